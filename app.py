@@ -1,11 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
+import atexit
+import json
 import threading
+import time
 import uuid
 import config
 from device.devices import Refrigerator, Light, Lock, Camera
-import random
-import time
+from device.fleet import Fleet
+from device.heartbeat import HeartbeatScheduler
+from device.simulation import FleetSimulator, parse_rates
+from device.trace import TraceRecorder, TraceReplayer
+from device import http_client, metrics, resilience, ssdp
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from device.clock import get_clock
+from device.wire import DeltaCodec
 from device.base_device import BaseDevice
+from device.actions import ActionError
 
 app = Flask(__name__)
 
@@ -17,7 +27,15 @@ DEVICE_MAPPING = {
     'camera': Camera
 }
 
+metrics.bind_actions(DEVICE_MAPPING.values())
+metrics.set_sources(devices=lambda: [d for d in hosted_devices() if d], responder=ssdp.get_responder,
+                    resilience=resilience.get_resilience)
+
 device:BaseDevice = None
+fleet:Fleet = None
+heartbeat_scheduler:HeartbeatScheduler = None
+trace_recorder:TraceRecorder = None
+trace_replayer:TraceReplayer = None
 controller_url_set = threading.Event()
 
 @app.route('/set_controller_url', methods=['POST'])
@@ -42,82 +60,78 @@ def init_device():
     else:
         raise ValueError(f"不支持的设备类型: {config.DEVICE_TYPE}")
 
+def init_fleet():
+    """设备群模式：在当前进程中创建全部设备"""
+    global device, fleet
+    fleet = Fleet(DEVICE_MAPPING, config.HOST, config.PORT).populate(config.FLEET)
+    if not len(fleet):
+        raise ValueError(f"设备组合为空: {config.FLEET}")
+    # 第一个设备作为主设备，响应 /query 和 /control
+    device = next(iter(fleet))
+    # 全部设备共用一个 SSDP 应答器，location 指向各自的设备接口
+    for hosted in fleet:
+        hosted.start_ssdp_service(f"http://{config.HOST}:{config.PORT}/devices/{hosted.device_id}")
+    stats = fleet.stats()
+    print(f"设备群已初始化，设备数: {stats['device_count']}，"
+          f"启动耗时: {stats['startup_seconds']}秒，"
+          f"每设备内存: {stats['rss_bytes_per_device']}字节")
+
+def hosted_devices():
+    """当前进程托管的全部设备"""
+    return list(fleet) if fleet else [device]
+
 def generate_random_events():
-    """生成随机事件"""
+    """批量生成随机事件"""
+    simulator = FleetSimulator(hosted_devices(), rates=parse_rates(config.SIM_RATES))
     while True:
-        if isinstance(device, Refrigerator):
-            # 随机开关冰箱门
-            if random.random() < 0.003:  # 0.3%的概率触发
-                device.door_open = not device.door_open
-                device.add_event(
-                    "door_state_change",
-                    {"door_open": device.door_open}
-                )
-                
-            # 随机温度变化
-            if random.random() < 0.003:  # 0.3%的概率触发
-                temp_change = random.uniform(-1, 1)
-                device.temperature += temp_change
-                # 限制温度范围
-                device.temperature = max(-20, min(10, device.temperature))
-                device.add_event("temperature_change", {"temperature": round(device.temperature, 1)})
-        
-        elif isinstance(device, Light):
-            # 随机调节亮度
-            if random.random() < 0.003:  # 0.3%的概率触发
-                new_brightness = random.randint(0, 100)
-                device.control("set_brightness", {"brightness": new_brightness})
-        
-        elif isinstance(device, Lock):
-            # 随机锁定/解锁
-            if random.random() < 0.003:  # 0.3%的概率触发
-                current_state = device.locked
-                new_state = "unlock" if current_state else "lock"
-                device.control("set_lock", {"state": new_state})
-            
-            # 随机电池电量变化
-            if random.random() < 0.003:  # 0.3%的概率触发
-                device.battery = max(0, device.battery - random.uniform(0.1, 0.5))
-                device.add_event("battery_level", {"battery": round(device.battery, 1)})
-        
-        elif isinstance(device, Camera):
-            # 随机开始/停止录制
-            if random.random() < 0.003:  # 0.3%的概率触发
-                current_state = device.recording
-                new_state = "stop" if current_state else "start"
-                device.control("set_recording", {"state": new_state})
-            # 随机切换分辨率
-            elif random.random() < 0.003:  # 0.3%的概率触发
-                resolutions = ["720p", "1080p", "4k"]
-                new_resolution = random.choice(resolutions)
-                device.control("set_resolution", {"resolution": new_resolution})
-
-        # # 随机设备状态错误模拟
-        # if random.random() < 0.05:  # 5%的概率触发
-        #     if device.status == "online":
-        #         device.status = "error"
-        #         print(f"设备状态变为错误: {device.status}")
-        #     else:
-        #         device.status = "online"
-        #         print(f"设备状态恢复正常: {device.status}")
-
-        # 随机等待5-15秒
-        time.sleep(random.uniform(5, 15))
-
-@app.route('/query', methods=['POST'])
-def query():
-    if not request.is_json:
-        return jsonify({"error": "需要JSON格式的请求"}), 400
-    
-    keys = request.json.get('keys', [])
-    if not isinstance(keys, list):
-        return jsonify({"error": "keys必须是列表"}), 400
+        simulator.tick()
+        get_clock().sleep(config.SIM_TICK_INTERVAL)
 
-    info = device.get_info(keys)
-    return jsonify(info)
+def replay_trace():
+    """把轨迹文件回放到当前进程托管的设备"""
+    global trace_replayer
+    trace_replayer = TraceReplayer(config.TRACE_REPLAY, hosted_devices(),
+                                   speed=config.TRACE_SPEED, loop=config.TRACE_LOOP)
+    applied = trace_replayer.run()
+    print(f"轨迹回放结束，执行记录数: {applied}，统计: {trace_replayer.stats()}")
 
-@app.route('/control', methods=['POST'])
-def control():
+def find_device(device_id):
+    """按设备ID查找当前进程托管的设备"""
+    if not isinstance(device_id, str):
+        return None
+    if fleet:
+        return fleet.get(device_id)
+    if device and device.device_id == device_id:
+        return device
+    return None
+
+def handle_query(target):
+    """查询设备状态，keys 为空（或GET请求）时返回带 ETag 的完整快照"""
+    started = time.perf_counter()
+    keys = []
+    if request.method == 'POST':
+        if not request.is_json:
+            return jsonify({"error": "需要JSON格式的请求"}), 400
+        keys = request.json.get('keys', [])
+        if not isinstance(keys, list):
+            return jsonify({"error": "keys必须是列表"}), 400
+
+    if keys:
+        response = jsonify(target.get_info(keys))
+        metrics.QUERY_KEYS.observe(time.perf_counter() - started)
+        return response
+
+    # 完整快照：状态未变化时直接返回304，不做序列化
+    etag = target.etag
+    headers = {"ETag": etag, "X-State-Version": str(target.version)}
+    if etag in request.headers.get('If-None-Match', ''):
+        metrics.QUERY_NOT_MODIFIED.observe(time.perf_counter() - started)
+        return Response(status=304, headers=headers)
+    response = Response(target.snapshot_json(), mimetype='application/json', headers=headers)
+    metrics.QUERY_SNAPSHOT.observe(time.perf_counter() - started)
+    return response
+
+def handle_control(target):
     if not request.is_json:
         return jsonify({"error": "需要JSON格式的请求"}), 400
 
@@ -127,20 +141,249 @@ def control():
     if not action:
         return jsonify({"error": "缺少action参数"}), 400
 
-    success = device.control(action, params)
+    started = time.perf_counter()
+    success = target.control(action, params)
+    metrics.control_latency(action).observe(time.perf_counter() - started)
     return jsonify({"success": success})
 
+@app.route('/query', methods=['GET', 'POST'])
+def query():
+    return handle_query(device)
+
+@app.route('/control', methods=['POST'])
+def control():
+    return handle_control(device)
+
+def broadcast_targets(target):
+    """按设备类型和标签选出广播的目标设备"""
+    device_type = target.get('device_type')
+    tag = target.get('tag')
+    return [d for d in hosted_devices()
+            if (not device_type or d.device_type == device_type) and (not tag or tag in d.tags)]
+
+@app.route('/control/batch', methods=['POST'])
+def control_batch():
+    """批量控制
+
+    请求体为 {"commands": [{"device_id", "action", "params"}, ...]}，
+    或广播形式 {"target": {"device_type", "tag"}, "action", "params"}；
+    "atomic": true 时先校验全部命令，有任何无效命令则一条都不执行。
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "需要JSON格式的请求"}), 400
+    atomic = bool(body.get('atomic'))
+
+    if 'commands' in body:
+        commands = body['commands']
+        if not isinstance(commands, list):
+            return jsonify({"error": "commands必须是列表"}), 400
+        items = []
+        for command in commands:
+            if not isinstance(command, dict):
+                items.append((None, None, None, None))
+                continue
+            device_id = command.get('device_id')
+            items.append((device_id, find_device(device_id) if device_id else device,
+                          command.get('action'), command.get('params', {})))
+    elif 'target' in body:
+        if not isinstance(body['target'], dict) or not body.get('action'):
+            return jsonify({"error": "广播需要target对象和action参数"}), 400
+        if not all(isinstance(body['target'].get(k), (str, type(None))) for k in ('device_type', 'tag')):
+            return jsonify({"error": "device_type和tag必须是字符串"}), 400
+        items = [(d.device_id, d, body['action'], body.get('params', {}))
+                 for d in broadcast_targets(body['target'])]
+    else:
+        return jsonify({"error": "缺少commands或target参数"}), 400
+
+    # 第一阶段：查找设备并校验参数，单条命令无效不影响其它命令
+    calls = []
+    results = []
+    for device_id, target, action, params in items:
+        result = {"device_id": device_id, "action": action, "success": True}
+        call = None
+        try:
+            if target is None:
+                raise ActionError("设备不存在" if device_id else "命令格式错误")
+            call = target.prepare(action, params)
+        except ActionError as e:
+            result.update(success=False, error=str(e))
+        calls.append(call)
+        results.append(result)
+
+    invalid = sum(1 for call in calls if call is None)
+    if atomic and invalid:
+        for result in results:
+            if result["success"]:
+                result.update(success=False, error="未执行：批量中有无效命令")
+        return jsonify({"applied": False, "succeeded": 0, "failed": len(results), "results": results}), 409
+
+    # 第二阶段：执行已通过校验的命令
+    for (_, target, action, _), call, result in zip(items, calls, results):
+        if call is None:
+            continue
+        method, kwargs = call
+        started = time.perf_counter()
+        try:
+            target.run(action, method, kwargs)
+        except Exception as e:
+            result.update(success=False, error=str(e))
+        metrics.control_latency(result["action"]).observe(time.perf_counter() - started)
+    failed = sum(1 for result in results if not result["success"])
+    return jsonify({"applied": True, "succeeded": len(results) - failed, "failed": failed, "results": results})
+
+@app.route('/devices', methods=['GET'])
+def list_devices():
+    """列出当前进程托管的全部设备"""
+    return jsonify([
+        {"device_id": d.device_id, "device_type": d.device_type, "status": d.status, "tags": list(d.tags)}
+        for d in hosted_devices()
+    ])
+
+@app.route('/devices/query', methods=['POST'])
+def batch_query():
+    """一次查询多个设备的完整快照
+
+    请求体：{"device_ids": [...], "versions": {设备ID: 版本号}}，不传 device_ids 时查询全部设备；
+    versions 中版本号未变化的设备不返回快照，只列在 unchanged 中。
+    """
+    started = time.perf_counter()
+    body = request.get_json(silent=True) or {}
+    device_ids = body.get('device_ids')
+    versions = body.get('versions') or {}
+    if device_ids is not None and not isinstance(device_ids, list):
+        return jsonify({"error": "device_ids必须是列表"}), 400
+    if not isinstance(versions, dict):
+        return jsonify({"error": "versions必须是对象"}), 400
+
+    targets = hosted_devices() if device_ids is None else [find_device(str(i)) for i in device_ids]
+    snapshots = []
+    unchanged = []
+    missing = []
+    for i, target in enumerate(targets):
+        if target is None:
+            missing.append(device_ids[i])
+        elif versions.get(target.device_id) == target.version:
+            unchanged.append(target.device_id)
+        else:
+            # 快照按版本缓存了序列化结果，直接拼接
+            snapshots.append('%s:{"version":%d,"state":%s}' % (
+                json.dumps(target.device_id), target.version, target.snapshot_json()))
+    body = '{"devices":{%s},"unchanged":%s,"missing":%s}' % (
+        ",".join(snapshots), json.dumps(unchanged), json.dumps(missing))
+    metrics.QUERY_BATCH.observe(time.perf_counter() - started)
+    return Response(body, mimetype='application/json')
+
+@app.route('/devices/<device_id>', methods=['GET'])
+def device_detail(device_id):
+    """SSDP location 指向的设备描述"""
+    target = find_device(device_id)
+    if not target:
+        return jsonify({"error": "设备不存在"}), 404
+    return jsonify({"device_id": target.device_id, "device_type": target.device_type,
+                    "status": target.status, "last_update": target.last_update})
+
+@app.route('/devices/<device_id>/query', methods=['GET', 'POST'])
+def device_query(device_id):
+    target = find_device(device_id)
+    if not target:
+        return jsonify({"error": "设备不存在"}), 404
+    return handle_query(target)
+
+@app.route('/devices/<device_id>/control', methods=['POST'])
+def device_control(device_id):
+    target = find_device(device_id)
+    if not target:
+        return jsonify({"error": "设备不存在"}), 404
+    return handle_control(target)
+
+@app.route('/heartbeat/stats', methods=['GET'])
+def heartbeat_stats():
+    """心跳连接池统计：命中/未命中、在途请求数"""
+    return jsonify(http_client.get_client().stats())
+
+@app.route('/heartbeat/resilience', methods=['GET'])
+def heartbeat_resilience():
+    """各控制器地址的熔断状态、重试数、缓冲区深度、丢弃数和回放数"""
+    return jsonify(resilience.get_resilience().stats())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 指标"""
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/ssdp/stats', methods=['GET'])
+def ssdp_stats():
+    """SSDP 应答器统计：注册设备数、应答数、通告数"""
+    return jsonify(ssdp.get_responder().stats())
+
+@app.route('/fleet', methods=['GET'])
+def fleet_stats():
+    """设备群统计：设备数量、启动耗时、每设备内存"""
+    if not fleet:
+        return jsonify({"error": "未启用设备群模式"}), 404
+    return jsonify(fleet.stats())
+
+@app.route('/trace', methods=['GET'])
+def trace_stats():
+    """轨迹记录和回放的统计"""
+    if not trace_recorder and not trace_replayer:
+        return jsonify({"error": "未启用轨迹记录或回放"}), 404
+    return jsonify({
+        "recorder": trace_recorder.stats() if trace_recorder else None,
+        "replayer": trace_replayer.stats() if trace_replayer else None
+    })
+
 if __name__ == '__main__':
-    init_device()
+    http_client.configure(
+        pool_size=config.HEARTBEAT_POOL_SIZE,
+        connect_timeout=config.HEARTBEAT_CONNECT_TIMEOUT,
+        read_timeout=config.HEARTBEAT_READ_TIMEOUT,
+        max_in_flight=config.HEARTBEAT_MAX_IN_FLIGHT
+    )
+    resilience.configure(
+        retry_base=config.HEARTBEAT_RETRY_BASE,
+        retry_max=config.HEARTBEAT_RETRY_MAX,
+        failure_threshold=config.HEARTBEAT_BREAKER_THRESHOLD,
+        reset_timeout=config.HEARTBEAT_BREAKER_RESET,
+        spool_size=config.HEARTBEAT_SPOOL_SIZE,
+        replay_batch=config.HEARTBEAT_REPLAY_BATCH,
+        replay_rate=config.HEARTBEAT_REPLAY_RATE
+    )
+    ssdp.configure(
+        port=config.SSDP_PORT,
+        max_age=config.SSDP_MAX_AGE,
+        notify_interval=config.SSDP_NOTIFY_INTERVAL,
+        notify_batch=config.SSDP_NOTIFY_BATCH
+    )
+    if config.FLEET:
+        init_fleet()
+    else:
+        init_device()
+    if config.TRACE_RECORD:
+        trace_recorder = TraceRecorder(config.TRACE_RECORD).start(hosted_devices())
+        atexit.register(trace_recorder.close)
     
-    # 启动随机事件生成器线程
-    event_thread = threading.Thread(target=generate_random_events)
+    # 启动随机事件生成器线程，指定了轨迹文件时改为回放轨迹
+    event_thread = threading.Thread(target=replay_trace if config.TRACE_REPLAY else generate_random_events)
     event_thread.daemon = True
     event_thread.start()
     
     def wait_and_start_heartbeat():
+        global heartbeat_scheduler
         controller_url_set.wait()
-        device.start_heartbeat(config.CONTROLLER_URL, config.HEARTBEAT_INTERVAL)
+        if config.HEARTBEAT_MODE == 'async':
+            heartbeat_scheduler = HeartbeatScheduler(
+                batch_window=config.HEARTBEAT_BATCH_WINDOW,
+                batch_size=config.HEARTBEAT_BATCH_SIZE,
+                wire_format=config.HEARTBEAT_FORMAT,
+                codec=DeltaCodec(snapshot_every=config.HEARTBEAT_SNAPSHOT_EVERY,
+                                 compress=config.HEARTBEAT_COMPRESS)
+            )
+            heartbeat_scheduler.start()
+        for hosted in hosted_devices():
+            hosted.start_heartbeat(config.CONTROLLER_URL, config.HEARTBEAT_INTERVAL,
+                                   scheduler=heartbeat_scheduler)
         print(f"已设置CONTROLLER_URL，开始心跳，状态: {device.status}")
 
     heartbeat_thread = threading.Thread(target=wait_and_start_heartbeat)
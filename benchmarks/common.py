@@ -0,0 +1,56 @@
+"""压测脚本共用的工具函数"""
+import importlib.util
+import logging
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTROLLER_DIR = os.path.join(ROOT, 'controller')
+sys.path.insert(0, ROOT)
+
+from werkzeug.serving import make_server
+
+from device.devices import Refrigerator, Light, Lock, Camera
+
+DEVICE_MAPPING = {
+    'refrigerator': Refrigerator,
+    'light': Light,
+    'lock': Lock,
+    'camera': Camera
+}
+
+
+def load_controller():
+    """以独立模块名加载 controller/app.py，避免与根目录的 app.py 冲突"""
+    if CONTROLLER_DIR not in sys.path:
+        sys.path.append(CONTROLLER_DIR)
+    spec = importlib.util.spec_from_file_location('controller_app', os.path.join(CONTROLLER_DIR, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_device_app():
+    """以独立模块名加载根目录的 app.py（设备端），不执行其启动逻辑"""
+    spec = importlib.util.spec_from_file_location('device_app', os.path.join(ROOT, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def serve_in_background(wsgi_app):
+    """在后台线程中用多线程服务器运行 WSGI 应用，返回 (地址, 服务器)"""
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def start_local_controller():
+    """在后台线程中启动 controller/app.py，返回 (地址, 服务器)"""
+    return serve_in_background(load_controller().app)
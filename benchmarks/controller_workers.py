@@ -0,0 +1,79 @@
+"""对比不同 worker 数下控制器的心跳接收吞吐量（心跳/秒）
+
+每个 worker 数各启动一个全新的 controller/app.py（WORKERS=N），由多个客户端进程并发发送
+逐个心跳请求，避免客户端自身成为瓶颈：
+
+    python benchmarks/controller_workers.py --workers 1,2,4 --mix "4000 lights" --clients 4
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+
+from common import DEVICE_MAPPING
+from device.fleet import Fleet
+from heartbeat_batch import measure, send_single
+from run import controller_process
+
+
+def client_process(url, mix, rounds, start, results):
+    """一个客户端进程：创建自己的设备并发送心跳，等到统一的开始时间再发送"""
+    devices = list(Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(mix))
+    time.sleep(max(0.0, start - time.time()))
+    results.put(asyncio.run(measure('single', lambda c: send_single(c, url, devices, rounds))))
+
+
+def run_workers(workers, args):
+    with controller_process({'WORKERS': str(workers)}) as (url, _):
+        results = multiprocessing.Queue()
+        start = time.time() + 2
+        clients = [multiprocessing.Process(target=client_process, args=(url, args.mix, args.rounds, start, results))
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        parts = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    # 各客户端同时开始，以最慢的客户端计算总吞吐量
+    heartbeats = sum(p['heartbeats'] for p in parts)
+    seconds = max(p['seconds'] for p in parts)
+    return {
+        "workers": workers,
+        "clients": args.clients,
+        "heartbeats": heartbeats,
+        "failures": sum(p['failures'] for p in parts),
+        "seconds": seconds,
+        "heartbeats_per_second": round(heartbeats / seconds, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default=f"1,{os.cpu_count()}", help='逗号分隔的 worker 数')
+    parser.add_argument('--mix', default='1000 lights', help='每个客户端进程的设备组合')
+    parser.add_argument('--clients', type=int, default=os.cpu_count(), help='客户端进程数')
+    parser.add_argument('--rounds', type=int, default=3, help='每个设备发送的心跳轮数')
+    parser.add_argument('--json', help='把结果写入该JSON文件')
+    args = parser.parse_args()
+
+    results = []
+    for workers in sorted({int(w) for w in args.workers.split(',')}):
+        result = run_workers(workers, args)
+        results.append(result)
+        print(f"{workers:>3} 个 worker: {result['heartbeats']} 个心跳，{result['seconds']} 秒，"
+              f"{result['heartbeats_per_second']} 心跳/秒，失败 {result['failures']}")
+    base = results[0]['heartbeats_per_second']
+    for result in results[1:]:
+        print(f"{result['workers']} 个 worker / {results[0]['workers']} 个 worker 吞吐量比: "
+              f"{result['heartbeats_per_second'] / base:.2f}x")
+    print(f"CPU 核数: {os.cpu_count()}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"mix": args.mix, "rounds": args.rounds, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""设备群汇总的增量维护：与全量重算对比校验，并测量 /fleet/summary 的耗时随设备数的变化
+
+每个设备数各加载一个全新的 controller/app.py，按轮推进随机行为模拟（开关门、开关锁、录制等），
+以批量心跳发送每轮全部设备的心跳，并让一部分设备心跳超时（按 --policy 移除或标记为 offline）。
+每轮之后调用 /fleet/summary/verify，增量结果与遍历设备表的全量重算不一致时返回非零退出码。
+最后对比 /fleet/summary 与需要遍历全部设备的 /devices 的请求耗时：
+
+    python benchmarks/fleet_summary.py --sizes 1000,10000,50000 --rounds 5 --policy mark
+
+压测前先运行一个确定性的校验：按固定顺序发送心跳（包括只在部分心跳中上报的电量、存储和录制状态）
+并让设备超时（先标记为 offline，再移除），每一步核对汇总的取值并要求 verify 没有不一致；最后篡改
+一个设备的增量状态，要求 verify 能发现。只运行该校验：
+
+    python benchmarks/fleet_summary.py --check-only
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+
+from common import DEVICE_MAPPING, load_controller
+from device.fleet import Fleet
+from device.simulation import FleetSimulator
+
+RATES = {"door_toggle": 0.05, "brightness_change": 0.05, "lock_toggle": 0.05, "recording_toggle": 0.05}
+# 各类型设备在总数中的比例
+MIX = (("lights", 0.5), ("locks", 0.2), ("refrigerators", 0.15), ("cameras", 0.15))
+
+
+def fleet_mix(size):
+    return ", ".join(f"{max(1, int(size * share))} {name}" for name, share in MIX)
+
+
+def heartbeat(device_id, device_type, power, **events):
+    return {"device_id": device_id, "device_type": device_type, "status": "online",
+            "data": {"current_power_consumption": power, **events}}
+
+
+def deterministic_check():
+    """按固定的心跳和超时序列校验增量汇总，返回失败说明的列表"""
+    controller = load_controller()
+    client = controller.app.test_client()
+    failures = []
+
+    def step(name, batch, expect):
+        if batch:
+            client.post('/heartbeat/batch', json=batch)
+        result = client.get('/fleet/summary/verify').json
+        if not result['ok']:
+            failures.append(f"{name}: verify 不一致 {result['mismatches']}")
+        summary = client.get('/fleet/summary').json
+        for path, expected in expect.items():
+            value = summary
+            for key in path.split('.'):
+                value = value.get(key) if isinstance(value, dict) else None
+            if value != expected:
+                failures.append(f"{name}: {path} 为 {value}，应为 {expected}")
+
+    def expire(device_id, policy):
+        controller.DEVICE_OFFLINE_POLICY = policy
+        controller.liveness.touch(device_id, now=time.monotonic() - controller.DEVICE_TIMEOUT - 1)
+        controller.expire_devices()
+
+    step("首轮心跳", [
+        heartbeat("lock-1", "lock", 5.0, battery_level={"battery": 95}),
+        heartbeat("lock-2", "lock", 5.0),
+        heartbeat("camera-1", "camera", 25.0, camera_state={"camera_state": "recording"},
+                  storage_usage={"storage_used_mb": 10.0}),
+        heartbeat("light-1", "light", 8.0),
+    ], {"devices": 4, "power.total": 43.0, "locks.battery_histogram.90-100": 1, "locks.battery_unknown": 1,
+        "cameras.recording": 1, "cameras.storage_used_mb": 10.0})
+    step("未上报的事件沿用上次的值", [
+        heartbeat("lock-1", "lock", 4.0),
+        heartbeat("camera-1", "camera", 15.0, storage_usage={"storage_used_mb": 20.0}),
+    ], {"power.total": 32.0, "locks.battery_histogram.90-100": 1, "cameras.recording": 1,
+        "cameras.storage_used_mb": 20.0})
+    step("电量变化和停止录制", [
+        heartbeat("lock-1", "lock", 4.0, battery_level={"battery": 42}),
+        heartbeat("camera-1", "camera", 15.0, camera_state={"camera_state": "standby"}),
+    ], {"locks.battery_histogram.90-100": 0, "locks.battery_histogram.40-49": 1, "cameras.recording": 0})
+    expire("light-1", "mark")
+    step("超时标记为 offline", [], {"devices": 4, "by_status.offline": 1, "power.total": 24.0})
+    expire("camera-1", "evict")
+    step("超时移除", [], {"devices": 3, "cameras.storage_used_mb": 0.0, "power.total": 9.0})
+    step("移除后重新上线", [heartbeat("camera-1", "camera", 15.0)],
+         {"devices": 4, "cameras.storage_used_mb": 0.0, "cameras.recording": 0})
+
+    # 篡改增量状态（电量和直方图一起改，自洽但与上报的值不符），verify 必须发现
+    aggregates = controller.fleet_aggregates
+    row = aggregates._rows["lock-1"]
+    aggregates._apply(row, -1)
+    row.battery = 5
+    aggregates._apply(row, 1)
+    if not client.get('/fleet/summary/verify').json['mismatches']:
+        failures.append("篡改门锁电量后 verify 没有发现不一致")
+    return failures
+
+
+def request_seconds(client, path, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        response = client.get(path)
+    elapsed = (time.perf_counter() - started) / repeat
+    assert response.status_code == 200, response.status_code
+    return elapsed
+
+
+def run_size(size, args, rng):
+    controller = load_controller()
+    client = controller.app.test_client()
+    devices = list(Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(fleet_mix(size)))
+    simulator = FleetSimulator(devices, rates=RATES, seed=rng.randrange(1 << 30))
+    for device in devices:
+        device.status = "online"
+
+    failures = []
+    expired = 0
+    for round_index in range(args.rounds):
+        simulator.tick()
+        heartbeats = []
+        for device in devices:
+            heartbeats.append(device._build_heartbeat())
+            device.events.commit()
+        for i in range(0, len(heartbeats), args.batch_size):
+            client.post('/heartbeat/batch', json=heartbeats[i:i + args.batch_size])
+        # 一部分设备的截止时间改到过去，由过期检查移除或标记为 offline
+        stale = rng.sample(devices, int(len(devices) * args.expire))
+        past = time.monotonic() - controller.DEVICE_TIMEOUT - 1
+        for device in stale:
+            controller.liveness.touch(device.device_id, now=past)
+        expired += len(controller.expire_devices())
+
+        result = client.get('/fleet/summary/verify').json
+        if not result['ok']:
+            failures.append({"round": round_index, "mismatches": result['mismatches'][:10]})
+
+    summary = client.get('/fleet/summary').json
+    return {
+        "devices": size,
+        "tracked": summary['devices'],
+        "expired": expired,
+        "verified_rounds": args.rounds,
+        "failures": failures,
+        "summary_us": round(request_seconds(client, '/fleet/summary', args.repeat) * 1e6, 1),
+        "devices_list_us": round(request_seconds(client, '/devices', max(1, args.repeat // 10)) * 1e6, 1),
+        "power_total": summary['power']['total'],
+        "cameras_recording": summary['cameras']['recording']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,30000', help='逗号分隔的设备数')
+    parser.add_argument('--rounds', type=int, default=5, help='每个设备数下的心跳轮数')
+    parser.add_argument('--expire', type=float, default=0.02, help='每轮心跳超时的设备比例')
+    parser.add_argument('--policy', choices=('evict', 'mark'), default='evict', help='心跳超时设备的处理方式')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200, help='测量请求耗时的请求次数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='把结果写入该JSON文件')
+    parser.add_argument('--check-only', action='store_true', help='只运行确定性校验')
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        failures = deterministic_check()
+    print("确定性校验: " + ("通过" if not failures else f"{len(failures)} 项失败"))
+    for failure in failures:
+        print(f"  {failure}")
+    if failures:
+        sys.exit(1)
+    if args.check_only:
+        return
+
+    os.environ['DEVICE_OFFLINE_POLICY'] = args.policy
+    rng = random.Random(args.seed)
+    results = []
+    for size in sorted({int(s) for s in args.sizes.split(',')}):
+        # 控制器和设备会打印心跳，测量期间丢弃控制台输出
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = run_size(size, args, rng)
+        results.append(result)
+        status = "一致" if not result['failures'] else f"{len(result['failures'])} 轮不一致"
+        print(f"{size:>7} 个设备: 校验 {result['verified_rounds']} 轮{status}，超时 {result['expired']} 个，"
+              f"/fleet/summary {result['summary_us']} 微秒，/devices {result['devices_list_us']} 微秒")
+        for failure in result['failures']:
+            print(f"  第 {failure['round']} 轮: {failure['mismatches']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"policy": args.policy, "results": results}, f, indent=2)
+    if any(result['failures'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""对比逐个心跳与批量心跳两条路径的控制器吞吐量（心跳/秒）
+
+默认在本机启动 controller/app.py，也可以用 --url 指向已运行的控制器：
+
+    python benchmarks/heartbeat_batch.py --mix "2000 lights, 500 locks" --rounds 3
+    python benchmarks/heartbeat_batch.py --url http://localhost:8000 --batch-size 500
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+from common import DEVICE_MAPPING, start_local_controller
+from device.fleet import Fleet
+from device.http_client import HeartbeatClient
+
+
+async def send_single(client, url, devices, rounds):
+    endpoint = f"{url}/api/v1/devices/heartbeat/"
+    for _ in range(rounds):
+        await asyncio.gather(*(client.post_async(endpoint, d._build_heartbeat()) for d in devices))
+    return len(devices) * rounds
+
+
+async def send_batch(client, url, devices, rounds, batch_size):
+    endpoint = f"{url}/api/v1/devices/heartbeat/batch/"
+    for _ in range(rounds):
+        heartbeats = [d._build_heartbeat() for d in devices]
+        chunks = [heartbeats[i:i + batch_size] for i in range(0, len(heartbeats), batch_size)]
+        await asyncio.gather(*(client.post_async(endpoint, chunk) for chunk in chunks))
+    return len(devices) * rounds
+
+
+async def measure(name, coro_factory):
+    client = HeartbeatClient(pool_size=32, max_in_flight=64)
+    try:
+        started = time.perf_counter()
+        count = await coro_factory(client)
+        elapsed = time.perf_counter() - started
+    finally:
+        await client.close_async()
+    stats = client.stats()
+    return {
+        "path": name,
+        "heartbeats": count,
+        "requests": stats["requests"],
+        "failures": stats["failures"],
+        "seconds": round(elapsed, 3),
+        "heartbeats_per_second": round(count / elapsed, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='控制器地址，不指定时在本机启动 controller/app.py')
+    parser.add_argument('--mix', default='1000 lights, 500 locks, 250 cameras, 250 refrigerators')
+    parser.add_argument('--rounds', type=int, default=3, help='每个设备发送的心跳轮数')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--json', help='把结果写入该JSON文件')
+    args = parser.parse_args()
+
+    devices = list(Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(args.mix))
+    server = None
+    url = args.url
+    if not url:
+        url, server = start_local_controller()
+
+    # 控制器会打印每个心跳，压测期间丢弃控制台输出
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = [
+            asyncio.run(measure('single', lambda c: send_single(c, url, devices, args.rounds))),
+            asyncio.run(measure('batch', lambda c: send_batch(c, url, devices, args.rounds, args.batch_size)))
+        ]
+    if server:
+        server.shutdown()
+
+    for r in results:
+        print(f"{r['path']:>6}: {r['heartbeats']} 个心跳，{r['requests']} 个请求，"
+              f"{r['seconds']} 秒，{r['heartbeats_per_second']} 心跳/秒，失败 {r['failures']}")
+    speedup = results[1]['heartbeats_per_second'] / results[0]['heartbeats_per_second']
+    print(f"批量/逐个 吞吐量比: {speedup:.1f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"mix": args.mix, "batch_size": args.batch_size, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
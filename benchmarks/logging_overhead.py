@@ -0,0 +1,47 @@
+"""对比调试日志（逐条表格输出）与默认采样日志下控制器的心跳接收吞吐量
+
+每种日志配置各启动一个全新的 controller/app.py 子进程，用逐个心跳请求发送相同的负载：
+
+    python benchmarks/logging_overhead.py --mix "2000 lights, 500 locks" --rounds 3
+"""
+import argparse
+import asyncio
+import json
+
+from common import DEVICE_MAPPING
+from device.fleet import Fleet
+from heartbeat_batch import measure, send_single
+from run import controller_process
+
+# 日志配置名 -> 控制器环境变量
+MODES = {
+    'debug': {'LOG_DEBUG': 'true'},
+    'sampled': {'LOG_DEBUG': 'false'},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mix', default='1000 lights, 500 locks, 250 cameras, 250 refrigerators')
+    parser.add_argument('--rounds', type=int, default=3, help='每个设备发送的心跳轮数')
+    parser.add_argument('--json', help='把结果写入该JSON文件')
+    args = parser.parse_args()
+
+    devices = list(Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(args.mix))
+    results = []
+    for mode, env in MODES.items():
+        with controller_process(env) as (url, _):
+            result = asyncio.run(measure(mode, lambda c: send_single(c, url, devices, args.rounds)))
+        results.append(result)
+        print(f"{mode:>8}: {result['heartbeats']} 个心跳，{result['seconds']} 秒，"
+              f"{result['heartbeats_per_second']} 心跳/秒，失败 {result['failures']}")
+    ratio = results[1]['heartbeats_per_second'] / results[0]['heartbeats_per_second']
+    print(f"采样/调试 吞吐量比: {ratio:.2f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"mix": args.mix, "rounds": args.rounds, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
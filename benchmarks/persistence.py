@@ -0,0 +1,112 @@
+"""持久化日志的写入吞吐量、恢复时间，以及开启持久化后控制器心跳接收吞吐量的下降
+
+1. 直接向 EventLog 写入 --records 条心跳/事件记录（按设备数轮转），测量写入吞吐量和
+   从快照与日志恢复设备表的耗时
+2. 分别以不开启和开启 PERSIST_DIR 启动 controller/app.py，发送相同的心跳负载，
+   吞吐量下降超过 --max-overhead 时返回非零退出码
+
+    python benchmarks/persistence.py --records 10000000 --devices 10000
+    python benchmarks/persistence.py --skip-http --records 1000000
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from collections import deque
+
+from common import CONTROLLER_DIR, DEVICE_MAPPING
+from device.fleet import Fleet
+from heartbeat_batch import measure, send_single
+from run import controller_process
+
+sys.path.append(CONTROLLER_DIR)
+import wal  # noqa: E402
+
+# 每隔多少轮（每轮每个设备一条记录）写一轮事件，其余为心跳
+EVENT_EVERY = 10
+
+
+def write_records(directory, count, devices, fsync):
+    log = wal.EventLog(directory, fsync=fsync)
+    log.start()
+    now = time.time()
+    started = time.perf_counter()
+    for i in range(count):
+        device_id = f"device-{i % devices:06d}"
+        if (i // devices) % EVENT_EVERY:
+            log.append(wal.KIND_HEARTBEAT, now, {
+                "device_id": device_id, "device_type": "light", "status": "online",
+                "timestamp": "2024-03-20T10:30:00", "last_update": "2024-03-20T10:30:00",
+                "data": {"current_power_consumption": i % 100 / 10}
+            })
+        else:
+            log.append(wal.KIND_EVENT, now, {
+                "device_id": device_id, "device_type": "light", "event_type": "switch",
+                "event_data": {"state": "on"}, "timestamp": "2024-03-20T10:30:00"
+            })
+    log.close()
+    # 等待压缩线程完成，恢复时从最新快照开始
+    log.compact(log._segment - 1)
+    elapsed = time.perf_counter() - started
+    return log, elapsed
+
+
+def recover(directory, event_capacity):
+    """与控制器启动时相同的恢复过程：最新心跳写入设备表，事件只保留最近 event_capacity 个"""
+    log = wal.EventLog(directory)
+    devices = {}
+    events = deque(maxlen=event_capacity)
+    started = time.perf_counter()
+    for kind, t, payload in log.recover():
+        if kind == wal.KIND_HEARTBEAT:
+            devices[payload['device_id']] = payload
+        elif kind == wal.KIND_EVENT:
+            events.append((t, payload))
+    return log, time.perf_counter() - started, len(devices), len(events)
+
+
+def http_throughput(mix, rounds, env):
+    devices = list(Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(mix))
+    with controller_process(env) as (url, _):
+        return asyncio.run(measure('single', lambda c: send_single(c, url, devices, rounds)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--event-capacity', type=int, default=1000000)
+    parser.add_argument('--no-fsync', action='store_true', help='写入时不调用 fsync')
+    parser.add_argument('--skip-http', action='store_true', help='不测试控制器心跳接收吞吐量')
+    parser.add_argument('--mix', default='1000 lights, 500 locks')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--max-overhead', type=float, default=0.1,
+                        help='开启持久化后允许的吞吐量下降比例')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        log, elapsed = write_records(directory, args.records, args.devices, not args.no_fsync)
+        stats = log.stats()
+        print(f"写入: {args.records} 条记录，{elapsed:.2f} 秒，{args.records / elapsed:.0f} 条/秒，"
+              f"{stats['frames_written']} 帧，{stats['fsyncs']} 次 fsync，{stats['bytes_written'] / 2**20:.1f}MB，"
+              f"快照 {stats['snapshots']} 次")
+        log, elapsed, devices, events = recover(directory, args.event_capacity)
+        print(f"恢复: 读取 {log.recovered} 条记录（快照 + 未归并的段），{elapsed:.2f} 秒，"
+              f"设备 {devices} 个，事件 {events} 个")
+
+    if args.skip_http:
+        return
+    baseline = http_throughput(args.mix, args.rounds, {})
+    with tempfile.TemporaryDirectory() as directory:
+        persisted = http_throughput(args.mix, args.rounds, {'PERSIST_DIR': directory})
+    drop = 1 - persisted['heartbeats_per_second'] / baseline['heartbeats_per_second']
+    print(f"心跳接收: 内存 {baseline['heartbeats_per_second']} 心跳/秒，"
+          f"持久化 {persisted['heartbeats_per_second']} 心跳/秒，下降 {drop:.1%}")
+    if drop > args.max_overhead:
+        print(f"吞吐量下降超过 {args.max_overhead:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
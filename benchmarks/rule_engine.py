@@ -0,0 +1,149 @@
+"""规则数增加时规则引擎每条消息的评估开销
+
+按设备组合生成一组心跳和事件消息，分别装载不同数量的规则后用 RuleEngine.observe 评估同一组消息，
+输出每条消息的耗时和实际评估的条件数，并与逐条扫描全部规则的做法对比。规则中少数按设备类型
+限定（冰箱门持续打开、温度过高、门锁解锁、电量低等），其余按设备ID限定，模拟每户各自的规则：
+
+    python benchmarks/rule_engine.py --rules 10,100,1000,5000 --mix "5000 lights, 2000 locks, 2000 refrigerators, 1000 cameras"
+
+最多规则数下每条消息的耗时超过最少规则数的 --max-growth 倍时返回非零退出码。
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from common import CONTROLLER_DIR, DEVICE_MAPPING
+from device.fleet import parse_device_mix
+
+sys.path.append(CONTROLLER_DIR)
+import rules  # noqa: E402
+
+# 按设备类型限定的规则，数量固定，不随规则总数增加
+TYPE_RULES = [
+    {"device_type": "refrigerator", "event_type": "door_state_change", "field": "door_open", "value": True, "for": 120},
+    {"device_type": "refrigerator", "field": "temperature", "op": ">", "value": 8},
+    {"device_type": "lock", "event_type": "lock_state_change", "field": "lock_state", "value": "unlocked"},
+    {"device_type": "lock", "field": "battery", "op": "<", "value": 20},
+    {"device_type": "camera", "field": "camera_state", "value": "recording", "for": 3600},
+    {"device_type": "light", "field": "brightness", "op": ">=", "value": 90},
+    {"field": "status", "value": "offline"},
+    {"field": "current_power_consumption", "op": ">", "value": 200},
+]
+
+# 各设备类型的事件：(事件类型, 字段, 取值函数)
+EVENTS = {
+    "refrigerator": [("door_state_change", "door_open", lambda r: r.random() < 0.5),
+                     ("temperature_change", "temperature", lambda r: r.randint(-5, 10))],
+    "lock": [("lock_state_change", "lock_state", lambda r: r.choice(("locked", "unlocked"))),
+             ("battery_level", "battery", lambda r: r.randint(0, 100))],
+    "light": [("brightness_change", "brightness", lambda r: r.randint(0, 100)),
+              ("power_state_change", "power_state", lambda r: r.choice(("on", "off")))],
+    "camera": [("camera_state", "camera_state", lambda r: r.choice(("recording", "standby"))),
+               ("storage_usage", "storage_used", lambda r: r.randint(0, 10000))],
+}
+
+
+def fleet_devices(mix):
+    devices = []
+    for device_type, count, _ in parse_device_mix(mix, DEVICE_MAPPING):
+        devices.extend((f"{device_type}-{i:06d}", device_type) for i in range(len(devices), len(devices) + count))
+    return devices
+
+
+def make_messages(devices, count, rng):
+    """心跳状态消息，其中一半附带一个事件，格式为 observe 的参数"""
+    messages = []
+    while len(messages) < count:
+        device_id, device_type = rng.choice(devices)
+        messages.append((device_id, device_type, {
+            "status": "online", "current_power_consumption": rng.randint(0, 250)
+        }, None))
+        if rng.random() < 0.5:
+            event_type, field, value = rng.choice(EVENTS[device_type])
+            messages.append((device_id, device_type, {field: value(rng)}, event_type))
+    return messages[:count]
+
+
+def make_rules(devices, count, rng):
+    specs = [dict(spec, id=f"type-{i}") for i, spec in enumerate(TYPE_RULES[:count])]
+    for i in range(count - len(specs)):
+        device_id, device_type = rng.choice(devices)
+        event_type, field, value = rng.choice(EVENTS[device_type])
+        specs.append({"id": f"device-{i}", "device_id": device_id, "event_type": event_type,
+                      "field": field, "value": value(rng), "for": rng.choice((0, 60, 300))})
+    return [rules.Rule.from_dict(spec) for spec in specs]
+
+
+def run_indexed(rule_list, messages):
+    engine = rules.RuleEngine()
+    for rule in rule_list:
+        engine.add(rule)
+    started = time.perf_counter()
+    for device_id, device_type, fields, event_type in messages:
+        engine.observe(device_id, device_type, fields, event_type, now=0)
+    return time.perf_counter() - started, engine.stats()
+
+
+def run_linear(rule_list, messages):
+    """对照：每条消息逐条检查全部规则"""
+    started = time.perf_counter()
+    for device_id, device_type, fields, event_type in messages:
+        for rule in rule_list:
+            if rule.device_id is not None and rule.device_id != device_id:
+                continue
+            if rule.device_type is not None and rule.device_type != device_type:
+                continue
+            if rule.event_type is not None and rule.event_type != event_type:
+                continue
+            if rule.field in fields:
+                rule.test(fields[rule.field])
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', default='10,100,1000,5000,10000', help='逗号分隔的规则数')
+    parser.add_argument('--mix', default='5000 lights, 2000 locks, 2000 refrigerators, 1000 cameras')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--linear-messages', type=int, default=5000, help='逐条扫描对照使用的消息数')
+    parser.add_argument('--max-growth', type=float, default=1.5,
+                        help='最多规则数与最少规则数下每条消息耗时之比的上限')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='把结果写入该JSON文件')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    devices = fleet_devices(args.mix)
+    messages = make_messages(devices, args.messages, rng)
+    results = []
+    for count in sorted({int(c) for c in args.rules.split(',')}):
+        rule_list = make_rules(devices, count, rng)
+        seconds, stats = run_indexed(rule_list, messages)
+        linear = run_linear(rule_list, messages[:args.linear_messages])
+        result = {
+            "rules": count,
+            "messages": len(messages),
+            "us_per_message": round(seconds / len(messages) * 1e6, 3),
+            "evaluations_per_message": round(stats['evaluations'] / len(messages), 3),
+            "fired": stats['fired'],
+            "linear_us_per_message": round(linear / args.linear_messages * 1e6, 3)
+        }
+        results.append(result)
+        print(f"{count:>6} 条规则: {result['us_per_message']} 微秒/消息，"
+              f"评估 {result['evaluations_per_message']} 个条件/消息，触发 {result['fired']}；"
+              f"逐条扫描 {result['linear_us_per_message']} 微秒/消息")
+    growth = results[-1]['us_per_message'] / results[0]['us_per_message']
+    print(f"{results[-1]['rules']} 条 / {results[0]['rules']} 条规则 每条消息耗时比: {growth:.2f}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"mix": args.mix, "results": results}, f, indent=2)
+    if growth > args.max_growth:
+        print(f"每条消息耗时增长超过 {args.max_growth}x")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+"""设备到控制器流量的压测套件
+
+对每个 (设备数, 心跳间隔) 组合，在本机创建设备群并用异步心跳调度器向控制器发送心跳，
+同时通过设备端HTTP接口探测 /query 和 /control 的往返延迟，测量：
+
+- 控制器心跳接收吞吐量（心跳/秒）
+- 心跳端到端延迟 p50/p95/p99（从生成心跳到控制器确认）
+- /query、/control 往返延迟 p50/p95/p99
+- 每设备常驻内存
+- 每1000个心跳消耗的CPU时间（设备端进程；本机启动的控制器单独统计）
+
+默认每个组合都启动一个全新的 controller/app.py 子进程，也可以用 --url 指向已运行的控制器。
+结果写入JSON文件，传入 --baseline 时与之前的结果对比，有指标退化超过 --tolerance 时返回非零退出码：
+
+    python benchmarks/run.py --counts 100,1000,5000 --intervals 1,5 --duration 20
+    python benchmarks/run.py --counts 1000 --baseline benchmarks/results/run-20240320-103000.json
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import asyncio
+
+import requests
+
+from common import CONTROLLER_DIR, DEVICE_MAPPING, ROOT, load_device_app, serve_in_background
+from device.fleet import Fleet
+from device.heartbeat import HeartbeatScheduler
+from device.http_client import HeartbeatClient
+
+# 探测 /control 时各设备类型使用的命令
+CONTROL_SAMPLES = {
+    'refrigerator': lambda: ("set_temperature", {"temperature": random.randint(-5, 8)}),
+    'light': lambda: ("set_brightness", {"brightness": random.randint(0, 100)}),
+    'lock': lambda: ("set_lock", {"state": random.choice(["lock", "unlock"])}),
+    'camera': lambda: ("set_resolution", {"resolution": random.choice(["720p", "1080p", "4k"])}),
+}
+
+# 对比基线时检查的指标及其方向（1 表示越大越好，-1 表示越小越好）
+TRACKED_METRICS = {
+    "heartbeats_per_second": 1,
+    "heartbeat_latency_ms.p95": -1,
+    "query_latency_ms.p95": -1,
+    "control_latency_ms.p95": -1,
+    "rss_bytes_per_device": -1,
+    "cpu_ms_per_1k_heartbeats": -1,
+    "controller_cpu_ms_per_1k_heartbeats": -1,
+}
+
+
+class TimedClient(HeartbeatClient):
+    """记录每个心跳请求的延迟和确认的心跳数"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        self.acked = 0
+        self.recording = False
+
+    async def post_async(self, url, payload=None, data=None, headers=None):
+        started = time.perf_counter()
+        status, body = await super().post_async(url, payload=payload, data=data, headers=headers)
+        if self.recording and status < 300:
+            self.latencies.append(time.perf_counter() - started)
+            self.acked += len(payload) if isinstance(payload, list) else 1
+        return status, body
+
+    def reset(self):
+        self.latencies = []
+        self.acked = 0
+
+
+def percentiles(samples, scale=1000.0):
+    """返回 p50/p95/p99/max（默认换算为毫秒）"""
+    if not samples:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * scale, 3)
+    return {"count": len(ordered), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "max": round(ordered[-1] * scale, 3)}
+
+
+def process_cpu_seconds(pid):
+    """从 /proc 读取进程的 user+system CPU 时间，非 Linux 平台返回 None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def self_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def controller_process(env=None):
+    """启动一个全新的 controller/app.py 子进程，返回 (地址, pid)；env 为额外的环境变量"""
+    port = free_port()
+    env = dict(os.environ, **(env or {}), PORT=str(port), PYTHONUNBUFFERED='1')
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=CONTROLLER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                requests.get(f"{url}/devices", timeout=1)
+                break
+            except requests.RequestException:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("控制器启动失败")
+                time.sleep(0.1)
+        yield url, process.pid
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def build_mix(count, ratio):
+    """按比例把设备数分配到各设备类型，如 ratio="light=6,lock=2,camera=1,refrigerator=1" """
+    weights = {}
+    for item in ratio.split(','):
+        name, _, weight = item.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    total = sum(weights.values())
+    parts = []
+    remaining = count
+    names = list(weights)
+    for i, name in enumerate(names):
+        n = remaining if i == len(names) - 1 else int(count * weights[name] / total)
+        remaining -= n
+        if n:
+            parts.append(f"{n} {name}")
+    return ", ".join(parts)
+
+
+def probe_loop(device_url, devices, rate, stop, query_latencies, control_latencies, errors):
+    """以固定速率交替探测设备的 /query 和 /control"""
+    session = requests.Session()
+    period = 1.0 / rate
+    next_at = time.perf_counter()
+    turn = 0
+    while not stop.is_set():
+        device = random.choice(devices)
+        base = f"{device_url}/devices/{device.device_id}"
+        started = time.perf_counter()
+        try:
+            if turn % 2 == 0:
+                response = session.post(f"{base}/query", json={"keys": []}, timeout=5)
+                samples = query_latencies
+            else:
+                action, params = CONTROL_SAMPLES[device.device_type]()
+                response = session.post(f"{base}/control", json={"action": action, "params": params}, timeout=5)
+                samples = control_latencies
+            response.raise_for_status()
+            samples.append(time.perf_counter() - started)
+        except requests.RequestException:
+            errors.append(1)
+        turn += 1
+        next_at += period
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            stop.wait(delay)
+        else:
+            next_at = time.perf_counter()
+    session.close()
+
+
+def run_scenario(controller_url, controller_pid, device_app, count, interval, args):
+    """运行一个 (设备数, 心跳间隔) 组合，返回测量结果"""
+    gc.collect()
+    fleet = Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(build_mix(count, args.ratio), rng=random.Random(args.seed))
+    devices = list(fleet)
+    fleet_stats = fleet.stats()
+
+    # 设备端HTTP接口，用于探测 /query 和 /control
+    device_app.fleet = fleet
+    device_app.device = devices[0]
+    device_url, device_server = serve_in_background(device_app.app)
+
+    client = TimedClient(pool_size=args.pool_size, max_in_flight=args.max_in_flight)
+    scheduler = HeartbeatScheduler(client=client, batch_window=args.batch_window, batch_size=args.batch_size)
+    scheduler.start()
+    for device in devices:
+        device.start_heartbeat(controller_url, interval, scheduler=scheduler)
+
+    stop = threading.Event()
+    query_latencies, control_latencies, probe_errors = [], [], []
+    probe = threading.Thread(target=probe_loop, daemon=True, args=(
+        device_url, devices, args.probe_rate, stop, query_latencies, control_latencies, probe_errors))
+
+    # 预热一个心跳间隔，让全部设备的相位铺开
+    time.sleep(max(interval, 1))
+    client.reset()
+    client.recording = True
+    failures_before = client.stats()["failures"]
+    cpu_before = self_cpu_seconds()
+    controller_cpu_before = process_cpu_seconds(controller_pid) if controller_pid else None
+    probe.start()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    client.recording = False
+    cpu_used = self_cpu_seconds() - cpu_before
+    controller_cpu_used = None
+    if controller_cpu_before is not None:
+        controller_cpu_used = process_cpu_seconds(controller_pid) - controller_cpu_before
+    stop.set()
+    probe.join(timeout=10)
+
+    for device in devices:
+        device.stop_heartbeat()
+    scheduler.stop()
+    asyncio.run(client.close_async())
+    client.close()
+    device_server.shutdown()
+
+    acked = client.acked
+    per_1k = (lambda seconds: round(seconds * 1000 / acked * 1000, 3) if acked and seconds is not None else None)
+    return {
+        "devices": count,
+        "interval": interval,
+        "mix": build_mix(count, args.ratio),
+        "duration": round(elapsed, 3),
+        "heartbeats": acked,
+        "expected_heartbeats_per_second": round(count / interval, 1),
+        "heartbeats_per_second": round(acked / elapsed, 1),
+        "heartbeat_failures": client.stats()["failures"] - failures_before,
+        "heartbeat_latency_ms": percentiles(client.latencies),
+        "query_latency_ms": percentiles(query_latencies),
+        "control_latency_ms": percentiles(control_latencies),
+        "probe_errors": len(probe_errors),
+        "rss_bytes_per_device": fleet_stats["rss_bytes_per_device"],
+        "startup_seconds": fleet_stats["startup_seconds"],
+        "cpu_ms_per_1k_heartbeats": per_1k(cpu_used),
+        "controller_cpu_ms_per_1k_heartbeats": per_1k(controller_cpu_used),
+    }
+
+
+def metric(result, path):
+    value = result
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(results, baseline, tolerance):
+    """与基线对比，返回退化的指标列表"""
+    previous = {(r["devices"], r["interval"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get((result["devices"], result["interval"]))
+        if old is None:
+            continue
+        for path, direction in TRACKED_METRICS.items():
+            new_value, old_value = metric(result, path), metric(old, path)
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if change * direction < -tolerance:
+                regressions.append({
+                    "devices": result["devices"], "interval": result["interval"], "metric": path,
+                    "baseline": old_value, "current": new_value, "change": round(change, 3)
+                })
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_list(text, cast):
+    return [cast(item) for item in text.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='控制器地址，不指定时每个组合启动一个本机控制器子进程')
+    parser.add_argument('--counts', default='100,1000', help='设备数列表，逗号分隔')
+    parser.add_argument('--intervals', default='1,5', help='心跳间隔列表（秒），逗号分隔')
+    parser.add_argument('--duration', type=float, default=15, help='每个组合的测量时长（秒），不含预热')
+    parser.add_argument('--ratio', default='light=6,lock=2,camera=1,refrigerator=1', help='各设备类型的比例')
+    parser.add_argument('--batch-window', type=float, default=0, help='心跳批量合并窗口（秒），0表示逐个发送')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--pool-size', type=int, default=32)
+    parser.add_argument('--max-in-flight', type=int, default=200)
+    parser.add_argument('--probe-rate', type=float, default=20, help='每秒探测 /query 和 /control 的次数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果文件，默认 benchmarks/results/run-<时间>.json')
+    parser.add_argument('--baseline', help='与该结果文件对比')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='允许的指标退化比例')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    device_app = load_device_app()
+    results = []
+    for count in parse_list(args.counts, int):
+        for interval in parse_list(args.intervals, float):
+            print(f"设备数 {count}，心跳间隔 {interval} 秒 ...", flush=True)
+            # 控制器和设备端都会打印日志，压测期间丢弃控制台输出
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                if args.url:
+                    result = run_scenario(args.url, None, device_app, count, interval, args)
+                else:
+                    with controller_process() as (url, pid):
+                        result = run_scenario(url, pid, device_app, count, interval, args)
+            results.append(result)
+            print(f"  吞吐量 {result['heartbeats_per_second']}/{result['expected_heartbeats_per_second']} 心跳/秒，"
+                  f"心跳延迟 p50/p95/p99 {result['heartbeat_latency_ms']['p50']}/"
+                  f"{result['heartbeat_latency_ms']['p95']}/{result['heartbeat_latency_ms']['p99']} ms，"
+                  f"query p95 {result['query_latency_ms']['p95']} ms，control p95 {result['control_latency_ms']['p95']} ms，"
+                  f"每设备内存 {result['rss_bytes_per_device']} B，"
+                  f"CPU {result['cpu_ms_per_1k_heartbeats']} ms/千心跳"
+                  f"（控制器 {result['controller_cpu_ms_per_1k_heartbeats']}）")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "controller": args.url or "local",
+            "args": vars(args)
+        },
+        "results": results
+    }
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', time.strftime('run-%Y%m%d-%H%M%S.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        for r in regressions:
+            print(f"退化: 设备数 {r['devices']}，间隔 {r['interval']}，{r['metric']} "
+                  f"{r['baseline']} -> {r['current']}（{r['change']:+.1%}）")
+        if regressions:
+            exit_code = 1
+        else:
+            print("与基线相比没有超出容差的退化")
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"结果已写入 {output}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
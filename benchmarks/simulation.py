@@ -0,0 +1,34 @@
+"""测量批量模拟引擎每个周期的耗时
+
+    python benchmarks/simulation.py --mix "40000 lights, 30000 locks, 15000 cameras, 15000 refrigerators"
+"""
+import argparse
+import time
+
+from common import DEVICE_MAPPING
+from device.fleet import Fleet
+from device.simulation import FleetSimulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mix', default='40000 lights, 30000 locks, 15000 cameras, 15000 refrigerators')
+    parser.add_argument('--ticks', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fleet = Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(args.mix)
+    simulator = FleetSimulator(list(fleet), seed=args.seed)
+    durations = []
+    for _ in range(args.ticks):
+        started = time.perf_counter()
+        simulator.tick()
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    print(f"设备数: {len(fleet)}，周期数: {args.ticks}，事件数: {simulator.events_emitted}")
+    print(f"每周期耗时 中位数: {durations[len(durations) // 2] * 1000:.2f} ms，"
+          f"最大: {durations[-1] * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
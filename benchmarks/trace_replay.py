@@ -0,0 +1,116 @@
+"""轨迹记录与流式回放：回放结果与原设备群一致，回放内存与轨迹大小无关
+
+在虚拟时钟下推进随机行为模拟并把设备群的行为记录为轨迹，然后以最快速度回放到一个新建的同组合
+设备群，逐个对比回放后设备与原设备的状态字段，并测量回放吞吐量和回放本身占用的内存：
+
+    python benchmarks/trace_replay.py --mix "2000 lights, 1000 locks, 1000 refrigerators, 1000 cameras" --ticks 500
+
+任何设备状态不一致时返回非零退出码。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import DEVICE_MAPPING
+from device.clock import VirtualClock, set_clock
+from device.fleet import Fleet
+from device.simulation import FleetSimulator
+from device.trace import TraceRecorder, TraceReplayer, traced_fields
+
+RATES = {"door_toggle": 0.05, "temperature_drift": 0.05, "brightness_change": 0.05, "lock_toggle": 0.05,
+         "battery_drain": 0.05, "recording_toggle": 0.05, "resolution_change": 0.05}
+# 心跳生成时按经过时间累计的字段，不参与对比
+DERIVED_FIELDS = {"storage_used"}
+
+
+def record(mix, path, ticks, tick_interval, seed, clock):
+    devices = list(Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(mix))
+    simulator = FleetSimulator(devices, rates=RATES, seed=seed)
+    recorder = TraceRecorder(path, clock).start(devices)
+    started = time.perf_counter()
+    for _ in range(ticks):
+        simulator.tick()
+        clock.advance(tick_interval)
+    recorder.close()
+    return devices, recorder.records, time.perf_counter() - started
+
+
+def compare(original, replayer, replayed):
+    """回放后设备与原设备状态字段不一致的项 [(设备ID, 字段, 原值, 回放值), ...]"""
+    by_id = {d.device_id: d for d in replayed}
+    mapping = replayer.mapping()
+    mismatches = []
+    for device in original:
+        target = by_id.get(mapping.get(device.device_id))
+        if target is None:
+            mismatches.append((device.device_id, None, "未映射", None))
+            continue
+        for name in traced_fields(device):
+            if name in DERIVED_FIELDS:
+                continue
+            expected, actual = getattr(device, name), getattr(target, name)
+            if expected != actual:
+                mismatches.append((device.device_id, name, expected, actual))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mix', default='2000 lights, 1000 locks, 1000 refrigerators, 1000 cameras')
+    parser.add_argument('--ticks', type=int, default=500, help='记录的模拟周期数')
+    parser.add_argument('--tick-interval', type=float, default=10, help='模拟周期的虚拟时长（秒）')
+    parser.add_argument('--gzip', action='store_true', help='轨迹文件使用 gzip 压缩')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='把结果写入该JSON文件')
+    args = parser.parse_args()
+
+    clock = VirtualClock()
+    set_clock(clock)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'fleet.trace' + ('.gz' if args.gzip else ''))
+        original, records, record_seconds = record(args.mix, path, args.ticks, args.tick_interval, args.seed, clock)
+        size = os.path.getsize(path)
+
+        replayed = list(Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(args.mix))
+        replayer = TraceReplayer(path, replayed, speed=0, clock=clock)
+        tracemalloc.start()
+        started = time.perf_counter()
+        replayer.run()
+        replay_seconds = time.perf_counter() - started
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    mismatches = compare(original, replayer, replayed)
+    result = {
+        "devices": len(original),
+        "records": records,
+        "trace_bytes": size,
+        "record_seconds": round(record_seconds, 3),
+        "replay_records_per_second": round(records / max(replay_seconds, 1e-9)),
+        # 回放结束后仍占用的内存是设备状态和事件队列，峰值与之的差是回放本身的工作内存
+        "replay_retained_bytes": retained,
+        "replay_working_bytes": peak - retained,
+        "stats": replayer.stats(),
+        "mismatches": len(mismatches)
+    }
+    print(f"设备数: {result['devices']}，轨迹记录数: {records}，文件大小: {size / 1e6:.1f} MB")
+    print(f"回放: {result['replay_records_per_second']} 条/秒，工作内存 {(peak - retained) / 1e6:.2f} MB"
+          f"（设备状态和事件队列 {retained / 1e6:.2f} MB），"
+          f"执行 {replayer.applied}，失败 {replayer.failed}，未映射 {replayer.unmapped}")
+    print(f"状态对比: {'一致' if not mismatches else f'{len(mismatches)} 项不一致'}")
+    for mismatch in mismatches[:10]:
+        print(f"  {mismatch}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"mix": args.mix, "ticks": args.ticks, "result": result}, f, indent=2)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""对比JSON与差量二进制心跳编码：每个心跳的字节数和控制器处理每个心跳的CPU时间
+
+    python benchmarks/wire_format.py --mix "200 lights, 100 locks, 100 cameras, 100 refrigerators" --rounds 24
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+from common import DEVICE_MAPPING, load_controller
+from device.fleet import Fleet
+from device.simulation import FleetSimulator
+from device.wire import DeltaCodec, CONTENT_TYPE
+
+
+def generate_rounds(mix, rounds, seed):
+    """生成 rounds 轮心跳，每轮之前推进一次随机行为模拟"""
+    devices = list(Fleet(DEVICE_MAPPING, '127.0.0.1', 0).populate(mix))
+    simulator = FleetSimulator(devices, rates={"door_toggle": 0.05, "brightness_change": 0.05,
+                                               "lock_toggle": 0.05, "recording_toggle": 0.05}, seed=seed)
+    for device in devices:
+        device.status = "online"
+    result = []
+    for _ in range(rounds):
+        simulator.tick()
+        heartbeats = []
+        for device in devices:
+            heartbeats.append(device._build_heartbeat())
+            device.events.commit()
+        result.append(heartbeats)
+    return result
+
+
+def measure_json(client, rounds, batch_size):
+    """返回 (单个心跳字节数, 批量心跳字节数, 控制器CPU微秒/心跳)"""
+    total = 0
+    single_bytes = 0
+    batch_bytes = 0
+    started = time.process_time()
+    for heartbeats in rounds:
+        for heartbeat in heartbeats:
+            body = json.dumps(heartbeat).encode()
+            single_bytes += len(body)
+            client.post('/api/v1/devices/heartbeat/', data=body, content_type='application/json')
+        for i in range(0, len(heartbeats), batch_size):
+            batch_bytes += len(json.dumps(heartbeats[i:i + batch_size]).encode())
+        total += len(heartbeats)
+    cpu = time.process_time() - started
+    return single_bytes / total, batch_bytes / total, cpu / total * 1e6
+
+
+def measure_delta(client, rounds, batch_size, compress):
+    codec = DeltaCodec(compress=compress)
+    total = 0
+    single_bytes = 0
+    batch_bytes = 0
+    cpu = 0.0
+    for heartbeats in rounds:
+        messages = [codec.encode(heartbeat) for heartbeat in heartbeats]
+        started = time.process_time()
+        for message in messages:
+            body, headers = codec.pack(message)
+            single_bytes += len(body)
+            response = client.post('/api/v1/devices/heartbeat/', data=body, headers=headers,
+                                   content_type=CONTENT_TYPE)
+            codec.ack([message], response.json.get("resync", []))
+        cpu += time.process_time() - started
+        for i in range(0, len(messages), batch_size):
+            body, _ = codec.pack(messages[i:i + batch_size])
+            batch_bytes += len(body)
+        total += len(heartbeats)
+    return single_bytes / total, batch_bytes / total, cpu / total * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mix', default='200 lights, 100 locks, 100 cameras, 100 refrigerators')
+    parser.add_argument('--rounds', type=int, default=24)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rounds = generate_rounds(args.mix, args.rounds, args.seed)
+    controller = load_controller()
+    client = controller.app.test_client()
+
+    # 控制器会打印每个心跳，测量期间丢弃控制台输出
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = {
+            "json": measure_json(client, rounds, args.batch_size),
+            "delta-msgpack": measure_delta(client, rounds, args.batch_size, compress=False),
+            "delta-msgpack+deflate": measure_delta(client, rounds, args.batch_size, compress=True)
+        }
+
+    print(f"{'编码':<24}{'字节/心跳':>12}{'批量字节/心跳':>16}{'控制器CPU(us)/心跳':>22}")
+    for name, (single, batch, cpu) in results.items():
+        print(f"{name:<24}{single:>12.1f}{batch:>16.1f}{cpu:>22.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,48 @@ PORT = int(os.getenv('PORT', 5000))
 
 # 心跳包配置
 HEARTBEAT_INTERVAL = int(os.getenv('HEARTBEAT_INTERVAL', 5))  # 秒
+# 心跳模式：async 为单事件循环统一调度，thread 为每个设备一个心跳线程
+HEARTBEAT_MODE = os.getenv('HEARTBEAT_MODE', 'async')
+# 心跳HTTP连接池配置
+HEARTBEAT_POOL_SIZE = int(os.getenv('HEARTBEAT_POOL_SIZE', 20))  # 每个控制器的长连接数上限
+HEARTBEAT_CONNECT_TIMEOUT = float(os.getenv('HEARTBEAT_CONNECT_TIMEOUT', 3))  # 秒
+HEARTBEAT_READ_TIMEOUT = float(os.getenv('HEARTBEAT_READ_TIMEOUT', 5))  # 秒
+HEARTBEAT_MAX_IN_FLIGHT = int(os.getenv('HEARTBEAT_MAX_IN_FLIGHT', 200))  # 同时在途的心跳请求上限
+# 批量心跳：把窗口内到期的心跳合并为一个请求（仅 async 模式），0 表示逐个发送
+HEARTBEAT_BATCH_WINDOW = float(os.getenv('HEARTBEAT_BATCH_WINDOW', 0))  # 秒
+HEARTBEAT_BATCH_SIZE = int(os.getenv('HEARTBEAT_BATCH_SIZE', 1000))  # 每个批量请求的最大心跳数
+# 心跳编码（仅 async 模式）：json、delta-msgpack（差量二进制），或 auto 与控制器协商
+HEARTBEAT_FORMAT = os.getenv('HEARTBEAT_FORMAT', 'json')
+HEARTBEAT_SNAPSHOT_EVERY = int(os.getenv('HEARTBEAT_SNAPSHOT_EVERY', 12))  # 差量编码每隔多少个心跳发送一次完整快照
+HEARTBEAT_COMPRESS = os.getenv('HEARTBEAT_COMPRESS', 'false').lower() == 'true'  # 差量编码是否压缩较大的请求体
+# 心跳失败处理：带完全抖动的指数退避、按控制器地址熔断、缓存未送达的心跳并在恢复后限速回放
+HEARTBEAT_RETRY_BASE = float(os.getenv('HEARTBEAT_RETRY_BASE', 1))  # 首次重试的退避上限（秒）
+HEARTBEAT_RETRY_MAX = float(os.getenv('HEARTBEAT_RETRY_MAX', 60))  # 退避时间上限（秒）
+HEARTBEAT_BREAKER_THRESHOLD = int(os.getenv('HEARTBEAT_BREAKER_THRESHOLD', 5))  # 连续失败多少次后熔断
+HEARTBEAT_BREAKER_RESET = float(os.getenv('HEARTBEAT_BREAKER_RESET', 30))  # 熔断多久后放行探测请求（秒）
+HEARTBEAT_SPOOL_SIZE = int(os.getenv('HEARTBEAT_SPOOL_SIZE', 10000))  # 每个控制器缓存的心跳数上限
+HEARTBEAT_REPLAY_BATCH = int(os.getenv('HEARTBEAT_REPLAY_BATCH', 500))  # 每个回放请求的心跳数
+HEARTBEAT_REPLAY_RATE = float(os.getenv('HEARTBEAT_REPLAY_RATE', 1000))  # 回放速率（心跳/秒）
 
 # 设备类型配置
-DEVICE_TYPE = os.getenv('DEVICE_TYPE', 'refrigerator')  # base, refrigerator, light, lock, camera 
\ No newline at end of file
+DEVICE_TYPE = os.getenv('DEVICE_TYPE', 'refrigerator')  # base, refrigerator, light, lock, camera 
+
+# 设备群配置，如 "3000 lights, 1000 locks, 500 cameras, 500 refrigerators"，为空时只运行单个设备
+FLEET = os.getenv('FLEET', '')
+
+# 随机行为模拟配置
+SIM_TICK_INTERVAL = float(os.getenv('SIM_TICK_INTERVAL', 10))  # 模拟周期（秒）
+# 每个周期各行为的触发概率，如 "door_toggle=0.01, battery_drain=0.005"，未设置的行为默认0.003
+SIM_RATES = os.getenv('SIM_RATES', '')
+
+# 轨迹记录与回放，文件名以 .gz 结尾时 gzip 压缩
+TRACE_RECORD = os.getenv('TRACE_RECORD', '')  # 把控制命令和状态变化记录到该文件
+TRACE_REPLAY = os.getenv('TRACE_REPLAY', '')  # 回放该轨迹文件，代替随机行为模拟
+TRACE_SPEED = float(os.getenv('TRACE_SPEED', 1))  # 回放倍速，0表示不等待、以最快速度回放
+TRACE_LOOP = os.getenv('TRACE_LOOP', 'false').lower() == 'true'  # 回放结束后从头循环
+
+# SSDP 配置：进程内全部设备共用一个应答器
+SSDP_PORT = int(os.getenv('SSDP_PORT', 1900))
+SSDP_MAX_AGE = int(os.getenv('SSDP_MAX_AGE', 1800))  # 客户端缓存通告的时间（秒）
+SSDP_NOTIFY_INTERVAL = float(os.getenv('SSDP_NOTIFY_INTERVAL', 30))  # 周期性 ssdp:alive 通告间隔（秒）
+SSDP_NOTIFY_BATCH = int(os.getenv('SSDP_NOTIFY_BATCH', 100))  # 每批发送的通告数
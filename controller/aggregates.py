@@ -0,0 +1,241 @@
+import math
+import threading
+from collections import Counter
+
+# 门锁电量直方图的桶宽（%），最后一个桶包含100
+BATTERY_BUCKET = 10
+_BATTERY_BUCKETS = 100 // BATTERY_BUCKET
+BATTERY_LABELS = tuple(
+    f"{i * BATTERY_BUCKET}-{i * BATTERY_BUCKET + BATTERY_BUCKET - 1}" if i < _BATTERY_BUCKETS - 1
+    else f"{i * BATTERY_BUCKET}-100"
+    for i in range(_BATTERY_BUCKETS)
+)
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return value
+    return None
+
+
+def _event_value(fields, event_type, key):
+    """心跳 data 中某类事件最新一次的字段值"""
+    event_data = fields.get(event_type)
+    if isinstance(event_data, dict):
+        return event_data.get(key)
+    return None
+
+
+def _battery_bucket(battery):
+    return min(max(int(battery // BATTERY_BUCKET), 0), _BATTERY_BUCKETS - 1)
+
+
+class _Row:
+    """一个设备对各项合计的贡献"""
+
+    __slots__ = ("device_type", "status", "power", "battery", "storage", "recording")
+
+    def __init__(self, device_type=None, status=None):
+        self.device_type = device_type
+        self.status = status
+        self.power = None  # 最新心跳中的功耗
+        self.battery = None  # 门锁最近一次上报的电量
+        self.storage = None  # 摄像头最近一次上报的已用存储（MB）
+        self.recording = False  # 摄像头最近一次上报的状态是否为录制中
+
+
+class FleetAggregates:
+    """设备群的计数和合计，随每个心跳和设备过期增量维护
+
+    每个设备保存一行贡献值，心跳到达时先减去旧行再加上新行，读取 summary() 的开销只与设备类型、
+    状态和直方图桶的数量有关，与设备数无关。电量、存储和录制状态只在对应事件中上报，沿用设备
+    最近一次上报的值；功耗只计入状态不是 offline 的设备。
+    """
+
+    def __init__(self):
+        self._rows = {}  # device_id -> _Row
+        self._counts = Counter()  # (设备类型, 状态) -> 设备数
+        self._power = {}  # 设备类型 -> [功耗合计, 计入的设备数]
+        self._battery = [0] * _BATTERY_BUCKETS
+        self._battery_unknown = 0  # 尚未上报电量的门锁数
+        self._storage = 0.0
+        self._recording = 0
+        self._lock = threading.Lock()
+
+    # 增量维护
+
+    def update(self, device_id, device_type, status, fields):
+        """应用设备的一个心跳，fields 为心跳的 data"""
+        if not isinstance(fields, dict):
+            fields = {}
+        with self._lock:
+            row = self._rows.get(device_id)
+            if row is None:
+                row = self._rows[device_id] = _Row()
+            else:
+                self._apply(row, -1)
+            row.device_type = device_type
+            row.status = status
+            row.power = _number(fields.get('current_power_consumption'))
+            battery = _number(_event_value(fields, 'battery_level', 'battery'))
+            if battery is not None:
+                row.battery = battery
+            storage = _number(_event_value(fields, 'storage_usage', 'storage_used_mb'))
+            if storage is not None:
+                row.storage = storage
+            camera_state = _event_value(fields, 'camera_state', 'camera_state')
+            if camera_state is not None:
+                row.recording = camera_state == 'recording'
+            self._apply(row, 1)
+
+    def set_status(self, device_id, status):
+        """设备状态变化（心跳超时标记为 offline）"""
+        with self._lock:
+            row = self._rows.get(device_id)
+            if row is None:
+                return
+            self._apply(row, -1)
+            row.status = status
+            self._apply(row, 1)
+
+    def remove(self, device_id):
+        """设备从设备表移除"""
+        with self._lock:
+            row = self._rows.pop(device_id, None)
+            if row is not None:
+                self._apply(row, -1)
+
+    def _apply(self, row, sign):
+        key = (row.device_type, row.status)
+        self._counts[key] += sign
+        if not self._counts[key]:
+            del self._counts[key]
+        if row.power is not None and row.status != 'offline':
+            power = self._power.setdefault(row.device_type, [0.0, 0])
+            power[0] += sign * row.power
+            power[1] += sign
+            if not power[1]:
+                del self._power[row.device_type]
+        if row.device_type == 'lock':
+            if row.battery is None:
+                self._battery_unknown += sign
+            else:
+                self._battery[_battery_bucket(row.battery)] += sign
+        elif row.device_type == 'camera':
+            if row.storage is not None:
+                self._storage += sign * row.storage
+            if row.recording:
+                self._recording += sign
+
+    # 读取
+
+    def summary(self):
+        with self._lock:
+            return self._summary(self._counts, self._power, self._battery, self._battery_unknown,
+                                 self._storage, self._recording)
+
+    @staticmethod
+    def _summary(counts, power, battery, battery_unknown, storage, recording):
+        by_type = {}
+        by_status = Counter()
+        for (device_type, status), count in counts.items():
+            entry = by_type.setdefault(str(device_type), {"total": 0})
+            entry["total"] += count
+            entry[str(status)] = entry.get(str(status), 0) + count
+            by_status[str(status)] += count
+        return {
+            "devices": sum(by_status.values()),
+            "by_type": by_type,
+            "by_status": dict(by_status),
+            "power": {
+                "total": round(sum(total for total, _ in power.values()), 3),
+                "by_type": {str(t): round(total, 3) for t, (total, _) in power.items()},
+                "devices": sum(count for _, count in power.values())
+            },
+            "locks": {
+                "battery_histogram": dict(zip(BATTERY_LABELS, battery)),
+                "battery_unknown": battery_unknown
+            },
+            "cameras": {
+                "storage_used_mb": round(storage, 3),
+                "recording": recording
+            }
+        }
+
+    def __len__(self):
+        return len(self._rows)
+
+    # 校验
+
+    def recompute(self, devices, reports):
+        """遍历设备表全量重算，返回与 summary() 结构相同的结果
+
+        devices 为 device_id -> 最新心跳，reports 为 device_id -> 该设备各类事件最近一次上报的数据；
+        电量、存储和录制状态从 reports 中读取，不使用本对象增量维护的各设备贡献值。
+        """
+        counts = Counter()
+        power = {}
+        battery = [0] * _BATTERY_BUCKETS
+        battery_unknown = 0
+        storage = []
+        recording = 0
+        for device_id, device in devices.items():
+            device_type = device.get('device_type')
+            status = device.get('status')
+            counts[(device_type, status)] += 1
+            fields = device.get('data') if isinstance(device.get('data'), dict) else {}
+            value = _number(fields.get('current_power_consumption'))
+            if value is not None and status != 'offline':
+                entry = power.setdefault(device_type, [[], 0])
+                entry[0].append(value)
+                entry[1] += 1
+            report = reports.get(device_id) or {}
+            if device_type == 'lock':
+                value = _number(_event_value(report, 'battery_level', 'battery'))
+                if value is None:
+                    battery_unknown += 1
+                else:
+                    battery[_battery_bucket(value)] += 1
+            elif device_type == 'camera':
+                value = _number(_event_value(report, 'storage_usage', 'storage_used_mb'))
+                if value is not None:
+                    storage.append(value)
+                recording += _event_value(report, 'camera_state', 'camera_state') == 'recording'
+        power = {t: [math.fsum(values), count] for t, (values, count) in power.items()}
+        return self._summary(counts, power, battery, battery_unknown, math.fsum(storage), recording)
+
+    def verify(self, devices, reports):
+        """对比增量结果和全量重算，返回不一致的项 [(路径, 增量值, 重算值), ...]"""
+        mismatches = []
+        _compare("", self.summary(), self.recompute(devices, reports), mismatches)
+        return mismatches
+
+
+def _compare(path, incremental, expected, mismatches):
+    if isinstance(incremental, dict) and isinstance(expected, dict):
+        for key in sorted(set(incremental) | set(expected)):
+            _compare(f"{path}.{key}" if path else key, incremental.get(key), expected.get(key), mismatches)
+    elif isinstance(incremental, float) or isinstance(expected, float):
+        # 增量加减的浮点合计允许舍入误差
+        if incremental is None or expected is None or not math.isclose(incremental, expected, abs_tol=0.01):
+            mismatches.append((path, incremental, expected))
+    elif incremental != expected:
+        mismatches.append((path, incremental, expected))
+
+
+def merge_summaries(summaries):
+    """合并设备互不重叠的多个 summary()（如各 worker 的结果），数值逐项相加"""
+    merged = {}
+    for summary in summaries:
+        _add(merged, summary)
+    return merged
+
+
+def _add(target, source):
+    for key, value in source.items():
+        if isinstance(value, dict):
+            _add(target.setdefault(key, {}), value)
+        elif isinstance(value, float):
+            target[key] = round(target.get(key, 0.0) + value, 3)
+        else:
+            target[key] = target.get(key, 0) + value
@@ -1,75 +1,638 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from datetime import datetime
 import json
-from tabulate import tabulate
+import logging
 import threading
+import time
 import os
+import atexit
+import signal
+import socket
+import sys
+from werkzeug.serving import make_server
+from event_store import EventStore
+from registry import RecordRejected, RegistryFull, SharedRegistry
+from router import RouterError, WorkerRouter
+from timeseries import TimeSeriesStore
+from aggregates import FleetAggregates, merge_summaries
+from liveness import LivenessTracker
+from discovery import Discovery
+import pubsub
+import metrics
+import logs
+import zlib
+import wire
+import wal
+import rules
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 
 # 存储设备信息
 devices = {}
-# 存储设备事件历史
-event_history = []
-# 最大事件历史记录数
+# 保护 devices 的并发修改（心跳写入、离线清理）
+devices_lock = threading.Lock()
+# 设备心跳超时时间（秒）
+DEVICE_TIMEOUT = float(os.environ.get('DEVICE_TIMEOUT', 30))
+# 设备超时后的处理方式：evict 从设备列表移除，mark 保留并标记为offline
+DEVICE_OFFLINE_POLICY = os.environ.get('DEVICE_OFFLINE_POLICY', 'evict')
+liveness = LivenessTracker(DEVICE_TIMEOUT)
+# 多进程模式：WORKERS 大于1时 fork 出多个 worker 共享监听端口，设备表放在共享内存中，
+# 各 worker 都能读到全部设备。每个设备表分区属于一个 worker（分区号 % WORKERS），设备的心跳和
+# 事件无论由哪个 worker 接收，都转交给所属的 worker 按接收顺序处理；事件历史、功耗序列、规则状态
+# 和设备群汇总只包含本 worker 负责的设备，订阅只包含本 worker 处理的数据
+WORKERS = int(os.environ.get('WORKERS', 1))
+registry = None
+router = None
+if WORKERS > 1:
+    registry = SharedRegistry(
+        capacity=int(os.environ.get('REGISTRY_CAPACITY', 65536)),
+        partitions=int(os.environ.get('REGISTRY_PARTITIONS', 64)),
+        record_bytes=int(os.environ.get('REGISTRY_RECORD_BYTES', 1024))
+    )
+    router = WorkerRouter(WORKERS, timeout=float(os.environ.get('WORKER_HANDOFF_TIMEOUT', 5)))
+# 本 worker 负责的设备表分区，None 表示全部
+worker_partitions = None
+# 差量二进制心跳的解码状态
+wire_decoder = wire.DeltaDecoder()
+# 存储设备事件历史（环形缓冲区，按设备ID、事件类型和时间索引）
+event_history = EventStore(int(os.environ.get('EVENT_STORE_CAPACITY', 1000000)))
+# 各设备功耗的时间序列（原始样本、分钟和小时汇总），总内存不超过 TIMESERIES_MEMORY_MB
+power_history = TimeSeriesStore(
+    raw_capacity=int(os.environ.get('TIMESERIES_RAW_SAMPLES', 720)),
+    minute_capacity=int(os.environ.get('TIMESERIES_MINUTES', 1440)),
+    hour_capacity=int(os.environ.get('TIMESERIES_HOURS', 168)),
+    memory_budget=int(float(os.environ.get('TIMESERIES_MEMORY_MB', 512)) * 1024 * 1024)
+)
+# 按设备类型和状态的计数、功耗合计、门锁电量直方图和摄像头存储合计，随心跳和设备过期增量维护；
+# 多进程模式下各 worker 维护自己负责的设备，/fleet/summary 合并各 worker 的结果
+fleet_aggregates = FleetAggregates()
+# 各设备每类事件最近一次上报的数据（device_id -> {事件类型: 事件数据}），与设备表一起维护，
+# 用于全量重算汇总，与 fleet_aggregates 中的增量状态相互独立
+device_reports = {}
+# 心跳、事件和上下线通知的订阅（SSE 流和长轮询）
+broker = pubsub.Broker(idle_timeout=float(os.environ.get('SUBSCRIPTION_IDLE_TIMEOUT', 60)))
+# 事件流没有新消息时发送保活注释的间隔（秒）
+STREAM_KEEPALIVE = 15
+# 不带查询参数时 /events 返回的最近事件数
 MAX_EVENT_HISTORY = 100
+# SSDP 自动发现：设置为本控制器对设备可见的地址后启用，新发现的设备会被设置为向该地址发送心跳
+DISCOVERY_URL = os.environ.get('DISCOVERY_URL')
+# 周期性发送 M-SEARCH 的间隔（秒）
+DISCOVERY_INTERVAL = float(os.environ.get('DISCOVERY_INTERVAL', 60))
+discovery = None
+# 日志：LOG_DEBUG=true 时逐条输出表格（调试用），否则按类别采样和限速后由后台线程异步输出
+LOG_DEBUG = os.environ.get('LOG_DEBUG', 'false').lower() == 'true'
+# 各类日志的保留比例和每秒上限，如 "heartbeat=0.01"、"heartbeat=20, event=100"
+LOG_SAMPLE = logs.parse_category_values(os.environ.get('LOG_SAMPLE', 'heartbeat=0.01'))
+LOG_RATE_LIMIT = logs.parse_category_values(os.environ.get('LOG_RATE_LIMIT', 'heartbeat=20, batch=20, event=100'))
 
-def get_device_info(device_id):
-    """获取设备信息的格式化字符串"""
-    device = devices.get(device_id, {})
-    if not device:
+def configure_logging():
+    """配置日志；fork 出的 worker 需要重新调用，启动自己的后台输出线程"""
+    global logger, log_listener
+    logger, log_listener = logs.setup(
+        debug=LOG_DEBUG,
+        log_file=os.environ.get('LOG_FILE'),  # JSON 行日志文件，按大小轮转
+        max_bytes=int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 * 1024)),
+        backups=int(os.environ.get('LOG_BACKUPS', 5)),
+        queue_size=int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    )
+
+configure_logging()
+logs.counters.on_drop = metrics.log_dropped
+
+# 持久化：设置 PERSIST_DIR 后心跳和事件写入分段的只追加日志，重启时从快照和日志恢复设备表和事件历史
+PERSIST_DIR = os.environ.get('PERSIST_DIR')
+# 为 true 时心跳和事件写入并同步到磁盘后才响应，否则立即响应、由后台线程按组提交
+PERSIST_WAIT = os.environ.get('PERSIST_WAIT', 'false').lower() == 'true'
+event_log = None
+
+def open_event_log(directory):
+    return wal.EventLog(
+        directory,
+        segment_bytes=int(float(os.environ.get('PERSIST_SEGMENT_MB', 64)) * 1024 * 1024),
+        flush_interval=float(os.environ.get('PERSIST_FLUSH_MS', 5)) / 1000,
+        fsync=os.environ.get('PERSIST_FSYNC', 'true').lower() == 'true',
+        snapshot_segments=int(os.environ.get('PERSIST_SNAPSHOT_SEGMENTS', 4)),
+        event_capacity=event_history.capacity
+    )
+
+# 多进程模式下各 worker 在 PERSIST_DIR/worker-<编号> 中记录自己负责的设备，由 worker 启动时打开
+if PERSIST_DIR and WORKERS == 1:
+    event_log = open_event_log(PERSIST_DIR)
+
+def category_logger(category, level=logging.INFO):
+    """调试模式下不采样、不限速"""
+    if LOG_DEBUG:
+        return logs.CategoryLogger(logger, category, level=level)
+    return logs.CategoryLogger(logger, category, sample=LOG_SAMPLE.get(category, 1),
+                               rate_limit=LOG_RATE_LIMIT.get(category, 0), level=level)
+
+log_heartbeat = category_logger('heartbeat')
+log_batch = category_logger('batch')
+log_event = category_logger('event')
+log_device = category_logger('device')
+log_rule = category_logger('rule')
+
+# 规则引擎：对每个心跳和事件评估规则，条件成立时生成事件或调用设备的 /control；
+# RULES_FILE 为启动时加载的规则文件（JSON数组），运行中可通过 /rules 增删
+# 多进程模式下各 worker 持有相同的规则，只对自己负责的设备评估
+RULES_FILE = os.environ.get('RULES_FILE')
+rule_engine = rules.RuleEngine()
+# 规则动作中的 /control 请求在线程池中发送，不阻塞心跳请求
+rule_control_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('RULE_CONTROL_WORKERS', 8)),
+                                       thread_name_prefix="rule-control")
+rule_session = requests.Session()
+RULE_CONTROL_TIMEOUT = float(os.environ.get('RULE_CONTROL_TIMEOUT', 2))
+
+# 心跳 data 中不属于事件的字段
+HEARTBEAT_STATE_FIELDS = {"current_power_consumption", "event_log"}
+
+def device_type_status():
+    """抓取指标时统计设备表中的 (设备类型, 状态)"""
+    if registry is not None:
+        return registry.type_status()
+    with devices_lock:
+        return [(d.get('device_type'), d.get('status')) for d in devices.values()]
+
+metrics.set_sources(devices=device_type_status, event_store=event_history, broker=broker)
+
+def device_fields(device):
+    """日志中记录的设备字段"""
+    return {
+        "device_id": device.get("device_id", ""),
+        "device_type": device.get("device_type", ""),
+        "status": device.get("status", ""),
+        "last_update": device.get("last_update", "")
+    }
+
+def event_fields(event_data):
+    """日志中记录的事件字段"""
+    return {
+        "device_id": event_data.get("device_id", ""),
+        "device_type": event_data.get("device_type", ""),
+        "event_type": event_data.get("event_type", ""),
+        "event_data": event_data.get("event_data", {}),
+        "timestamp": event_data.get("timestamp", "")
+    }
+
+def heartbeat_error(data):
+    """心跳的格式错误，格式正确时返回None"""
+    if not isinstance(data, dict):
+        return "心跳必须是JSON对象"
+    # 设备端发送 device_identifier，兼容直接发送 device_id 的客户端
+    device_id = data.get('device_id') or data.get('device_identifier')
+    if not device_id:
+        return "缺少设备ID"
+    # 设备ID、类型和状态用作设备表和汇总的键
+    for name, value in (("device_id", device_id), ("device_type", data.get('device_type')),
+                        ("status", data.get('status'))):
+        if value is not None and not isinstance(value, str):
+            return f"{name} 必须是字符串"
+    return None
+
+def apply_heartbeat(data, now):
+    """写入一条心跳，返回设备ID，无效心跳返回None"""
+    if heartbeat_error(data) is not None:
         return None
-    
-    info = [
-        ["属性", "值"],
-        ["设备ID", device.get("device_id", "")],
-        ["设备类型", device.get("device_type", "")],
-        ["状态", device.get("status", "")],
-        ["最后更新", device.get("last_update", "")]
-    ]
-    return tabulate(info, headers="firstrow", tablefmt="grid")
-
-def print_event(event_data):
-    """打印事件信息"""
-    print("\n=== 新事件通知 ===")
-    event_info = [
-        ["字段", "值"],
-        ["设备ID", event_data.get("device_id", "")],
-        ["设备类型", event_data.get("device_type", "")],
-        ["事件类型", event_data.get("event_type", "")],
-        ["事件数据", json.dumps(event_data.get("event_data", {}), ensure_ascii=False)],
-        ["时间戳", event_data.get("timestamp", "")]
-    ]
-    print(tabulate(event_info, headers="firstrow", tablefmt="grid"))
+    device_id = data.get('device_id') or data.get('device_identifier')
+    data['device_id'] = device_id
+    data['last_update'] = now
+    if data.get('replay'):
+        # 设备在控制器不可用期间缓存、恢复后回放的心跳：只补录其中的事件，不覆盖设备的最新状态
+        record_heartbeat_events(data)
+        return device_id
+    if registry is not None:
+        with devices_lock:
+            try:
+                previous_status = registry.put(device_id, data.get('device_type'), data.get('status'), time.time(), data)
+            except (RegistryFull, RecordRejected) as e:
+                logger.warning("无法写入设备表", extra={"category": "device", "fields": {"device_id": device_id, "error": str(e)}})
+                return None
+            fleet_aggregates.update(device_id, data.get('device_type'), data.get('status'), data.get('data'))
+            record_reports(device_id, data)
+        came_online = previous_status in (None, 'offline')
+    else:
+        with devices_lock:
+            previous = devices.get(device_id)
+            devices[device_id] = data
+            is_new = liveness.touch(device_id)
+            fleet_aggregates.update(device_id, data.get('device_type'), data.get('status'), data.get('data'))
+            record_reports(device_id, data)
+        came_online = is_new or (previous is not None and previous.get('status') == 'offline')
+    if event_log is not None:
+        event_log.append(wal.KIND_HEARTBEAT, time.time(), data)
+    if came_online:
+        broker.publish(pubsub.KIND_STATUS, {
+            "device_id": device_id, "device_type": data.get('device_type'),
+            "status": "online", "timestamp": now
+        })
+    broker.publish(pubsub.KIND_HEARTBEAT, data)
+    record_power(data)
+    events = heartbeat_events(data)
+    for event_data in events:
+        record_event(event_data)
+    evaluate_rules(data, events)
+    return device_id
+
+def device_owner(device_id):
+    """多进程模式下负责设备的 worker 编号，设备ID无效或过长时为本 worker"""
+    if not isinstance(device_id, str) or not device_id:
+        return router.index
+    try:
+        return registry.partition(device_id) % WORKERS
+    except RecordRejected:
+        return router.index
+
+def apply_heartbeats(batch, now):
+    """写入一批心跳，返回各心跳是否被接受
+
+    多进程模式下按设备所属的 worker 分组，每组整体放入所属 worker 的收件管道（包括本 worker），
+    不等待处理结果：同一设备的心跳无论由哪个 worker 接收，都在所属 worker 中按到达顺序处理；
+    格式正确的心跳即计为接受，写入设备表失败时由所属 worker 记录日志。PERSIST_WAIT 为 true 时
+    逐组等待所属 worker 写入并同步到磁盘，转交失败或超时的心跳计为未接受。
+    """
+    if router is None:
+        return [apply_heartbeat(data, now) is not None for data in batch]
+    accepted = [False] * len(batch)
+    groups = {}
+    for position, data in enumerate(batch):
+        # 格式错误的心跳直接拒绝
+        if heartbeat_error(data) is None:
+            owner = device_owner(data.get('device_id') or data.get('device_identifier'))
+            groups.setdefault(owner, []).append(position)
+    if not PERSIST_WAIT:
+        for worker, positions in groups.items():
+            router.cast(worker, 'heartbeats', ([batch[p] for p in positions], now))
+            for position in positions:
+                accepted[position] = True
+        return accepted
+    pending = {worker: router.call(worker, 'heartbeats', ([batch[p] for p in positions], now))
+               for worker, positions in groups.items()}
+    for worker, future in pending.items():
+        try:
+            results = router.result(future)
+        except RouterError as e:
+            logger.warning("转交心跳失败", extra={"category": "device", "fields": {
+                "worker": worker, "heartbeats": len(groups[worker]), "error": str(e)
+            }})
+            continue
+        for position, ok in zip(groups[worker], results):
+            accepted[position] = ok
+    return accepted
+
+def record_reports(device_id, data):
+    """更新设备各类事件最近一次上报的数据（调用方持有 devices_lock）"""
+    fields = data.get('data')
+    if not isinstance(fields, dict):
+        return
+    reports = device_reports.setdefault(device_id, {})
+    for event_type, event_data in fields.items():
+        if event_type not in HEARTBEAT_STATE_FIELDS:
+            reports[event_type] = event_data
+
+def apply_event(event_data):
+    """写入一个设备上报的事件并评估规则"""
+    record_event(event_data)
+    observe_event(event_data)
+
+def record_event(event_data):
+    """写入事件历史并推送给订阅者"""
+    received_at = time.time()
+    event_history.append(event_data, received_at)
+    if event_log is not None:
+        event_log.append(wal.KIND_EVENT, received_at, event_data)
+    metrics.EVENTS_RECORDED.inc()
+    broker.publish(pubsub.KIND_EVENT, event_data)
+
+def record_power(data):
+    """把心跳中的当前功耗写入时间序列，时间取控制器的接收时间"""
+    fields = data.get('data')
+    if not isinstance(fields, dict):
+        return
+    power = fields.get('current_power_consumption')
+    if isinstance(power, (int, float)) and not isinstance(power, bool):
+        power_history.add(data['device_id'], data.get('device_type'), time.time(), power)
+
+def persist_sync():
+    """PERSIST_WAIT 为 true 时等到本请求写入的记录同步到磁盘"""
+    if event_log is not None and PERSIST_WAIT:
+        event_log.sync()
+
+def recover_state():
+    """从持久化日志恢复设备表和事件历史"""
+    # 只有最近 capacity 个事件会留在事件历史中，先在有界队列中截取
+    events = deque(maxlen=event_history.capacity)
+    recovered = {}
+    for kind, t, payload in event_log.recover():
+        if kind == wal.KIND_HEARTBEAT:
+            if heartbeat_error(payload) is not None:
+                # 早期版本可能记录了类型或状态不是字符串的心跳
+                continue
+            recovered[payload['device_id']] = payload
+            record_reports(payload['device_id'], payload)
+        elif kind == wal.KIND_REPORTS:
+            # 快照中各设备之前上报过、最新心跳中没有的事件数据
+            device_id, fields = payload
+            record_reports(device_id, {"data": fields})
+        elif kind == wal.KIND_EVENT:
+            events.append((t, payload))
+        elif kind == wal.KIND_OFFLINE:
+            device_id, policy = payload
+            if policy == 'mark':
+                if device_id in recovered:
+                    recovered[device_id]['status'] = 'offline'
+            else:
+                recovered.pop(device_id, None)
+                device_reports.pop(device_id, None)
+    for t, event in events:
+        event_history.append(event, t)
+    for device_id, device in recovered.items():
+        # 恢复的设备从现在起重新计算心跳超时
+        if registry is not None:
+            try:
+                registry.put(device_id, device.get('device_type'), device.get('status'), time.time(), device)
+            except (RegistryFull, RecordRejected) as e:
+                logger.warning("无法写入设备表", extra={"category": "device", "fields": {"device_id": device_id, "error": str(e)}})
+                device_reports.pop(device_id, None)
+                continue
+        else:
+            devices[device_id] = device
+            if device.get('status') != 'offline':
+                liveness.touch(device_id)
+        # 最新心跳中没有的事件沿用之前上报的值
+        fields = dict(device_reports.get(device_id, {}))
+        if isinstance(device.get('data'), dict):
+            fields.update(device['data'])
+        fleet_aggregates.update(device_id, device.get('device_type'), device.get('status'), fields)
+    stats = event_log.stats()
+    logger.info("已从持久化日志恢复", extra={"category": "persist", "fields": {
+        "records": stats['recovered'], "devices": len(fleet_aggregates), "events": len(event_history),
+        "seconds": stats['recovery_seconds'], "torn_bytes": stats['torn_bytes']
+    }})
+
+def heartbeat_events(data):
+    """心跳中携带的设备事件"""
+    fields = data.get('data')
+    if not isinstance(fields, dict):
+        return []
+    timestamp = data.get('timestamp', data['last_update'])
+    events = []
+    # 同一心跳周期内多次发生的事件按顺序放在 event_log 中
+    logged = set()
+    for entry in fields.get('event_log') or []:
+        logged.add(entry.get('event_type'))
+        events.append({
+            "device_id": data['device_id'],
+            "device_type": data.get('device_type'),
+            "event_type": entry.get('event_type'),
+            "event_data": entry.get('event_data'),
+            "timestamp": entry.get('timestamp') or timestamp
+        })
+    for event_type, event_data in fields.items():
+        if event_type in HEARTBEAT_STATE_FIELDS or event_type in logged:
+            continue
+        events.append({
+            "device_id": data['device_id'],
+            "device_type": data.get('device_type'),
+            "event_type": event_type,
+            "event_data": event_data,
+            "timestamp": timestamp
+        })
+    return events
+
+def record_heartbeat_events(data):
+    """把心跳中携带的设备事件写入事件历史"""
+    for event_data in heartbeat_events(data):
+        record_event(event_data)
+
+def evaluate_rules(data, events):
+    """按心跳的状态字段和其中的事件依次评估规则"""
+    fields = data.get('data')
+    state = {"status": data.get('status')}
+    if isinstance(fields, dict) and 'current_power_consumption' in fields:
+        state['current_power_consumption'] = fields['current_power_consumption']
+    rule_engine.observe(data['device_id'], data.get('device_type'), state)
+    for event_data in events:
+        observe_event(event_data)
+
+def observe_event(event_data):
+    """用事件数据评估规则，非对象的事件数据以事件类型作为字段名"""
+    values = event_data.get('event_data')
+    if not isinstance(values, dict):
+        values = {event_data.get('event_type'): values}
+    rule_engine.observe(event_data.get('device_id'), event_data.get('device_type'), values,
+                        event_data.get('event_type'))
+
+def control_requests(action, trigger):
+    """规则 control 动作的请求地址和请求体
+
+    未指定 url 时从 SSDP 发现缓存中查找设备或设备群进程的地址。
+    """
+    body = {"action": action['action'], "params": action.get('params', {})}
+    url = action.get('url')
+    device_id = action.get('device_id')
+    if device_id == rules.TRIGGER_DEVICE:
+        device_id = trigger['device_id']
+    if device_id:
+        if url:
+            return [(f"{url.rstrip('/')}/devices/{device_id}/control", body)]
+        location = discovery.location(device_id) if discovery is not None else None
+        return [(f"{location.rstrip('/')}/control", body)] if location else []
+    # 广播：由设备群进程按设备类型和标签选出目标
+    body['target'] = action['target']
+    origins = [url] if url else (discovery.origins() if discovery is not None else [])
+    return [(f"{origin.rstrip('/')}/control/batch", body) for origin in origins]
+
+def send_rule_control(rule_id, url, body):
+    try:
+        response = rule_session.post(url, json=body, timeout=RULE_CONTROL_TIMEOUT)
+        response.raise_for_status()
+        metrics.RULE_CONTROL_OK.inc()
+    except requests.RequestException as e:
+        metrics.RULE_CONTROL_FAILED.inc()
+        logger.warning("规则控制请求失败", extra={"category": "rule", "fields": {
+            "rule_id": rule_id, "url": url, "error": str(e)
+        }})
+
+def run_rule_actions(rule, trigger):
+    """执行规则触发的动作"""
+    log_rule("规则触发", trigger)
+    for action in rule.actions:
+        if action['type'] == rules.ACTION_EVENT:
+            metrics.RULE_EVENTS.inc()
+            record_event({
+                "device_id": trigger['device_id'],
+                "device_type": trigger['device_type'],
+                "event_type": action.get('event_type', 'rule_triggered'),
+                "event_data": {**trigger, **(action.get('data') or {})},
+                "timestamp": datetime.now().isoformat()
+            })
+            continue
+        if router is not None and router.index != 0 and not action.get('url'):
+            # 发现缓存只在第一个 worker 中，由它查找目标地址
+            router.cast(0, 'rule_control', (rule.id, action, trigger))
+        else:
+            dispatch_rule_control((rule.id, action, trigger))
+
+def dispatch_rule_control(payload):
+    """查找规则 control 动作的目标，在线程池中发送请求"""
+    rule_id, action, trigger = payload
+    targets = control_requests(action, trigger)
+    if not targets:
+        metrics.RULE_CONTROL_UNRESOLVED.inc()
+        logger.warning("找不到规则控制的目标设备", extra={"category": "rule", "fields": {
+            "rule_id": rule_id, "device_id": action.get('device_id'), "target": action.get('target')
+        }})
+    for url, body in targets:
+        rule_control_pool.submit(send_rule_control, rule_id, url, body)
+
+def run_rule_timers():
+    """触发持续时间已满足的规则"""
+    while True:
+        rule_engine.wait(60)
+        try:
+            rule_engine.fire_due()
+        except Exception as e:
+            # 单次触发失败不能让定时线程退出，否则之后带 for 的规则都不再触发
+            logger.error("规则定时触发失败", extra={"category": "rule", "fields": {
+                "error": f"{type(e).__name__}: {e}"
+            }})
+
+rule_engine.on_fire = run_rule_actions
+
+def load_rules(path):
+    """从 JSON 文件加载规则"""
+    with open(path, encoding='utf-8') as f:
+        specs = json.load(f)
+    for spec in specs:
+        rule_engine.add(rules.Rule.from_dict(spec))
+    logger.info("已加载规则", extra={"category": "rule", "fields": {"path": path, "rules": len(rule_engine)}})
+
+def parse_heartbeat_batch():
+    """解析批量心跳：JSON数组、{"heartbeats": [...]} 或按行分隔的JSON流"""
+    if request.mimetype == 'application/x-ndjson':
+        lines = request.get_data(as_text=True).splitlines()
+        return [json.loads(line) for line in lines if line.strip()]
+    body = request.get_json()
+    if isinstance(body, dict):
+        body = body.get('heartbeats')
+    if not isinstance(body, list):
+        raise ValueError("需要心跳数组")
+    return body
+
+def decode_delta_request():
+    """解码差量二进制请求，返回 (标准心跳列表, 需要重新发送完整快照的设备ID列表)"""
+    messages = wire_decoder.unpack(request.get_data(), request.headers.get('Content-Encoding'))
+    if isinstance(messages, dict):
+        messages = [messages]
+    heartbeats = []
+    resync = []
+    for message in messages:
+        data = wire_decoder.decode(message)
+        if data is None:
+            resync.append(message["i"])
+        else:
+            heartbeats.append(data)
+    return heartbeats, resync
+
+@app.route('/api/v1/devices/heartbeat/formats/', methods=['GET'])
+def heartbeat_formats():
+    """心跳编码协商：返回控制器支持的编码"""
+    return jsonify({"formats": wire.SUPPORTED_FORMATS})
 
 @app.route('/heartbeat', methods=['POST'])
+@app.route('/api/v1/devices/heartbeat/', methods=['POST'])
 def heartbeat():
-    """接收设备心跳"""
-    data = request.json
-    device_id = data.get('device_id')
-    if device_id:
-        data['last_update'] = datetime.now().isoformat()
-        devices[device_id] = data
-        print(f"\n=== 心跳包 ===\n{get_device_info(device_id)}")
+    """接收设备心跳，支持JSON和差量二进制两种编码"""
+    started = time.perf_counter()
+    resync = []
+    delta = request.mimetype == wire.CONTENT_TYPE
+    if delta:
+        try:
+            heartbeats, resync = decode_delta_request()
+        except (ValueError, KeyError, zlib.error) as e:
+            metrics.HEARTBEATS_REJECTED.inc()
+            return jsonify({"error": f"无法解析心跳: {e}"}), 400
+    else:
+        heartbeats = [request.get_json(silent=True)]
+        error = heartbeat_error(heartbeats[0])
+        if error is not None:
+            metrics.HEARTBEATS_REJECTED.inc()
+            return jsonify({"error": f"心跳无效: {error}"}), 400
+    now = datetime.now().isoformat()
+    for data, accepted in zip(heartbeats, apply_heartbeats(heartbeats, now)):
+        if accepted:
+            (metrics.HEARTBEATS_DELTA if delta else metrics.HEARTBEATS_JSON).inc()
+            if log_heartbeat.enabled():
+                log_heartbeat.log("心跳包", device_fields(data))
+        else:
+            metrics.HEARTBEATS_REJECTED.inc()
+    metrics.INGEST_SINGLE.observe(time.perf_counter() - started)
+    persist_sync()
+    if resync:
+        return jsonify({"status": "ok", "resync": resync})
     return jsonify({"status": "ok"})
 
+@app.route('/heartbeat/batch', methods=['POST'])
+@app.route('/api/v1/devices/heartbeat/batch/', methods=['POST'])
+def heartbeat_batch():
+    """批量接收多个设备的心跳，一次处理整批"""
+    started = time.perf_counter()
+    resync = []
+    delta = request.mimetype == wire.CONTENT_TYPE
+    try:
+        if delta:
+            batch, resync = decode_delta_request()
+        else:
+            batch = parse_heartbeat_batch()
+    except (ValueError, KeyError, zlib.error) as e:
+        metrics.HEARTBEATS_REJECTED.inc()
+        return jsonify({"error": f"无法解析批量心跳: {e}"}), 400
+    now = datetime.now().isoformat()
+    accepted = sum(apply_heartbeats(batch, now))
+    rejected = len(batch) - accepted
+    (metrics.HEARTBEATS_DELTA if delta else metrics.HEARTBEATS_JSON).inc(accepted)
+    metrics.HEARTBEATS_REJECTED.inc(rejected)
+    metrics.INGEST_BATCH.observe(time.perf_counter() - started)
+    if log_batch.enabled():
+        log_batch.log("批量心跳", {"accepted": accepted, "rejected": rejected, "resync": len(resync)})
+    persist_sync()
+    return jsonify({"status": "ok", "accepted": accepted, "rejected": rejected, "resync": resync})
+
 @app.route('/event', methods=['POST'])
 def event():
     """接收设备事件"""
-    event_data = request.json
-    # 添加到历史记录
-    event_history.append(event_data)
-    if len(event_history) > MAX_EVENT_HISTORY:
-        event_history.pop(0)
-    # 打印事件信息
-    print_event(event_data)
+    event_data = request.get_json(silent=True)
+    if not isinstance(event_data, dict):
+        return jsonify({"error": "事件必须是JSON对象"}), 400
+    if router is None:
+        apply_event(event_data)
+    elif not PERSIST_WAIT:
+        # 与心跳一样放入设备所属 worker 的收件管道，按到达顺序写入历史记录并评估规则
+        router.cast(device_owner(event_data.get('device_id')), 'event', event_data)
+    else:
+        try:
+            router.result(router.call(device_owner(event_data.get('device_id')), 'event', event_data))
+        except RouterError as e:
+            return jsonify({"error": f"转交事件失败: {e}"}), 503
+    if log_event.enabled():
+        log_event.log("新事件通知", event_fields(event_data))
+    persist_sync()
     return jsonify({"status": "ok"})
 
 @app.route('/devices', methods=['GET'])
 def list_devices():
     """列出所有设备"""
+    if registry is not None:
+        return jsonify(registry.summaries())
+    with devices_lock:
+        snapshot = list(devices.items())
     result = []
-    for device_id, device in devices.items():
+    for device_id, device in snapshot:
         result.append({
             "device_id": device_id,
             "device_type": device.get("device_type"),
@@ -78,41 +641,554 @@ def list_devices():
         })
     return jsonify(result)
 
+def parse_time_arg(value):
+    """解析时间参数：epoch秒或ISO格式"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
 @app.route('/events', methods=['GET'])
 def list_events():
-    """获取事件历史"""
-    return jsonify(event_history)
+    """获取事件历史
+
+    不带参数时返回最近的事件列表；带 device_id/type/since/until/limit/cursor
+    参数时按条件过滤并分页，返回 {"events": [...], "next_cursor": ...}
+    """
+    args = request.args
+    if not args:
+        return jsonify(event_history.latest(MAX_EVENT_HISTORY))
+    try:
+        limit = min(int(args.get('limit', MAX_EVENT_HISTORY)), 10000)
+        cursor = args.get('cursor')
+        events, next_cursor = event_history.query(
+            device_id=args.get('device_id'),
+            event_type=args.get('type'),
+            since=parse_time_arg(args.get('since')),
+            until=parse_time_arg(args.get('until')),
+            cursor=int(cursor) if cursor is not None else None,
+            limit=max(1, limit)
+        )
+    except ValueError as e:
+        return jsonify({"error": f"查询参数错误: {e}"}), 400
+    return jsonify({"events": events, "next_cursor": next_cursor})
+
+def subscription_filters(source):
+    """从查询参数或请求体中读取订阅的过滤条件和缓冲设置"""
+    return {
+        "kinds": source.get('kinds'),
+        "device_id": source.get('device_id'),
+        "device_type": source.get('device_type'),
+        "event_type": source.get('type'),
+        "max_buffer": max(1, min(int(source.get('max_buffer', 1000)), 100000)),
+        "policy": source.get('policy', pubsub.DROP_OLDEST)
+    }
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """推送心跳、事件和上下线通知
+
+    默认为 SSE（text/event-stream），format=ndjson 时每行一条JSON消息。
+    可按 kinds、device_id、device_type、type（事件类型）过滤，多个值用逗号分隔。
+    """
+    try:
+        subscriber = broker.subscribe(**subscription_filters(request.args))
+    except ValueError as e:
+        return jsonify({"error": f"订阅参数错误: {e}"}), 400
+    ndjson = request.args.get('format') == 'ndjson'
+
+    def generate():
+        try:
+            if not ndjson:
+                yield ": connected\n\n"
+            while True:
+                items = subscriber.get(timeout=STREAM_KEEPALIVE, max_items=500)
+                if items:
+                    if ndjson:
+                        yield "\n".join(items) + "\n"
+                    else:
+                        yield "".join(f"data: {item}\n\n" for item in items)
+                elif subscriber.closed:
+                    break
+                else:
+                    # 保活，同时让服务器及时发现已断开的连接
+                    yield "\n" if ndjson else ": keepalive\n\n"
+        finally:
+            broker.unsubscribe(subscriber.id)
+
+    mimetype = 'application/x-ndjson' if ndjson else 'text/event-stream'
+    return Response(generate(), mimetype=mimetype,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/subscriptions', methods=['POST'])
+def create_subscription():
+    """创建长轮询订阅"""
+    try:
+        subscriber = broker.subscribe(**subscription_filters(request.get_json(silent=True) or {}))
+    except ValueError as e:
+        return jsonify({"error": f"订阅参数错误: {e}"}), 400
+    return jsonify({"subscription_id": subscriber.id, **subscriber.stats()}), 201
+
+@app.route('/subscriptions', methods=['GET'])
+def subscription_stats():
+    return jsonify(broker.stats())
+
+@app.route('/subscriptions/<subscription_id>/poll', methods=['GET'])
+def poll_subscription(subscription_id):
+    """长轮询：返回缓冲区中的消息，没有消息时最多等待 timeout 秒"""
+    subscriber = broker.get(subscription_id)
+    if subscriber is None:
+        return jsonify({"error": "订阅不存在"}), 404
+    try:
+        timeout = max(0.0, min(float(request.args.get('timeout', 25)), 60))
+        max_items = max(1, min(int(request.args.get('max', 1000)), 10000))
+    except ValueError as e:
+        return jsonify({"error": f"查询参数错误: {e}"}), 400
+    items = subscriber.get(timeout=timeout, max_items=max_items)
+    if not items and subscriber.closed:
+        broker.unsubscribe(subscription_id)
+        return jsonify({"error": "订阅因缓冲区溢出已断开，请重新订阅"}), 410
+    # 消息已序列化，直接拼接
+    body = '{"messages":[%s],"dropped":%d,"closed":%s}' % (
+        ",".join(items), subscriber.dropped, "true" if subscriber.closed else "false")
+    return Response(body, mimetype='application/json')
+
+@app.route('/subscriptions/<subscription_id>', methods=['DELETE'])
+def delete_subscription(subscription_id):
+    if broker.unsubscribe(subscription_id) is None:
+        return jsonify({"error": "订阅不存在"}), 404
+    return jsonify({"status": "ok"})
 
 @app.route('/device/<device_id>', methods=['GET'])
 def get_device(device_id):
     """获取特定设备信息"""
-    device = devices.get(device_id)
+    device = registry.get(device_id) if registry is not None else devices.get(device_id)
     if device:
         return jsonify(device)
     return jsonify({"error": "设备不存在"}), 404
 
+def format_power_points(resolution, points):
+    if resolution == 'raw':
+        return [{"t": t, "value": round(value, 3)} for t, value in points]
+    return [{"t": t, "min": round(low, 3), "max": round(high, 3), "avg": round(avg, 3), "count": count}
+            for t, low, high, avg, count in points]
+
+@app.route('/device/<device_id>/power', methods=['GET'])
+def device_power(device_id):
+    """单个设备的功耗序列
+
+    参数 since/until（epoch秒或ISO格式）和 resolution（raw、minute、hour），
+    不指定分辨率时选择能覆盖 since 之后全部数据的最细分辨率。
+    """
+    args = request.args
+    try:
+        resolution, points = power_history.query(
+            device_id,
+            since=parse_time_arg(args.get('since')),
+            until=parse_time_arg(args.get('until')),
+            resolution=args.get('resolution')
+        )
+    except ValueError as e:
+        return jsonify({"error": f"查询参数错误: {e}"}), 400
+    if points is None:
+        return jsonify({"error": "设备没有功耗数据"}), 404
+    return jsonify({"device_id": device_id, "resolution": resolution,
+                    "points": format_power_points(resolution, points)})
+
+@app.route('/fleet/power', methods=['GET'])
+def fleet_power():
+    """全部设备（或 device_type 指定的类型）在各分钟/小时桶内的功耗合计"""
+    args = request.args
+    try:
+        resolution, rows = power_history.fleet(
+            since=parse_time_arg(args.get('since')),
+            until=parse_time_arg(args.get('until')),
+            resolution=args.get('resolution'),
+            device_type=args.get('device_type')
+        )
+    except ValueError as e:
+        return jsonify({"error": f"查询参数错误: {e}"}), 400
+    points = [{"t": t, "avg": round(avg, 3), "min": round(low, 3), "max": round(high, 3), "devices": count}
+              for t, avg, low, high, count in rows]
+    return jsonify({"resolution": resolution, "device_type": args.get('device_type'), "points": points})
+
+@app.route('/fleet/summary', methods=['GET'])
+def fleet_summary():
+    """设备数（按类型和状态）、功耗合计、门锁电量直方图和摄像头存储合计，开销与设备数无关"""
+    if router is None:
+        return jsonify(fleet_aggregates.summary())
+    try:
+        return jsonify(merge_summaries(router.broadcast('fleet_summary')))
+    except RouterError as e:
+        return jsonify({"error": f"无法汇总各 worker 的结果: {e}"}), 503
+
+@app.route('/fleet/summary/verify', methods=['GET'])
+def verify_fleet_summary():
+    """遍历设备表全量重算汇总，与增量维护的结果对比；多进程模式下各 worker 分别校验"""
+    if router is None:
+        parts = [verify_local_fleet()]
+    else:
+        try:
+            parts = router.broadcast('fleet_verify')
+        except RouterError as e:
+            return jsonify({"error": f"无法汇总各 worker 的结果: {e}"}), 503
+    mismatches = []
+    for worker, (_, part) in enumerate(parts):
+        for path, incremental, expected in part:
+            mismatch = {"path": path, "incremental": incremental, "recomputed": expected}
+            if router is not None:
+                mismatch["worker"] = worker
+            mismatches.append(mismatch)
+    return jsonify({
+        "ok": not mismatches,
+        "devices": sum(count for count, _ in parts),
+        "mismatches": mismatches
+    })
+
+def verify_local_fleet(_=None):
+    """用本 worker 负责的设备表记录全量重算，返回 (设备数, 不一致的项)"""
+    with devices_lock:
+        source = registry.records(worker_partitions) if registry is not None else devices
+        return len(fleet_aggregates), fleet_aggregates.verify(source, device_reports)
+
+@app.route('/fleet/power/stats', methods=['GET'])
+def fleet_power_stats():
+    """功耗时间序列的设备数、内存占用和丢弃计数"""
+    return jsonify(power_history.stats())
+
+@app.route('/discovery', methods=['GET'])
+def list_discovered():
+    """SSDP 发现缓存中的设备"""
+    if discovery is None:
+        return jsonify({"error": "未启用自动发现"}), 404
+    return jsonify({
+        "stats": discovery.stats(),
+        "devices": [record.to_dict() for record in discovery.devices()]
+    })
+
+@app.route('/discovery/search', methods=['POST'])
+def discovery_search():
+    """立即发送一次 M-SEARCH"""
+    if discovery is None:
+        return jsonify({"error": "未启用自动发现"}), 404
+    body = request.get_json(silent=True) or {}
+    try:
+        mx = int(body.get('mx', 2))
+    except (TypeError, ValueError):
+        return jsonify({"error": "mx必须是整数"}), 400
+    found = discovery.search(body.get('st', 'ssdp:all'), mx=mx)
+    return jsonify({"found": len(found), "stats": discovery.stats()})
+
+def run_discovery():
+    """监听 NOTIFY 并周期性搜索设备"""
+    discovery.start()
+    while True:
+        found = discovery.search()
+        if found:
+            log_device("发现新设备", {"found": len(found), "cached": len(discovery)})
+        threading.Event().wait(DISCOVERY_INTERVAL)
+
+@app.route('/persistence/stats', methods=['GET'])
+def persistence_stats():
+    """持久化日志的段、写入、fsync、快照和恢复统计"""
+    if event_log is None:
+        return jsonify({"error": "未启用持久化"}), 404
+    return jsonify(event_log.stats())
+
+def local_rules(_=None):
+    return [rule.to_dict() for rule in rule_engine.rules()]
+
+def add_rules(specs):
+    for spec in specs:
+        rule_engine.add(rules.Rule.from_dict(spec))
+
+@app.route('/rules', methods=['GET'])
+def list_rules():
+    """全部规则及各自的触发次数（多进程模式下为各 worker 之和）"""
+    if router is None:
+        return jsonify(local_rules())
+    try:
+        parts = router.broadcast('rules')
+    except RouterError as e:
+        return jsonify({"error": f"无法汇总各 worker 的结果: {e}"}), 503
+    merged = {}
+    for part in parts:
+        for spec in part:
+            if spec["id"] in merged:
+                merged[spec["id"]]["fired"] += spec["fired"]
+            else:
+                merged[spec["id"]] = spec
+    return jsonify(list(merged.values()))
+
+@app.route('/rules', methods=['POST'])
+def create_rules():
+    """添加一条或多条规则（请求体为规则对象或数组），同ID的规则被替换"""
+    body = request.get_json(silent=True)
+    specs = body if isinstance(body, list) else [body]
+    try:
+        # 先全部校验，有无效规则时一条都不添加
+        parsed = [rules.Rule.from_dict(spec) for spec in specs]
+    except rules.RuleError as e:
+        return jsonify({"error": f"规则无效: {e}"}), 400
+    if router is None:
+        for rule in parsed:
+            rule_engine.add(rule)
+    else:
+        # 未指定ID的规则已在上面生成ID，各 worker 使用相同的ID
+        try:
+            router.broadcast('rules_add', [rule.to_dict() for rule in parsed])
+        except RouterError as e:
+            return jsonify({"error": f"无法在全部 worker 中添加规则: {e}"}), 503
+    return jsonify([rule.to_dict() for rule in parsed]), 201
+
+@app.route('/rules/<rule_id>', methods=['DELETE'])
+def delete_rule(rule_id):
+    if router is None:
+        removed = rule_engine.remove(rule_id) is not None
+    else:
+        try:
+            removed = any(router.broadcast('rules_remove', rule_id))
+        except RouterError as e:
+            return jsonify({"error": f"无法在全部 worker 中删除规则: {e}"}), 503
+    if not removed:
+        return jsonify({"error": "规则不存在"}), 404
+    return jsonify({"status": "ok"})
+
+@app.route('/rules/stats', methods=['GET'])
+def rule_stats():
+    """规则数、评估的消息和条件数、触发数、条件成立中的设备数和定时器数"""
+    if router is None:
+        return jsonify(rule_engine.stats())
+    try:
+        parts = router.broadcast('rules_stats')
+    except RouterError as e:
+        return jsonify({"error": f"无法汇总各 worker 的结果: {e}"}), 503
+    # 各 worker 的规则相同，其余计数相加
+    stats = dict(parts[0])
+    for part in parts[1:]:
+        for key, value in part.items():
+            if key not in ("rules", "index_keys"):
+                stats[key] += value
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 指标"""
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+def expire_devices():
+    """处理心跳超时的设备，返回离线设备ID列表"""
+    now = datetime.now().isoformat()
+    offline = []
+    with devices_lock:
+        if registry is not None:
+            expired = registry.expire(time.time() - DEVICE_TIMEOUT, DEVICE_OFFLINE_POLICY, worker_partitions)
+            for device_id, device_type, last_update in expired:
+                if DEVICE_OFFLINE_POLICY == 'mark':
+                    fleet_aggregates.set_status(device_id, 'offline')
+                else:
+                    fleet_aggregates.remove(device_id)
+                    device_reports.pop(device_id, None)
+                offline.append((device_id, {"device_type": device_type, "last_update": last_update}))
+        for device_id in liveness.expire():
+            if DEVICE_OFFLINE_POLICY == 'mark':
+                device = devices.get(device_id)
+                if device is None:
+                    continue
+                device['status'] = 'offline'
+                fleet_aggregates.set_status(device_id, 'offline')
+            else:
+                device = devices.pop(device_id, None)
+                if device is None:
+                    continue
+                fleet_aggregates.remove(device_id)
+                device_reports.pop(device_id, None)
+            offline.append((device_id, device))
+
+    (metrics.EXPIRED_MARK if DEVICE_OFFLINE_POLICY == 'mark' else metrics.EXPIRED_EVICT).inc(len(offline))
+    for device_id, device in offline:
+        if event_log is not None:
+            event_log.append(wal.KIND_OFFLINE, time.time(), [device_id, DEVICE_OFFLINE_POLICY])
+        log_device("设备离线", {"device_id": device_id, "device_type": device.get("device_type")})
+        rule_engine.observe(device_id, device.get("device_type"), {"status": "offline"})
+        if DEVICE_OFFLINE_POLICY != 'mark':
+            rule_engine.forget(device_id)
+        broker.publish(pubsub.KIND_STATUS, {
+            "device_id": device_id, "device_type": device.get("device_type"),
+            "status": "offline", "timestamp": now
+        })
+        record_event({
+            "device_id": device_id,
+            "device_type": device.get("device_type"),
+            "event_type": "device_offline",
+            "event_data": {"last_update": device.get("last_update")},
+            "timestamp": now
+        })
+    return [device_id for device_id, _ in offline]
+
 def clear_inactive_devices():
-    """清理不活跃的设备（超过30秒没有心跳）"""
+    """清理不活跃的设备（超过 DEVICE_TIMEOUT 秒没有心跳）"""
     while True:
-        current_time = datetime.now()
-        inactive_devices = []
-        for device_id, device in devices.items():
-            last_update = datetime.fromisoformat(device['last_update'])
-            if (current_time - last_update).seconds > 30:
-                inactive_devices.append(device_id)
-        
-        for device_id in inactive_devices:
-            print(f"\n设备离线：{device_id}")
-            devices.pop(device_id, None)
-        
-        threading.Event().wait(10)  # 每10秒检查一次
+        try:
+            expire_devices()
+            broker.expire_idle()
+        except Exception as e:
+            # 单次检查失败不能让清理线程退出，否则之后不再有设备过期
+            logger.error("设备过期检查失败", extra={"category": "device", "fields": {
+                "error": f"{type(e).__name__}: {e}"
+            }})
+        # 睡眠到最早的截止时间，没有设备时等待一个超时周期；共享设备表按固定间隔扫描
+        next_deadline = liveness.next_deadline()
+        if registry is not None:
+            delay = DEVICE_TIMEOUT / 4
+        elif next_deadline is None:
+            delay = DEVICE_TIMEOUT
+        else:
+            delay = next_deadline - time.monotonic()
+        threading.Event().wait(min(max(delay, 0.05), DEVICE_TIMEOUT))
 
-if __name__ == '__main__':
+def start_background_threads(run_discovery_thread=True):
+    global discovery
     # 启动清理线程
     cleanup_thread = threading.Thread(target=clear_inactive_devices)
     cleanup_thread.daemon = True
     cleanup_thread.start()
-    
-    # 启动服务器
+
+    rule_thread = threading.Thread(target=run_rule_timers)
+    rule_thread.daemon = True
+    rule_thread.start()
+
+    if DISCOVERY_URL and run_discovery_thread:
+        discovery = Discovery(DISCOVERY_URL, workers=int(os.environ.get('DISCOVERY_WORKERS', 64)))
+        discovery_thread = threading.Thread(target=run_discovery)
+        discovery_thread.daemon = True
+        discovery_thread.start()
+
+@app.route('/workers', methods=['GET'])
+def worker_stats():
+    """本 worker 的编号，以及与其它 worker 之间转交的请求数"""
+    if router is None:
+        return jsonify({"error": "未启用多进程模式"}), 404
+    return jsonify(router.stats())
+
+def handle_heartbeats(payload):
+    """处理其它 worker 转交的一组心跳，返回各心跳是否被接受"""
+    batch, now = payload
+    accepted = [apply_heartbeat(data, now) is not None for data in batch]
+    persist_sync()
+    return accepted
+
+def handle_event(event_data):
+    """处理其它 worker 转交的事件"""
+    apply_event(event_data)
+    persist_sync()
+
+def worker_handlers():
+    """其它 worker 可以请求本 worker 执行的操作"""
+    return {
+        "heartbeats": handle_heartbeats,
+        "event": handle_event,
+        "rule_control": dispatch_rule_control,
+        "rules": local_rules,
+        "rules_add": add_rules,
+        "rules_remove": lambda rule_id: rule_engine.remove(rule_id) is not None,
+        "rules_stats": lambda _: rule_engine.stats(),
+        "fleet_summary": lambda _: fleet_aggregates.summary(),
+        "fleet_verify": verify_local_fleet
+    }
+
+def check_persist_layout():
+    """检查持久化目录记录的 worker 数和分区数与当前配置一致
+
+    多进程模式下各 worker 只记录和恢复自己负责的设备，worker 数或分区数变化后已有的日志
+    不再对应各 worker 负责的设备，此时拒绝启动。没有记录的非空目录视为单进程模式写入的日志。
+    """
+    layout = {"workers": WORKERS, "partitions": registry.partitions if registry is not None else None}
+    path = os.path.join(PERSIST_DIR, 'layout.json')
+    os.makedirs(PERSIST_DIR, exist_ok=True)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            existing = json.load(f)
+    elif os.listdir(PERSIST_DIR):
+        existing = {"workers": 1, "partitions": None}
+    else:
+        existing = layout
+    if existing != layout:
+        sys.exit(f"PERSIST_DIR 中的日志由 WORKERS={existing['workers']}、REGISTRY_PARTITIONS={existing['partitions']} "
+                 f"写入，与当前配置不一致")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(layout, f)
+
+def run_worker(index, fd, port):
+    """worker 进程：在继承的监听套接字上运行多线程服务器"""
+    global worker_partitions, event_log
+    configure_logging()
+    # 各 worker 负责分区号 % WORKERS 等于自己编号的分区：处理其中设备的心跳和事件，并做过期检查
+    worker_partitions = range(index, registry.partitions, WORKERS)
+    if PERSIST_DIR:
+        event_log = open_event_log(os.path.join(PERSIST_DIR, f"worker-{index}"))
+        recover_state()
+        event_log.start()
+        # SIGTERM 时正常退出，写完缓冲区中的记录
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # 恢复完成后再接收其它 worker 转交的心跳
+    router.start(index, worker_handlers())
+    # 只由第一个 worker 执行 SSDP 发现
+    start_background_threads(run_discovery_thread=index == 0)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    try:
+        make_server('0.0.0.0', port, app, threaded=True, fd=fd).serve_forever()
+    finally:
+        if event_log is not None:
+            event_log.close()
+
+def serve_workers(port):
+    """父进程监听端口后 fork 出 WORKERS 个 worker，由内核在它们之间分配连接"""
+    if PERSIST_DIR:
+        check_persist_layout()
+    if RULES_FILE:
+        load_rules(RULES_FILE)
+    listener = socket.create_server(('0.0.0.0', port), backlog=1024)
+    children = []
+    for index in range(WORKERS):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(index, listener.fileno(), port)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"已启动 {WORKERS} 个 worker，端口: {port}")
+
+    def stop_workers(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop_workers)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop_workers(signal.SIGINT, None)
+
+if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8000))
-    app.run(host='0.0.0.0', port=port) 
\ No newline at end of file
+    if WORKERS > 1:
+        serve_workers(port)
+    else:
+        if event_log is not None:
+            check_persist_layout()
+            recover_state()
+            event_log.start()
+            atexit.register(event_log.close)
+            # SIGTERM 时正常退出，写完缓冲区中的记录
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if RULES_FILE:
+            load_rules(RULES_FILE)
+        start_background_threads()
+        # 启动服务器
+        app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,321 @@
+import heapq
+import itertools
+import logging
+import re
+import select
+import socket
+import struct
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from ssdpy.constants import ipv4_multicast_ip
+from ssdpy.http_helper import parse_headers
+from ssdpy.protocol import create_msearch_payload
+
+SSDP_PORT = 1900
+logger = logging.getLogger("controller")
+_MAX_AGE = re.compile(r"max-age\s*=\s*(\d+)", re.IGNORECASE)
+
+
+class DiscoveredDevice:
+    """发现缓存中的一条记录"""
+
+    __slots__ = ("usn", "location", "headers", "expires", "info", "error")
+
+    def __init__(self, usn, location, headers, expires):
+        self.usn = usn
+        self.location = location
+        self.headers = headers
+        self.expires = expires  # time.monotonic() 下的过期时间
+        self.info = None  # 探测得到的设备信息
+        self.error = None  # 探测失败的原因
+
+    @property
+    def origin(self):
+        """location 的 scheme://host:port，同一设备群进程下的设备相同"""
+        parts = urlsplit(self.location)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def to_dict(self):
+        return {
+            "usn": self.usn,
+            "location": self.location,
+            "device_id": self.headers.get("device-id"),
+            "device_status": self.headers.get("device-status"),
+            "expires_in": round(max(0.0, self.expires - time.monotonic()), 1),
+            "info": self.info,
+            "error": self.error
+        }
+
+
+class Discovery:
+    """并发的 SSDP 设备发现
+
+    M-SEARCH 的应答和组播 NOTIFY 在同一个接收循环中处理，按 USN 去重后立即把新设备
+    交给有界线程池并行探测（POST {location}/query），并按 host:port 去重调用
+    /set_controller_url，同一设备群进程只设置一次。缓存记录按 Cache-Control
+    的 max-age 过期，收到 ssdp:byebye 时立即移除。
+    """
+
+    def __init__(self, controller_url=None, workers=64, timeout=2,
+                 default_max_age=1800, probe_keys=("device_id", "device_type", "status")):
+        self.controller_url = controller_url
+        self.timeout = timeout
+        self.default_max_age = default_max_age
+        self.probe_keys = list(probe_keys)
+
+        self._cache = {}  # usn -> DiscoveredDevice
+        self._by_device = {}  # 设备ID -> DiscoveredDevice
+        self._origin_counts = Counter()  # origin -> 缓存中位于该地址的设备数
+        self._expiry = []  # (过期时间, 序号, DiscoveredDevice)，每条记录一个条目，刷新后到期时重新排入
+        self._expiry_seq = itertools.count()
+        self._origins = {}  # origin -> 已设置 controller_url 的 Future
+        self._pending = set()  # 未完成的探测和设置请求
+        # 已完成的 Future 会在提交线程中同步回调 _done，因此使用可重入锁
+        self._lock = threading.RLock()
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="discovery")
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._listen_sock = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def search(self, st="ssdp:all", mx=2, rounds=2, wait=None):
+        """发送 M-SEARCH 并收集应答，返回本次新发现的设备
+
+        rounds 轮请求在开始时依次发出，应答持续接收到 wait 秒（默认 mx + 1）。
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        payload = create_msearch_payload(f"{ipv4_multicast_ip}:{SSDP_PORT}", st, mx)
+        found = []
+        try:
+            for _ in range(rounds):
+                sock.sendto(payload, (ipv4_multicast_ip, SSDP_PORT))
+            deadline = time.monotonic() + (mx + 1 if wait is None else wait)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([sock], [], [], remaining)
+                if not readable:
+                    break
+                data, _ = sock.recvfrom(4096)
+                record = self._on_packet(data)
+                if record is not None:
+                    found.append(record)
+        finally:
+            sock.close()
+        return found
+
+    def start(self):
+        """在后台线程中监听组播 NOTIFY"""
+        if self._thread is not None:
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        mreq = socket.inet_aton(ipv4_multicast_ip) + struct.pack(b"@I", socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.bind(("0.0.0.0", SSDP_PORT))
+        sock.settimeout(1)
+        self._listen_sock = sock
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._listen_sock is not None:
+            self._listen_sock.close()
+            self._listen_sock = None
+        self._pool.shutdown(wait=False)
+        self._session.close()
+
+    def wait_idle(self, timeout=None):
+        """等待已提交的探测和 controller_url 设置完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                idle = not self._pending
+            if idle:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def devices(self):
+        """缓存中未过期的设备"""
+        self._expire()
+        with self._lock:
+            return list(self._cache.values())
+
+    def location(self, device_id):
+        """设备的 location，未发现或已过期时返回 None"""
+        with self._lock:
+            record = self._by_device.get(device_id)
+            if record is None:
+                return None
+            if record.expires <= time.monotonic():
+                self._drop(record.usn)
+                return None
+            return record.location
+
+    def origins(self):
+        """已发现设备所在的全部 scheme://host:port"""
+        self._expire()
+        with self._lock:
+            return sorted(self._origin_counts)
+
+    def __len__(self):
+        self._expire()
+        with self._lock:
+            return len(self._cache)
+
+    def stats(self):
+        self._expire()
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "probed": sum(1 for r in self._cache.values() if r.info is not None),
+                "probe_errors": sum(1 for r in self._cache.values() if r.error is not None),
+                "origins": len(self._origins)
+            }
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            try:
+                data, _ = self._listen_sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if data.startswith(b"NOTIFY"):
+                self._on_packet(data)
+
+    def _on_packet(self, data):
+        """处理一个应答或通告，新设备返回缓存记录，其余返回 None"""
+        try:
+            headers = parse_headers(data)
+        except ValueError:
+            return None
+        usn = headers.get("usn")
+        if not usn:
+            return None
+        if headers.get("nts") == "ssdp:byebye":
+            with self._lock:
+                self._drop(usn)
+            return None
+        location = headers.get("location")
+        if not location:
+            return None
+        match = _MAX_AGE.search(headers.get("cache-control", ""))
+        max_age = int(match.group(1)) if match else self.default_max_age
+        expires = time.monotonic() + max_age
+        with self._lock:
+            record = self._cache.get(usn)
+            if record is not None and record.location == location and record.expires > time.monotonic():
+                # 重复应答只刷新过期时间和头部字段
+                self._unindex(record, forget_origin=False)
+                record.expires = expires
+                record.headers = headers
+                self._index(record, schedule=False)
+                return None
+            self._drop(usn)
+            record = DiscoveredDevice(usn, location, headers, expires)
+            self._cache[usn] = record
+            self._index(record)
+            origin = record.origin
+            register = self.controller_url is not None and origin not in self._origins
+            if register:
+                self._origins[origin] = self._submit(self._set_controller_url, origin)
+            self._submit(self._probe, record)
+        return record
+
+    def _submit(self, fn, *args):
+        """提交到线程池并跟踪完成情况（调用方持有 _lock）"""
+        future = self._pool.submit(fn, *args)
+        self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _probe(self, record):
+        try:
+            response = self._session.post(
+                f"{record.location.rstrip('/')}/query", json={"keys": self.probe_keys}, timeout=self.timeout
+            )
+            response.raise_for_status()
+            record.info = response.json()
+            record.error = None
+        except (requests.RequestException, ValueError) as e:
+            record.error = str(e)
+
+    def _set_controller_url(self, origin):
+        try:
+            response = self._session.post(
+                f"{origin}/set_controller_url", json={"controller_url": self.controller_url}, timeout=self.timeout
+            )
+            response.raise_for_status()
+            return True
+        except requests.RequestException as e:
+            logger.warning("设置控制器地址失败", extra={"category": "discovery", "fields": {"origin": origin, "error": str(e)}})
+            with self._lock:
+                # 失败的地址下次发现时重试
+                self._origins.pop(origin, None)
+            return False
+
+    # 缓存索引（调用方持有 _lock）
+
+    def _index(self, record, schedule=True):
+        device_id = record.headers.get("device-id")
+        if device_id:
+            self._by_device[device_id] = record
+        self._origin_counts[record.origin] += 1
+        if schedule:
+            heapq.heappush(self._expiry, (record.expires, next(self._expiry_seq), record))
+
+    def _unindex(self, record, forget_origin=True):
+        device_id = record.headers.get("device-id")
+        if device_id and self._by_device.get(device_id) is record:
+            del self._by_device[device_id]
+        origin = record.origin
+        self._origin_counts[origin] -= 1
+        if not self._origin_counts[origin]:
+            del self._origin_counts[origin]
+            if forget_origin:
+                # 该地址上已没有设备：之后在同一地址重启的设备进程需要重新设置 controller_url
+                self._origins.pop(origin, None)
+
+    def _drop(self, usn):
+        record = self._cache.pop(usn, None)
+        if record is not None:
+            self._unindex(record)
+
+    def _expire(self):
+        """按过期时间堆移除已过期的记录，只处理到期的条目"""
+        now = time.monotonic()
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, _, record = heapq.heappop(self._expiry)
+                if self._cache.get(record.usn) is not record:
+                    continue  # 已被移除或替换
+                if record.expires <= now:
+                    self._drop(record.usn)
+                else:
+                    # 期间刷新过，按新的过期时间重新排入
+                    heapq.heappush(self._expiry, (record.expires, next(self._expiry_seq), record))
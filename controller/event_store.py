@@ -0,0 +1,167 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+
+class _SeqIndex:
+    """按序号升序排列的二级索引
+
+    新序号追加在尾部，过期序号从头部弹出；头部偏移量避免 list.pop(0) 的 O(n) 开销，
+    偏移过半时再整体压缩。
+    """
+
+    __slots__ = ('seqs', 'head')
+
+    def __init__(self):
+        self.seqs = []
+        self.head = 0
+
+    def append(self, seq):
+        self.seqs.append(seq)
+
+    def discard_head(self, seq):
+        """弹出头部的过期序号"""
+        if self.head < len(self.seqs) and self.seqs[self.head] == seq:
+            self.head += 1
+            if self.head > 64 and self.head * 2 > len(self.seqs):
+                del self.seqs[:self.head]
+                self.head = 0
+
+    def position(self, seq):
+        """第一个不小于 seq 的位置"""
+        return bisect_left(self.seqs, seq, self.head)
+
+    def __len__(self):
+        return len(self.seqs) - self.head
+
+
+class EventStore:
+    """固定容量的环形事件存储
+
+    事件按到达顺序分配递增序号，写入 seq % capacity 的槽位，写满后覆盖最旧的事件。
+    按设备ID、事件类型及二者组合维护序号索引，接收时间单调递增，可直接二分查找，
+    因此查询开销与结果数量成正比，而不是与历史总量成正比。
+    """
+
+    def __init__(self, capacity=1000000):
+        self.capacity = capacity
+        self._events = [None] * capacity
+        self._times = array('d', bytes(8 * capacity))  # 每个槽位的接收时间（epoch秒）
+        self._next_seq = 0
+        self._last_time = 0.0
+        self._by_device = {}
+        self._by_type = {}
+        self._by_device_type = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._next_seq, self.capacity)
+
+    @property
+    def oldest_seq(self):
+        return max(0, self._next_seq - self.capacity)
+
+    def append(self, event, received_at=None):
+        """写入事件，返回事件序号"""
+        device_id = event.get('device_id')
+        event_type = event.get('event_type')
+        with self._lock:
+            # 接收时间保持单调递增，保证可以按时间二分查找
+            now = received_at if received_at is not None else time.time()
+            if now < self._last_time:
+                now = self._last_time
+            self._last_time = now
+
+            seq = self._next_seq
+            slot = seq % self.capacity
+            if seq >= self.capacity:
+                self._evict(seq - self.capacity, self._events[slot])
+
+            event['seq'] = seq
+            self._events[slot] = event
+            self._times[slot] = now
+            self._index(self._by_device, device_id).append(seq)
+            self._index(self._by_type, event_type).append(seq)
+            self._index(self._by_device_type, (device_id, event_type)).append(seq)
+            self._next_seq = seq + 1
+            return seq
+
+    def query(self, device_id=None, event_type=None, since=None, until=None, cursor=None, limit=100):
+        """按条件查询事件，按序号升序返回 (事件列表, 下一页游标)
+
+        since/until 为接收时间（epoch秒），cursor 为上一页返回的游标（不含）。
+        """
+        with self._lock:
+            start = self.oldest_seq
+            if cursor is not None:
+                start = max(start, cursor + 1)
+            if since is not None:
+                start = max(start, self._first_seq_at(since))
+
+            if device_id is not None and event_type is not None:
+                index = self._by_device_type.get((device_id, event_type))
+            elif device_id is not None:
+                index = self._by_device.get(device_id)
+            elif event_type is not None:
+                index = self._by_type.get(event_type)
+            else:
+                index = None
+
+            if index is not None:
+                seqs = index.seqs
+                candidates = (seqs[i] for i in range(index.position(start), len(seqs)))
+            elif device_id is None and event_type is None:
+                candidates = range(start, self._next_seq)
+            else:
+                return [], None
+
+            result = []
+            for seq in candidates:
+                slot = seq % self.capacity
+                if until is not None and self._times[slot] > until:
+                    break
+                if len(result) >= limit:
+                    return result, result[-1]['seq']
+                result.append(self._events[slot])
+            return result, None
+
+    def latest(self, count):
+        """最近的 count 个事件，按时间顺序"""
+        with self._lock:
+            start = max(self.oldest_seq, self._next_seq - count)
+            return [self._events[seq % self.capacity] for seq in range(start, self._next_seq)]
+
+    def _first_seq_at(self, timestamp):
+        """第一个接收时间不早于 timestamp 的序号"""
+        lo, hi = self.oldest_seq, self._next_seq
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._times[mid % self.capacity] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _evict(self, seq, event):
+        device_id = event.get('device_id')
+        event_type = event.get('event_type')
+        self._discard(self._by_device, device_id, seq)
+        self._discard(self._by_type, event_type, seq)
+        self._discard(self._by_device_type, (device_id, event_type), seq)
+
+    @staticmethod
+    def _index(indexes, key):
+        index = indexes.get(key)
+        if index is None:
+            index = indexes[key] = _SeqIndex()
+        return index
+
+    @staticmethod
+    def _discard(indexes, key, seq):
+        index = indexes.get(key)
+        if index is None:
+            return
+        index.discard_head(seq)
+        if not len(index):
+            del indexes[key]
@@ -0,0 +1,53 @@
+import heapq
+import time
+
+
+class LivenessTracker:
+    """设备存活跟踪
+
+    每次心跳把设备的截止时间（单调时钟）压入最小堆，过期检查只弹出已到期的条目，
+    开销与过期设备数成正比。旧的截止时间不从堆中删除，出堆时与最新截止时间比对后丢弃。
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._deadlines = {}  # device_id -> 最新截止时间
+        self._heap = []  # (截止时间, device_id)
+
+    def touch(self, device_id, now=None):
+        """记录一次心跳，返回设备此前是否未被跟踪（新上线）"""
+        if now is None:
+            now = time.monotonic()
+        deadline = now + self.timeout
+        is_new = device_id not in self._deadlines
+        self._deadlines[device_id] = deadline
+        heapq.heappush(self._heap, (deadline, device_id))
+        # 过期条目过多时重建堆，保持内存有界
+        if len(self._heap) > 4 * len(self._deadlines) + 1024:
+            self._heap = [(d, k) for k, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        return is_new
+
+    def forget(self, device_id):
+        """停止跟踪设备"""
+        self._deadlines.pop(device_id, None)
+
+    def expire(self, now=None):
+        """弹出所有已过期的设备ID"""
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, device_id = heapq.heappop(heap)
+            if self._deadlines.get(device_id) == deadline:
+                del self._deadlines[device_id]
+                expired.append(device_id)
+        return expired
+
+    def next_deadline(self):
+        """最早的截止时间（可能是已作废的条目），没有设备时返回None"""
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._deadlines)
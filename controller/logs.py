@@ -0,0 +1,185 @@
+"""控制器的异步结构化日志
+
+请求处理线程只做采样/限速判断，通过的记录放入有界队列后立即返回，格式化和写入由
+QueueListener 的后台线程完成。队列满时丢弃记录并计数，不阻塞心跳接收。
+
+每条记录带有 category（heartbeat、batch、event、device 等）和 fields（结构化字段），
+可输出为控制台文本、调试模式下的表格，或写入按大小轮转的 JSON 行文件。
+"""
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from tabulate import tabulate
+
+LOGGER_NAME = "controller"
+
+# 调试模式下表格中各字段的显示名称
+FIELD_LABELS = {
+    "device_id": "设备ID",
+    "device_type": "设备类型",
+    "status": "状态",
+    "last_update": "最后更新",
+    "event_type": "事件类型",
+    "event_data": "事件数据",
+    "timestamp": "时间戳",
+}
+
+
+def parse_category_values(text):
+    """解析 "heartbeat=0.01, event=1" 形式的配置"""
+    values = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"无法解析日志配置: {item.strip()}")
+        values[name.strip()] = float(value)
+    return values
+
+
+class _Counters:
+    """各类被丢弃记录的计数"""
+
+    def __init__(self):
+        self.sampled = 0  # 采样丢弃
+        self.rate_limited = 0  # 限速丢弃
+        self.queue_full = 0  # 队列满丢弃
+        self.on_drop = None  # 丢弃时的回调，参数为原因
+
+
+counters = _Counters()
+
+
+def _dropped(reason):
+    setattr(counters, reason, getattr(counters, reason) + 1)
+    if counters.on_drop is not None:
+        counters.on_drop(reason)
+
+
+class CategoryLogger:
+    """某一类日志的入口，在创建 LogRecord 之前完成采样和限速
+
+    sample 为保留比例（1 表示全部保留），按计数确定性地每 1/sample 条保留一条；
+    rate_limit 为每秒最多记录的条数（令牌桶），0 表示不限速。
+    """
+
+    def __init__(self, logger, category, sample=1.0, rate_limit=0, level=logging.INFO):
+        self.logger = logger
+        self.category = category
+        self.level = level
+        self._every = max(1, round(1 / sample)) if sample > 0 else 0
+        self._count = 0
+        self._rate = rate_limit
+        self._tokens = float(rate_limit)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        """本条记录是否需要输出，调用方可据此跳过字段的构造"""
+        if not self._every or not self.logger.isEnabledFor(self.level):
+            return False
+        with self._lock:
+            self._count += 1
+            if self._count % self._every:
+                _dropped('sampled')
+                return False
+            if self._rate:
+                now = time.monotonic()
+                self._tokens = min(self._rate, self._tokens + (now - self._refilled) * self._rate)
+                self._refilled = now
+                if self._tokens < 1:
+                    _dropped('rate_limited')
+                    return False
+                self._tokens -= 1
+        return True
+
+    def log(self, message, fields=None):
+        """已通过 enabled() 判断后写入一条记录"""
+        self.logger.log(self.level, message, extra={"category": self.category, "fields": fields or {}})
+
+    def __call__(self, message, fields=None):
+        if self.enabled():
+            self.log(message, fields)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """放入有界队列，队列满时丢弃并计数，不做格式化"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped('queue_full')
+
+    def prepare(self, record):
+        # 格式化在后台线程中完成；fields 由调用方构造，之后不会再修改
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "category": getattr(record, "category", None),
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """单行文本；pretty 为 True 时把字段渲染为表格（调试模式）"""
+
+    def __init__(self, pretty=False):
+        super().__init__("%(asctime)s %(levelname)s [%(category)s] %(message)s")
+        self.pretty = pretty
+
+    def format(self, record):
+        if not hasattr(record, "category"):
+            record.category = "-"
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if not fields:
+            return line
+        if self.pretty:
+            rows = [["字段", "值"]] + [
+                [FIELD_LABELS.get(k, k), json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v]
+                for k, v in fields.items()
+            ]
+            return f"{line}\n{tabulate(rows, headers='firstrow', tablefmt='grid')}"
+        return line + " " + " ".join(f"{k}={v}" for k, v in fields.items())
+
+
+def setup(debug=False, log_file=None, max_bytes=50 * 1024 * 1024, backups=5,
+          queue_size=10000, console=True):
+    """配置控制器日志，返回 (logger, listener)，listener 已启动"""
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    handlers = []
+    if console:
+        stream = logging.StreamHandler()
+        stream.setFormatter(ConsoleFormatter(pretty=debug))
+        handlers.append(stream)
+    if log_file:
+        rotating = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        rotating.setFormatter(JsonLinesFormatter())
+        handlers.append(rotating)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    logger.addHandler(BoundedQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # 退出前输出队列中剩余的记录
+    atexit.register(listener.stop)
+    return logger, listener
@@ -0,0 +1,83 @@
+"""控制器 Prometheus 指标
+
+热路径上的指标在导入时就绑定好标签，调用时只做一次加法或分桶；
+设备数、事件存储和订阅者等状态类指标在抓取时才统计。
+"""
+from collections import Counter as _Tally
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+_LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+
+_heartbeats = Counter('controller_heartbeats', '接收的心跳数', ['format'])
+HEARTBEATS_JSON = _heartbeats.labels('json')
+HEARTBEATS_DELTA = _heartbeats.labels('delta-msgpack')
+HEARTBEATS_REJECTED = Counter('controller_heartbeats_rejected', '无效或无法解析的心跳数')
+
+_ingest_latency = Histogram(
+    'controller_heartbeat_ingest_seconds', '心跳请求的处理耗时', ['endpoint'], buckets=_LATENCY_BUCKETS)
+INGEST_SINGLE = _ingest_latency.labels('single')
+INGEST_BATCH = _ingest_latency.labels('batch')
+
+EVENTS_RECORDED = Counter('controller_events', '写入事件历史的事件数')
+
+_expired = Counter('controller_devices_expired', '心跳超时的设备数', ['policy'])
+EXPIRED_EVICT = _expired.labels('evict')
+EXPIRED_MARK = _expired.labels('mark')
+
+_rule_actions = Counter('controller_rule_actions', '规则触发执行的动作数', ['type', 'result'])
+RULE_EVENTS = _rule_actions.labels('event', 'ok')
+RULE_CONTROL_OK = _rule_actions.labels('control', 'ok')
+RULE_CONTROL_FAILED = _rule_actions.labels('control', 'failed')
+RULE_CONTROL_UNRESOLVED = _rule_actions.labels('control', 'unresolved')
+
+
+_log_dropped = Counter('controller_log_records_dropped', '未输出的日志记录数', ['reason'])
+_log_dropped_children = {reason: _log_dropped.labels(reason) for reason in ('sampled', 'rate_limited', 'queue_full')}
+
+
+def log_dropped(reason):
+    """日志记录被采样、限速或因队列满而丢弃"""
+    _log_dropped_children[reason].inc()
+
+
+class _StateCollector:
+    """抓取时统计设备表、事件存储和订阅状态"""
+
+    def __init__(self):
+        self.devices = None  # 返回 [(设备类型, 状态), ...] 的函数
+        self.event_store = None
+        self.broker = None
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        if self.devices is not None:
+            family = GaugeMetricFamily('controller_devices', '当前已知的设备数', labels=['device_type', 'status'])
+            for (device_type, status), value in _Tally(self.devices()).items():
+                family.add_metric([str(device_type), str(status)], value)
+            yield family
+        if self.event_store is not None:
+            yield GaugeMetricFamily('controller_event_store_events', '事件历史中保存的事件数',
+                                    value=len(self.event_store))
+        if self.broker is not None:
+            stats = self.broker.stats()
+            yield GaugeMetricFamily('controller_subscribers', '当前订阅者数', value=stats['subscribers'])
+            yield CounterMetricFamily('controller_subscriber_dropped', '当前订阅者因缓冲区满而丢弃的消息数',
+                                      value=stats['dropped'])
+
+
+_collector = _StateCollector()
+REGISTRY.register(_collector)
+
+
+def set_sources(devices=None, event_store=None, broker=None):
+    """设置抓取时统计的数据来源"""
+    if devices is not None:
+        _collector.devices = devices
+    if event_store is not None:
+        _collector.event_store = event_store
+    if broker is not None:
+        _collector.broker = broker
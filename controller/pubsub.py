@@ -0,0 +1,183 @@
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import deque
+
+# 消息类型
+KIND_HEARTBEAT = "heartbeat"
+KIND_EVENT = "event"
+KIND_STATUS = "status"  # 设备上线/离线
+KINDS = (KIND_HEARTBEAT, KIND_EVENT, KIND_STATUS)
+
+# 订阅者缓冲区满时的处理方式
+DROP_OLDEST = "drop-oldest"  # 丢弃最旧的消息并计数
+DISCONNECT = "disconnect"  # 断开订阅，由客户端重新订阅
+POLICIES = (DROP_OLDEST, DISCONNECT)
+
+
+def _as_set(value):
+    """把逗号分隔的字符串或列表转换为集合，空值表示不过滤"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    return {str(v).strip() for v in value if str(v).strip()} or None
+
+
+class Subscriber:
+    """一个订阅者：过滤条件和有界消息缓冲区
+
+    缓冲区中保存已序列化的消息，发布时每条消息只序列化一次，由全部订阅者共享。
+    """
+
+    def __init__(self, kinds=None, device_id=None, device_type=None, event_type=None,
+                 max_buffer=1000, policy=DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"不支持的缓冲策略: {policy}")
+        self.id = uuid.uuid4().hex
+        self.kinds = _as_set(kinds)
+        self.device_ids = _as_set(device_id)
+        self.device_types = _as_set(device_type)
+        self.event_types = _as_set(event_type)
+        if self.kinds and not self.kinds <= set(KINDS):
+            raise ValueError(f"不支持的消息类型: {','.join(sorted(self.kinds - set(KINDS)))}")
+        self.max_buffer = max_buffer
+        self.policy = policy
+        self.dropped = 0  # 因缓冲区满而丢弃的消息数
+        self.delivered = 0
+        self.closed = False
+        self.last_active = time.monotonic()
+        self._buffer = deque()
+        self._cond = threading.Condition()
+
+    def matches(self, kind, device_id, device_type, event_type):
+        if self.kinds is not None and kind not in self.kinds:
+            return False
+        if self.device_ids is not None and device_id not in self.device_ids:
+            return False
+        if self.device_types is not None and device_type not in self.device_types:
+            return False
+        if self.event_types is not None and (kind != KIND_EVENT or event_type not in self.event_types):
+            return False
+        return True
+
+    def offer(self, encoded):
+        """放入一条消息，不阻塞发布方"""
+        with self._cond:
+            if self.closed:
+                return
+            if len(self._buffer) >= self.max_buffer:
+                if self.policy == DISCONNECT:
+                    self.closed = True
+                    self._cond.notify_all()
+                    return
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(encoded)
+            self._cond.notify()
+
+    def get(self, timeout=None, max_items=1000):
+        """取出最多 max_items 条消息，缓冲区为空时最多等待 timeout 秒"""
+        with self._cond:
+            self.last_active = time.monotonic()
+            if not self._buffer and not self.closed and timeout:
+                self._cond.wait_for(lambda: self._buffer or self.closed, timeout)
+            items = []
+            while self._buffer and len(items) < max_items:
+                items.append(self._buffer.popleft())
+            self.delivered += len(items)
+            self.last_active = time.monotonic()
+            return items
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "id": self.id,
+                "buffered": len(self._buffer),
+                "max_buffer": self.max_buffer,
+                "policy": self.policy,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "closed": self.closed
+            }
+
+
+class Broker:
+    """心跳、事件和上下线通知的发布/订阅
+
+    publish() 只做过滤和非阻塞入队，慢订阅者按各自的策略丢弃消息或被断开，
+    不会反压心跳接收。长轮询订阅超过 idle_timeout 秒未取消息时自动移除。
+    """
+
+    def __init__(self, idle_timeout=60):
+        self.idle_timeout = idle_timeout
+        self._subscribers = {}  # id -> Subscriber
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, **filters):
+        subscriber = Subscriber(**filters)
+        with self._lock:
+            self._subscribers[subscriber.id] = subscriber
+        return subscriber
+
+    def unsubscribe(self, subscriber_id):
+        with self._lock:
+            subscriber = self._subscribers.pop(subscriber_id, None)
+        if subscriber is not None:
+            subscriber.close()
+        return subscriber
+
+    def get(self, subscriber_id):
+        with self._lock:
+            return self._subscribers.get(subscriber_id)
+
+    def publish(self, kind, payload):
+        """发布一条消息，payload 中的 device_id/device_type/event_type 用于过滤"""
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        device_id = payload.get("device_id")
+        device_type = payload.get("device_type")
+        event_type = payload.get("event_type")
+        with self._lock:
+            targets = [s for s in subscribers.values()
+                       if s.matches(kind, device_id, device_type, event_type)]
+        if not targets:
+            return
+        encoded = json.dumps({"seq": next(self._seq), "kind": kind, "data": payload},
+                             ensure_ascii=False, default=str)
+        self.published += 1
+        for subscriber in targets:
+            subscriber.offer(encoded)
+
+    def expire_idle(self):
+        """移除长时间未取消息和已断开的订阅"""
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            stale = [s for s in self._subscribers.values() if s.closed or s.last_active < deadline]
+            for subscriber in stale:
+                del self._subscribers[subscriber.id]
+        for subscriber in stale:
+            subscriber.close()
+        return len(stale)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers.values())
+        return {
+            "subscribers": len(subscribers),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subscribers)
+        }
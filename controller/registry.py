@@ -0,0 +1,288 @@
+import json
+import mmap
+import multiprocessing
+import struct
+import zlib
+from datetime import datetime
+
+# 状态在槽位中按编号存储
+STATUSES = ("unknown", "online", "offline", "error")
+_STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# 槽位状态
+_EMPTY = 0
+_USED = 1
+_DELETED = 2
+
+# 分区头：写序号（奇数表示正在写）、已用槽位数、删除标记数
+_PARTITION = struct.Struct('<III4x')
+# 槽位头：槽位状态、设备状态、最后心跳时间（epoch秒）、记录长度、设备ID、设备类型
+_SLOT = struct.Struct('<BB2xdI64s32s')
+_SLOT_HEADER = 128
+MAX_ID_BYTES = 64  # 设备ID 的最大 UTF-8 字节数，与槽位头中的字段等长
+MAX_TYPE_BYTES = 32  # 设备类型的最大 UTF-8 字节数
+# 心跳数据放不下时保留的设备字段
+_ESSENTIAL_FIELDS = ("device_id", "device_type", "status", "timestamp", "last_update")
+# 省略心跳数据时仍保留的 data 字段
+_STATE_FIELDS = ("current_power_consumption",)
+
+
+class RegistryFull(Exception):
+    """设备所在分区已没有空闲槽位"""
+
+
+class RecordRejected(ValueError):
+    """设备ID或类型不是字符串或过长，或只保留设备字段后记录仍超出槽位大小"""
+
+
+class SharedRegistry:
+    """多个 worker 进程共享的设备表
+
+    整张表是一块匿名共享内存（mmap），在 fork worker 之前创建。表按 device_id 的 CRC32
+    分为若干分区，每个分区是一段连续的槽位，用线性探测的开放寻址存放设备；每个槽位
+    保存设备ID、类型、状态、最后心跳时间和最新心跳的 JSON（超过 record_bytes 时省略 data 中功耗以外的字段）。
+    设备ID或类型不是字符串、超过槽位头中的字段长度，或省略字段后记录仍放不下时拒绝写入（RecordRejected），
+    不截断（截断的多字节字符无法解码）。
+
+    写入只锁设备所在的分区（进程间锁），不同分区的心跳可以并行写入。读取不加锁：
+    分区头中的写序号是一个 seqlock，读取方复制槽位后检查序号在读取前后未变化且为偶数，
+    否则重试，因此 /devices 和 /device/<id> 不会与心跳写入互相阻塞。
+    """
+
+    def __init__(self, capacity=65536, partitions=64, record_bytes=1024):
+        self.partitions = partitions
+        self.slots_per_partition = max(1, -(-capacity // partitions))
+        self.capacity = self.slots_per_partition * partitions
+        self.record_bytes = record_bytes
+        self.slot_bytes = _SLOT_HEADER + record_bytes
+        self._partition_bytes = self.slots_per_partition * self.slot_bytes
+        self._data_offset = partitions * _PARTITION.size
+        self._mm = mmap.mmap(-1, self._data_offset + self.partitions * self._partition_bytes)
+        self._locks = [multiprocessing.Lock() for _ in range(partitions)]
+
+    # 定位
+
+    def _locate(self, device_id):
+        if not isinstance(device_id, str):
+            raise RecordRejected("设备ID必须是字符串")
+        key = device_id.encode()
+        if len(key) > MAX_ID_BYTES:
+            # 截断后的ID无法再按原ID查到，同一设备的每个心跳都会占用一个新槽位
+            raise RecordRejected(f"设备ID超过 {MAX_ID_BYTES} 字节")
+        h = zlib.crc32(key)
+        return key, h % self.partitions, (h // self.partitions) % self.slots_per_partition
+
+    def partition(self, device_id):
+        """设备所在的分区，设备ID过长时抛出 RecordRejected"""
+        return self._locate(device_id)[1]
+
+    def _slot_offset(self, partition, index):
+        return self._data_offset + partition * self._partition_bytes + index * self.slot_bytes
+
+    def _header(self, partition):
+        return _PARTITION.unpack_from(self._mm, partition * _PARTITION.size)
+
+    def _set_header(self, partition, seq, used, deleted):
+        _PARTITION.pack_into(self._mm, partition * _PARTITION.size, seq, used, deleted)
+
+    def _probe(self, key, partition, start):
+        """返回 (设备所在槽位, 可插入的槽位)，未找到设备时前者为 None"""
+        free = None
+        for step in range(self.slots_per_partition):
+            index = (start + step) % self.slots_per_partition
+            state, _, _, _, slot_id, _ = _SLOT.unpack_from(self._mm, self._slot_offset(partition, index))
+            if state == _EMPTY:
+                return None, free if free is not None else index
+            if state == _DELETED:
+                if free is None:
+                    free = index
+            elif slot_id.rstrip(b'\0') == key:
+                return index, None
+        return None, free
+
+    # 写入（持有分区锁）
+
+    def put(self, device_id, device_type, status, last_seen, record):
+        """写入一个设备的最新心跳，返回写入前的状态，新设备返回 None"""
+        key, partition, start = self._locate(device_id)
+        if device_type is not None and not isinstance(device_type, str):
+            raise RecordRejected("设备类型必须是字符串")
+        type_key = (device_type or '').encode()
+        if len(type_key) > MAX_TYPE_BYTES:
+            raise RecordRejected(f"设备类型超过 {MAX_TYPE_BYTES} 字节")
+        payload = self._encode(record)
+        with self._locks[partition]:
+            index, free = self._probe(key, partition, start)
+            seq, used, deleted = self._header(partition)
+            if index is None:
+                if free is None:
+                    raise RegistryFull(f"设备表分区 {partition} 已满")
+                index = free
+                previous = None
+                offset = self._slot_offset(partition, index)
+                if self._mm[offset] == _DELETED:
+                    deleted -= 1
+                else:
+                    used += 1
+            else:
+                offset = self._slot_offset(partition, index)
+                previous = STATUSES[self._mm[offset + 1]]
+            self._set_header(partition, seq + 1, used, deleted)
+            _SLOT.pack_into(self._mm, offset, _USED, _STATUS_CODES.get(status, 0), last_seen, len(payload),
+                            key, type_key)
+            start = offset + _SLOT_HEADER
+            self._mm[start:start + len(payload)] = payload
+            self._set_header(partition, seq + 2, used, deleted)
+        return previous
+
+    def _encode(self, record):
+        """序列化心跳记录，超过 record_bytes 时逐级省略字段，不截断字节"""
+        payload = json.dumps(record, ensure_ascii=False, default=str).encode()
+        if len(payload) <= self.record_bytes:
+            return payload
+        # 先省略心跳数据（保留功耗），仍放不下时只保留设备字段
+        trimmed = {k: v for k, v in record.items() if k != 'data'}
+        if isinstance(record.get('data'), dict):
+            trimmed['data'] = {k: record['data'][k] for k in _STATE_FIELDS if k in record['data']}
+        trimmed['data_truncated'] = True
+        payload = json.dumps(trimmed, ensure_ascii=False, default=str).encode()
+        if len(payload) <= self.record_bytes:
+            return payload
+        trimmed = {k: record[k] for k in _ESSENTIAL_FIELDS if k in record}
+        trimmed['data_truncated'] = True
+        payload = json.dumps(trimmed, ensure_ascii=False, default=str).encode()
+        if len(payload) > self.record_bytes:
+            raise RecordRejected(f"设备记录超过 {self.record_bytes} 字节")
+        return payload
+
+    def expire(self, cutoff, policy='evict', partitions=None):
+        """处理最后心跳早于 cutoff 的设备，返回 [(设备ID, 设备类型, 最后更新时间), ...]
+
+        policy 为 mark 时把状态改为 offline，否则删除；partitions 为本进程负责的分区。
+        """
+        expired = []
+        for partition in (range(self.partitions) if partitions is None else partitions):
+            # 先不加锁地找出候选槽位，再在锁内逐个复核
+            candidates = [index for index, slot in self._scan(partition)
+                          if slot[1] < cutoff and (policy != 'mark' or slot[2] != 'offline')]
+            if not candidates:
+                continue
+            with self._locks[partition]:
+                seq, used, deleted = self._header(partition)
+                self._set_header(partition, seq + 1, used, deleted)
+                for index in candidates:
+                    offset = self._slot_offset(partition, index)
+                    state, status, last_seen, _, slot_id, slot_type = _SLOT.unpack_from(self._mm, offset)
+                    if state != _USED or last_seen >= cutoff:
+                        continue
+                    if policy == 'mark':
+                        if STATUSES[status] == 'offline':
+                            continue
+                        self._mm[offset + 1] = _STATUS_CODES['offline']
+                    else:
+                        self._mm[offset] = _DELETED
+                        used -= 1
+                        deleted += 1
+                    expired.append((slot_id.rstrip(b'\0').decode(), slot_type.rstrip(b'\0').decode() or None,
+                                    datetime.fromtimestamp(last_seen).isoformat()))
+                if deleted > self.slots_per_partition // 4:
+                    deleted = self._compact(partition)
+                self._set_header(partition, seq + 2, used, deleted)
+        return expired
+
+    def _compact(self, partition):
+        """清除删除标记，按探测顺序重新放置分区内的设备，返回新的删除标记数（0）"""
+        start = self._slot_offset(partition, 0)
+        raw = self._mm[start:start + self._partition_bytes]
+        self._mm[start:start + self._partition_bytes] = bytes(self._partition_bytes)
+        for index in range(self.slots_per_partition):
+            slot = raw[index * self.slot_bytes:(index + 1) * self.slot_bytes]
+            if slot[0] != _USED:
+                continue
+            key = _SLOT.unpack_from(slot)[4].rstrip(b'\0')
+            target = (zlib.crc32(key) // self.partitions) % self.slots_per_partition
+            while self._mm[self._slot_offset(partition, target)] != _EMPTY:
+                target = (target + 1) % self.slots_per_partition
+            offset = self._slot_offset(partition, target)
+            self._mm[offset:offset + self.slot_bytes] = slot
+        return 0
+
+    # 读取（不加锁，seqlock 重试）
+
+    def _read_consistent(self, partition, start, length):
+        while True:
+            before = self._header(partition)[0]
+            if before & 1:
+                continue
+            data = self._mm[start:start + length]
+            if self._header(partition)[0] == before:
+                return data
+
+    def _scan(self, partition):
+        """分区内全部设备的一致快照，生成 (槽位, (设备ID, 最后心跳, 状态, 设备类型, 记录))"""
+        data = self._read_consistent(partition, self._slot_offset(partition, 0), self._partition_bytes)
+        for index in range(self.slots_per_partition):
+            base = index * self.slot_bytes
+            if data[base] != _USED:
+                continue
+            _, status, last_seen, length, slot_id, slot_type = _SLOT.unpack_from(data, base)
+            yield index, (slot_id.rstrip(b'\0').decode(), last_seen, STATUSES[status],
+                          slot_type.rstrip(b'\0').decode() or None, (data, base + _SLOT_HEADER, length))
+
+    def get(self, device_id):
+        """设备最新的心跳记录，不存在时返回 None"""
+        try:
+            key, partition, start = self._locate(device_id)
+        except RecordRejected:
+            return None
+        for step in range(self.slots_per_partition):
+            index = (start + step) % self.slots_per_partition
+            offset = self._slot_offset(partition, index)
+            slot = self._read_consistent(partition, offset, self.slot_bytes)
+            state, status, _, length, slot_id, _ = _SLOT.unpack_from(slot)
+            if state == _EMPTY:
+                return None
+            if state == _USED and slot_id.rstrip(b'\0') == key:
+                record = json.loads(slot[_SLOT_HEADER:_SLOT_HEADER + length])
+                record['status'] = STATUSES[status]
+                return record
+        return None
+
+    def records(self, partitions=None):
+        """指定分区内全部设备的最新心跳记录 {设备ID: 记录}，状态取槽位中的值"""
+        result = {}
+        for partition in (range(self.partitions) if partitions is None else partitions):
+            for _, (device_id, _, status, _, (data, start, length)) in self._scan(partition):
+                record = json.loads(data[start:start + length])
+                record['status'] = status
+                result[device_id] = record
+        return result
+
+    def summaries(self):
+        """全部设备的 ID、类型、状态和最后更新时间"""
+        result = []
+        for partition in range(self.partitions):
+            for _, (device_id, last_seen, status, device_type, _) in self._scan(partition):
+                result.append({
+                    "device_id": device_id,
+                    "device_type": device_type,
+                    "status": status,
+                    "last_update": datetime.fromtimestamp(last_seen).isoformat()
+                })
+        return result
+
+    def type_status(self):
+        return [(device_type, status) for partition in range(self.partitions)
+                for _, (_, _, status, device_type, _) in self._scan(partition)]
+
+    def __len__(self):
+        return sum(self._header(partition)[1] for partition in range(self.partitions))
+
+    def stats(self):
+        return {
+            "devices": len(self),
+            "capacity": self.capacity,
+            "partitions": self.partitions,
+            "record_bytes": self.record_bytes,
+            "memory_bytes": len(self._mm)
+        }
@@ -0,0 +1,129 @@
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+
+class RouterError(Exception):
+    """转发给其它 worker 的请求失败或超时"""
+
+
+class WorkerRouter:
+    """多进程模式下 worker 之间的请求转发
+
+    父进程在 fork 之前为每个 worker 创建一个收件管道和一个回复管道。worker 把请求
+    (发送方, 序号, 操作, 参数) 写入目标 worker 的收件管道，目标 worker 的收件线程按到达顺序
+    依次调用对应的处理函数，把结果写回发送方的回复管道，由发送方的回复线程交给等待中的 Future。
+
+    处理函数只在本进程内执行，不会再等待其它 worker 的回复，因此不会出现相互等待。
+    同一个 worker 的收件线程按到达顺序逐个执行请求，适合需要保持顺序的写入（如心跳）。
+    """
+
+    def __init__(self, workers, timeout=5.0):
+        self.workers = workers
+        self.timeout = timeout
+        context = multiprocessing.get_context('fork')
+        self._inboxes = [context.SimpleQueue() for _ in range(workers)]
+        self._replies = [context.SimpleQueue() for _ in range(workers)]
+        self.index = None
+        self._handlers = {}
+        self._pending = {}  # 序号 -> Future
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.sent = 0  # 转发给其它 worker 的请求数
+        self.handled = 0  # 收件线程处理的请求数
+        self.failed = 0  # 失败或超时的转发请求数
+        self.errors = 0  # 收件线程执行时抛出异常的请求数（cast 的请求没有回复，只在此计数）
+
+    def start(self, index, handlers):
+        """在 worker 进程中调用：记录本 worker 的编号并启动收件和回复线程"""
+        self.index = index
+        self._handlers = handlers
+        for target in (self._serve, self._receive_replies):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+
+    def call(self, worker, op, payload=None):
+        """请求 worker 执行 op，返回 Future；目标是本 worker 时直接在当前线程执行"""
+        future = Future()
+        if worker == self.index:
+            try:
+                future.set_result(self._handlers[op](payload))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        seq = next(self._seq)
+        with self._lock:
+            self._pending[seq] = future
+            self.sent += 1
+        self._inboxes[worker].put((self.index, seq, op, payload))
+        return future
+
+    def cast(self, worker, op, payload=None):
+        """请求 worker 执行 op，不等待结果
+
+        目标是本 worker 时同样放入收件管道，与其它 worker 转交的请求按到达顺序执行；
+        收件线程执行的处理函数不能向本 worker cast，否则管道写满时会等待自己读取。
+        """
+        if worker != self.index:
+            with self._lock:
+                self.sent += 1
+        self._inboxes[worker].put((None, None, op, payload))
+
+    def result(self, future):
+        """等待转发请求的结果，失败或超时时抛出 RouterError"""
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.failed += 1
+            raise RouterError(f"worker 在 {self.timeout} 秒内没有响应")
+        except RouterError:
+            with self._lock:
+                self.failed += 1
+            raise
+
+    def broadcast(self, op, payload=None):
+        """请求全部 worker 执行 op，按 worker 编号返回结果列表"""
+        # 先发出对其它 worker 的请求，再执行本 worker 的部分
+        others = {worker: self.call(worker, op, payload) for worker in range(self.workers) if worker != self.index}
+        local = self.call(self.index, op, payload)
+        return [self.result(local if worker == self.index else others[worker]) for worker in range(self.workers)]
+
+    def _serve(self):
+        inbox = self._inboxes[self.index]
+        while True:
+            sender, seq, op, payload = inbox.get()
+            try:
+                reply = (seq, True, self._handlers[op](payload))
+            except Exception as e:
+                reply = (seq, False, f"{type(e).__name__}: {e}")
+                self.errors += 1
+            self.handled += 1
+            if sender is not None:
+                self._replies[sender].put(reply)
+
+    def _receive_replies(self):
+        replies = self._replies[self.index]
+        while True:
+            seq, ok, result = replies.get()
+            with self._lock:
+                future = self._pending.pop(seq, None)
+            if future is None or future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RouterError(result))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "worker": self.index,
+                "workers": self.workers,
+                "sent": self.sent,
+                "handled": self.handled,
+                "failed": self.failed,
+                "errors": self.errors,
+                "waiting": len(self._pending)
+            }
@@ -0,0 +1,318 @@
+"""控制器规则引擎：对到达的每个心跳和事件增量评估声明式规则
+
+一条规则是某个设备字段上的条件和条件成立时执行的动作，例如冰箱门打开超过2分钟时生成事件：
+
+    {"id": "fridge-door", "device_type": "refrigerator", "field": "door_open", "value": true,
+     "for": 120, "actions": [{"type": "event", "event_type": "door_left_open"}]}
+
+规则按 (范围, 字段) 建立索引，范围是规则限定的设备ID、设备类型或任意设备。每条消息的每个
+字段只查三次索引，只评估可能匹配的规则，开销与规则总数无关。
+
+规则是边沿触发的：条件对某个设备由不成立变为成立时触发一次，直到条件不成立后再次成立才会
+再触发。带 for 的规则在条件成立时登记定时器，到期时条件仍然成立才触发；定时器不从堆中删除，
+到期时与设备当前的条件状态比对，状态已变化的直接丢弃。
+"""
+import heapq
+import itertools
+import operator
+import threading
+import time
+import uuid
+from datetime import datetime
+
+OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "in": lambda value, expected: value in expected,
+}
+
+# 动作类型
+ACTION_EVENT = "event"  # 生成一个事件，写入事件历史并推送给订阅者
+ACTION_CONTROL = "control"  # 调用设备的 /control 接口
+ACTION_TYPES = (ACTION_EVENT, ACTION_CONTROL)
+
+# control 动作的 device_id 为该值时指触发规则的设备
+TRIGGER_DEVICE = "$device"
+
+
+class RuleError(ValueError):
+    """规则定义无效"""
+
+
+def _check_types(spec, names, expected, label):
+    """spec 中给出的 names 字段必须是 expected 类型"""
+    for name in names:
+        if spec.get(name) is not None and not isinstance(spec[name], expected):
+            raise RuleError(f"{name} 必须是{label}")
+
+
+def _check_action(action):
+    if not isinstance(action, dict) or action.get("type") not in ACTION_TYPES:
+        raise RuleError(f"动作类型必须是 {', '.join(ACTION_TYPES)} 之一")
+    # 这些值在规则触发时才使用（拼接地址、合并事件数据），需要先校验
+    _check_types(action, ("event_type", "action", "device_id", "url"), str, "字符串")
+    _check_types(action, ("data", "params", "target"), dict, "对象")
+    if action["type"] == ACTION_CONTROL:
+        if not action.get("action"):
+            raise RuleError("control 动作需要 action 参数")
+        if not action.get("device_id") and not isinstance(action.get("target"), dict):
+            raise RuleError("control 动作需要 device_id 或 target")
+    return action
+
+
+class Rule:
+    """一条规则：字段条件、可选的持续时间和动作列表"""
+
+    __slots__ = ("id", "device_type", "device_id", "event_type", "field", "op", "value", "window",
+                 "actions", "fired", "_test")
+
+    def __init__(self, field, value, op="==", rule_id=None, device_type=None, device_id=None,
+                 event_type=None, window=0, actions=()):
+        if not isinstance(op, str) or op not in OPS:
+            raise RuleError(f"不支持的比较运算: {op}")
+        if op == "in" and not isinstance(value, (list, tuple)):
+            raise RuleError("in 运算需要列表")
+        if not field or not isinstance(field, str):
+            raise RuleError("规则需要字符串 field 参数")
+        # 设备ID、设备类型和字段组成索引键
+        _check_types({"device_type": device_type, "device_id": device_id, "event_type": event_type},
+                     ("device_type", "device_id", "event_type"), str, "字符串")
+        if not isinstance(window, (int, float)) or window < 0:
+            raise RuleError("for 必须是非负的秒数")
+        self.id = rule_id or uuid.uuid4().hex
+        self.device_type = device_type
+        self.device_id = device_id
+        self.event_type = event_type
+        self.field = field
+        self.op = op
+        self.value = value
+        self.window = window  # 条件需要持续成立的秒数，0 表示立即触发
+        self.actions = [_check_action(action) for action in actions]
+        self.fired = 0
+        self._test = OPS[op]
+
+    @classmethod
+    def from_dict(cls, spec):
+        if not isinstance(spec, dict):
+            raise RuleError("规则必须是对象")
+        if "value" not in spec:
+            raise RuleError("规则需要 value 参数")
+        actions = spec.get("actions", [])
+        if not isinstance(actions, list):
+            raise RuleError("actions 必须是列表")
+        return cls(spec.get("field"), spec["value"], op=spec.get("op", "=="), rule_id=spec.get("id"),
+                   device_type=spec.get("device_type"), device_id=spec.get("device_id"),
+                   event_type=spec.get("event_type"), window=spec.get("for", 0), actions=actions)
+
+    @property
+    def key(self):
+        """索引键：规则限定的最窄范围和字段"""
+        if self.device_id is not None:
+            return ("device", self.device_id, self.field)
+        if self.device_type is not None:
+            return ("type", self.device_type, self.field)
+        return ("any", None, self.field)
+
+    def test(self, value):
+        try:
+            return bool(self._test(value, self.value))
+        except TypeError:
+            # 类型不可比较（例如 None > 5）视为不成立
+            return False
+
+    def to_dict(self):
+        spec = {"id": self.id, "field": self.field, "op": self.op, "value": self.value}
+        for name in ("device_type", "device_id", "event_type"):
+            if getattr(self, name) is not None:
+                spec[name] = getattr(self, name)
+        if self.window:
+            spec["for"] = self.window
+        spec["actions"] = self.actions
+        spec["fired"] = self.fired
+        return spec
+
+
+class RuleEngine:
+    """按设备维护各规则的条件状态，消息到达时评估，定时器到期时触发带 for 的规则
+
+    触发时在锁外调用 on_fire(规则, 触发信息)。
+    """
+
+    def __init__(self, on_fire=None):
+        self.on_fire = on_fire
+        self._rules = {}  # rule_id -> Rule
+        self._index = {}  # (范围, 设备ID或类型, 字段) -> [Rule]
+        self._active = {}  # device_id -> {rule_id: (成立时的单调时间, 成立时间 epoch, 值, 设备类型)}
+        self._timers = []  # (到期时间, 序号, Rule, device_id, 成立时的单调时间)
+        self._timer_limit = 1024  # 堆超过该长度时清理已作废的定时器
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.messages = 0
+        self.evaluations = 0  # 实际评估的条件数
+        self.fired = 0
+
+    # 规则管理
+
+    def add(self, rule):
+        """添加规则，同ID的规则被替换"""
+        with self._cond:
+            self._remove(rule.id)
+            self._rules[rule.id] = rule
+            self._index.setdefault(rule.key, []).append(rule)
+        return rule
+
+    def remove(self, rule_id):
+        """删除规则，返回被删除的规则，不存在时返回 None"""
+        with self._cond:
+            return self._remove(rule_id)
+
+    def _remove(self, rule_id):
+        rule = self._rules.pop(rule_id, None)
+        if rule is None:
+            return None
+        rules = self._index[rule.key]
+        rules.remove(rule)
+        if not rules:
+            del self._index[rule.key]
+        # 清除该规则的条件状态，其定时器到期时因规则已不在表中被丢弃
+        for device_id in [d for d, active in self._active.items() if rule_id in active]:
+            active = self._active[device_id]
+            del active[rule_id]
+            if not active:
+                del self._active[device_id]
+        return rule
+
+    def rules(self):
+        with self._cond:
+            return list(self._rules.values())
+
+    def __len__(self):
+        return len(self._rules)
+
+    # 评估
+
+    def observe(self, device_id, device_type, fields, event_type=None, now=None):
+        """评估一条消息中的字段（心跳状态或事件数据），返回立即触发的规则数"""
+        firings = []
+        with self._cond:
+            self.messages += 1
+            index = self._index
+            if not index:
+                return 0
+            if now is None:
+                now = time.monotonic()
+            for field, value in fields.items():
+                for key in (("device", device_id, field), ("type", device_type, field), ("any", None, field)):
+                    rules = index.get(key)
+                    if rules:
+                        self._evaluate(rules, device_id, device_type, event_type, value, now, firings)
+            self._count(firings)
+        self._fire(firings)
+        return len(firings)
+
+    def _evaluate(self, rules, device_id, device_type, event_type, value, now, firings):
+        for rule in rules:
+            if rule.event_type is not None and rule.event_type != event_type:
+                continue
+            if rule.device_type is not None and rule.device_type != device_type:
+                continue
+            self.evaluations += 1
+            active = self._active.get(device_id)
+            was = active is not None and rule.id in active
+            if rule.test(value):
+                if was:
+                    continue
+                if active is None:
+                    active = self._active[device_id] = {}
+                entry = active[rule.id] = (now, time.time(), value, device_type)
+                if rule.window:
+                    self._schedule(now + rule.window, rule, device_id, now)
+                else:
+                    firings.append((rule, device_id, entry))
+            elif was:
+                del active[rule.id]
+                if not active:
+                    del self._active[device_id]
+
+    def forget(self, device_id):
+        """设备已从设备表移除，清除其条件状态"""
+        with self._cond:
+            self._active.pop(device_id, None)
+
+    # 定时器
+
+    def _schedule(self, deadline, rule, device_id, since):
+        timers = self._timers
+        earliest = not timers or deadline < timers[0][0]
+        heapq.heappush(timers, (deadline, next(self._seq), rule, device_id, since))
+        if len(timers) > self._timer_limit:
+            self._timers = [timer for timer in timers if self._current(*timer[2:])]
+            heapq.heapify(self._timers)
+            self._timer_limit = max(1024, 4 * len(self._timers))
+        if earliest:
+            self._cond.notify_all()
+
+    def _current(self, rule, device_id, since):
+        """定时器对应的条件状态仍然有效时返回该状态"""
+        entry = self._active.get(device_id, {}).get(rule.id)
+        if entry is None or entry[0] != since or self._rules.get(rule.id) is not rule:
+            return None
+        return entry
+
+    def fire_due(self, now=None):
+        """触发已到期且条件仍然成立的定时器，返回触发数"""
+        if now is None:
+            now = time.monotonic()
+        firings = []
+        with self._cond:
+            timers = self._timers
+            while timers and timers[0][0] <= now:
+                _, _, rule, device_id, since = heapq.heappop(timers)
+                entry = self._current(rule, device_id, since)
+                if entry is not None:
+                    firings.append((rule, device_id, entry))
+            self._count(firings)
+        self._fire(firings)
+        return len(firings)
+
+    def wait(self, timeout):
+        """等到最早的定时器到期、登记了更早的定时器或超过 timeout 秒"""
+        with self._cond:
+            if self._timers:
+                timeout = min(timeout, self._timers[0][0] - time.monotonic())
+            if timeout > 0:
+                self._cond.wait(timeout)
+
+    def _count(self, firings):
+        for rule, _, _ in firings:
+            rule.fired += 1
+        self.fired += len(firings)
+
+    def _fire(self, firings):
+        if self.on_fire is None:
+            return
+        for rule, device_id, (_, since, value, device_type) in firings:
+            self.on_fire(rule, {
+                "rule_id": rule.id,
+                "device_id": device_id,
+                "device_type": device_type,
+                "field": rule.field,
+                "value": value,
+                "since": datetime.fromtimestamp(since).isoformat()
+            })
+
+    def stats(self):
+        with self._cond:
+            return {
+                "rules": len(self._rules),
+                "index_keys": len(self._index),
+                "messages": self.messages,
+                "evaluations": self.evaluations,
+                "fired": self.fired,
+                "active": sum(len(active) for active in self._active.values()),
+                "timers": len(self._timers)
+            }
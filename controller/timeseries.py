@@ -0,0 +1,303 @@
+import threading
+from array import array
+from itertools import chain
+from collections import OrderedDict
+
+RAW = 'raw'
+MINUTE = 'minute'
+HOUR = 'hour'
+RESOLUTIONS = (RAW, MINUTE, HOUR)
+_BUCKET_SECONDS = {MINUTE: 60, HOUR: 3600}
+
+
+class _Ring:
+    """固定容量的环形数组：一列时间加若干数值列，按时间升序追加，写满后覆盖最旧的行
+
+    各列使用 array 而不是 Python 对象，每行只占几个到十几个字节。
+    """
+
+    __slots__ = ('capacity', 'times', 'columns', 'next')
+
+    def __init__(self, capacity, time_code, column_codes):
+        self.capacity = capacity
+        self.times = array(time_code, bytes(array(time_code).itemsize * capacity))
+        self.columns = tuple(array(code, bytes(array(code).itemsize * capacity)) for code in column_codes)
+        self.next = 0  # 下一行的逻辑序号
+
+    def append(self, t, *values):
+        slot = self.next % self.capacity
+        self.times[slot] = t
+        for column, value in zip(self.columns, values):
+            column[slot] = value
+        self.next += 1
+
+    @property
+    def oldest(self):
+        return max(0, self.next - self.capacity)
+
+    def oldest_time(self):
+        if not self.next:
+            return None
+        return self.times[self.oldest % self.capacity]
+
+    def _first(self, lo, t, inclusive):
+        """[lo, next) 中第一个时间不小于 t（inclusive 为假时大于 t）的行的序号"""
+        hi = self.next
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.times[mid % self.capacity]
+            if value < t or (not inclusive and value == t):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def rows(self, since=None, until=None):
+        """时间在 [since, until] 内的行，按时间升序"""
+        lo = self.oldest if since is None else self._first(self.oldest, since, True)
+        for seq in range(lo, self.next):
+            slot = seq % self.capacity
+            t = self.times[slot]
+            if until is not None and t > until:
+                break
+            yield (t,) + tuple(column[slot] for column in self.columns)
+
+    def copy(self, since=None, until=None):
+        """时间在 [since, until] 内的行的副本 (时间列, 数值列, ...)，按时间升序
+
+        用数组切片复制，持锁时调用的开销很小，遍历副本可以在锁外进行。
+        """
+        lo = self.oldest if since is None else self._first(self.oldest, since, True)
+        hi = self.next if until is None else self._first(lo, until, False)
+        start, count = lo % self.capacity, hi - lo
+
+        def take(values):
+            if start + count <= self.capacity:
+                return values[start:start + count]
+            return values[start:] + values[:start + count - self.capacity]
+        return tuple(take(values) for values in (self.times,) + self.columns)
+
+    @property
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in (self.times,) + self.columns)
+
+
+class _Bucket:
+    """尚未写入环形数组的当前聚合桶"""
+
+    __slots__ = ('start', 'min', 'max', 'total', 'count')
+
+    def __init__(self, start, low, high, total, count):
+        self.start = start
+        self.min = low
+        self.max = high
+        self.total = total
+        self.count = count
+
+    def merge(self, low, high, total, count):
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+        self.total += total
+        self.count += count
+
+    def row(self):
+        return self.start, self.min, self.max, self.total / self.count, self.count
+
+
+def _rollup_ring(capacity):
+    # 桶起始时间（epoch秒）、最小值、最大值、平均值、样本数
+    return _Ring(capacity, 'I', ('f', 'f', 'f', 'I'))
+
+
+class _Series:
+    """单个设备的功耗序列：原始样本，以及逐级汇总的分钟和小时 min/max/avg"""
+
+    __slots__ = ('device_type', 'raw', 'minutes', 'hours', '_minute', '_hour', 'last')
+
+    def __init__(self, device_type, raw_capacity, minute_capacity, hour_capacity):
+        self.device_type = device_type
+        self.raw = _Ring(raw_capacity, 'd', ('f',))
+        self.minutes = _rollup_ring(minute_capacity)
+        self.hours = _rollup_ring(hour_capacity)
+        self._minute = None
+        self._hour = None
+        self.last = None
+
+    def add(self, t, value):
+        self.raw.append(t, value)
+        self.last = t
+        start = int(t // 60) * 60
+        if self._minute is not None and self._minute.start != start:
+            self._close_minute()
+        if self._minute is None:
+            self._minute = _Bucket(start, value, value, value, 1)
+        else:
+            self._minute.merge(value, value, value, 1)
+
+    def _close_minute(self):
+        bucket = self._minute
+        self._minute = None
+        self.minutes.append(*bucket.row())
+        start = bucket.start // 3600 * 3600
+        if self._hour is not None and self._hour.start != start:
+            self.hours.append(*self._hour.row())
+            self._hour = None
+        if self._hour is None:
+            self._hour = _Bucket(start, bucket.min, bucket.max, bucket.total, bucket.count)
+        else:
+            self._hour.merge(bucket.min, bucket.max, bucket.total, bucket.count)
+
+    def open_buckets(self, resolution):
+        """当前尚未写入环形数组的桶，按时间升序"""
+        if resolution == MINUTE:
+            return [self._minute] if self._minute is not None else []
+        result = []
+        hour = self._hour
+        if hour is not None:
+            hour = _Bucket(hour.start, hour.min, hour.max, hour.total, hour.count)
+            result.append(hour)
+        minute = self._minute
+        if minute is not None:
+            start = minute.start // 3600 * 3600
+            if hour is not None and hour.start == start:
+                hour.merge(minute.min, minute.max, minute.total, minute.count)
+            else:
+                result.append(_Bucket(start, minute.min, minute.max, minute.total, minute.count))
+        return result
+
+    def points(self, resolution, since=None, until=None):
+        """原始分辨率返回 (t, value)，汇总分辨率返回 (t, min, max, avg, count)"""
+        if resolution == RAW:
+            return list(self.raw.rows(since, until))
+        return list(self.rollup_rows(resolution, since, until))
+
+    def rollup_rows(self, resolution, since=None, until=None):
+        """汇总分辨率的 (t, min, max, avg, count) 迭代器，环形数组中的行已复制，可以在锁外遍历"""
+        ring = self.minutes if resolution == MINUTE else self.hours
+        # 桶与 [since, until] 有交集即返回
+        lower = None if since is None else since - _BUCKET_SECONDS[resolution] + 1
+        opened = [bucket.row() for bucket in self.open_buckets(resolution)
+                  if (lower is None or bucket.start >= lower) and (until is None or bucket.start <= until)]
+        return chain(zip(*ring.copy(lower, until)), opened)
+
+    def covers(self, resolution, since):
+        """该分辨率是否仍保留着 since 之后的全部数据（环形数组尚未覆盖，或最早一行不晚于 since）"""
+        ring = {RAW: self.raw, MINUTE: self.minutes, HOUR: self.hours}[resolution]
+        return ring.next <= ring.capacity or ring.oldest_time() <= since
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes + self.minutes.nbytes + self.hours.nbytes
+
+
+class TimeSeriesStore:
+    """各设备功耗的多分辨率时间序列
+
+    每个设备预先分配三个固定容量的环形数组：原始样本（时间 8 字节 + 值 4 字节），
+    分钟和小时汇总（桶起点、min、max、avg、样本数，各 4 字节）。单个设备的内存
+    因此是常数 bytes_per_device；设备数达到 max_devices 时，新设备替换最久没有
+    样本的设备，总内存不会超过预算。
+
+    默认容量：原始样本 720 个（5 秒一个样本约 1 小时），分钟汇总 1440 个（1 天），
+    小时汇总 168 个（1 周），每设备约 40KB，1 万个设备约 400MB。
+    """
+
+    def __init__(self, raw_capacity=720, minute_capacity=1440, hour_capacity=168, memory_budget=512 * 1024 * 1024):
+        self.raw_capacity = raw_capacity
+        self.minute_capacity = minute_capacity
+        self.hour_capacity = hour_capacity
+        self.bytes_per_device = _Series(None, raw_capacity, minute_capacity, hour_capacity).nbytes
+        self.memory_budget = memory_budget
+        self.max_devices = max(1, memory_budget // self.bytes_per_device)
+        self._series = OrderedDict()  # device_id -> _Series，按最近写入样本的顺序排列
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.out_of_order = 0  # 早于该设备上一个样本而被丢弃的样本数
+        self.replaced = 0  # 因设备数达到上限而被替换的设备数
+
+    def add(self, device_id, device_type, t, value):
+        """写入一个样本，t 为 epoch 秒"""
+        with self._lock:
+            series = self._series.get(device_id)
+            if series is None:
+                if len(self._series) >= self.max_devices:
+                    # 最前面的是最久没有写入样本的设备
+                    self._series.popitem(last=False)
+                    self.replaced += 1
+                series = self._series[device_id] = _Series(
+                    device_type, self.raw_capacity, self.minute_capacity, self.hour_capacity)
+            elif t < series.last:
+                self.out_of_order += 1
+                return False
+            else:
+                self._series.move_to_end(device_id)
+            series.device_type = device_type
+            series.add(t, value)
+            self.samples += 1
+            return True
+
+    def query(self, device_id, since=None, until=None, resolution=None):
+        """单个设备的序列，返回 (分辨率, 点列表)，设备不存在时返回 (分辨率, None)"""
+        with self._lock:
+            series = self._series.get(device_id)
+            if series is None:
+                return resolution or RAW, None
+            resolution = resolution or self._pick_resolution([series], since)
+            return resolution, series.points(self._check(resolution), since, until)
+
+    def fleet(self, since=None, until=None, resolution=None, device_type=None):
+        """全部（或某一类型）设备在各汇总桶内的功耗合计
+
+        返回 (分辨率, [(桶起点, 平均功耗合计, 最小值合计, 最大值合计, 设备数), ...])。
+        原始样本的时间不对齐，不支持合计。每个设备的行在持锁时按数组切片复制，在锁外逐行累加，
+        查询期间心跳写入只需等待单个设备的复制。
+        """
+        with self._lock:
+            selected = [s for s in self._series.values() if device_type is None or s.device_type == device_type]
+            resolution = resolution or self._pick_resolution(selected, since, rollup_only=True)
+        if self._check(resolution) == RAW:
+            raise ValueError("全体设备的功耗只支持 minute 或 hour 分辨率")
+        totals = {}
+        for series in selected:
+            with self._lock:
+                rows = series.rollup_rows(resolution, since, until)
+            for start, low, high, avg, _ in rows:
+                row = totals.get(start)
+                if row is None:
+                    totals[start] = [avg, low, high, 1]
+                else:
+                    row[0] += avg
+                    row[1] += low
+                    row[2] += high
+                    row[3] += 1
+        return resolution, [(start,) + tuple(row) for start, row in sorted(totals.items())]
+
+    def _pick_resolution(self, selected, since, rollup_only=False):
+        """选择能覆盖 since 之后全部数据的最细分辨率，不指定 since 时使用最细分辨率"""
+        candidates = (MINUTE, HOUR) if rollup_only else RESOLUTIONS
+        if since is None:
+            return candidates[0]
+        for resolution in candidates[:-1]:
+            if all(s.covers(resolution, since) for s in selected):
+                return resolution
+        return candidates[-1]
+
+    @staticmethod
+    def _check(resolution):
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"分辨率必须是 {', '.join(RESOLUTIONS)} 之一")
+        return resolution
+
+    def stats(self):
+        with self._lock:
+            devices = len(self._series)
+        return {
+            "devices": devices,
+            "max_devices": self.max_devices,
+            "bytes_per_device": self.bytes_per_device,
+            "memory_bytes": devices * self.bytes_per_device,
+            "memory_budget": self.memory_budget,
+            "samples": self.samples,
+            "out_of_order": self.out_of_order,
+            "replaced": self.replaced
+        }
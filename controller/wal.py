@@ -0,0 +1,344 @@
+"""控制器的持久化日志：分段、只追加的心跳和事件日志
+
+请求线程只把记录放入内存缓冲区；后台写线程按组提交，把一段时间内的全部记录编码为一个
+帧写入当前段文件，每帧一次 fsync。帧格式为：
+
+    [负载长度 u32][CRC32 u32][记录数 u32] 负载（记录的 msgpack 序列）
+
+每条记录为 [类型, 接收时间, 内容]。段文件写满 segment_bytes 后封存，封存的段累计达到
+snapshot_segments 个时，后台压缩线程把上一个快照和这些段归并为新快照（每个设备的最新心跳、
+最新心跳中没有而之前上报过的 data 字段，以及最近的 event_capacity 个事件），再删除已归并的段。启动时从最新快照开始，通过 mmap
+顺序读取之后的段恢复状态，恢复时间只与快照大小和未归并的段数有关。
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import msgpack
+
+KIND_HEARTBEAT = 1  # 内容为设备的最新心跳记录
+KIND_EVENT = 2  # 内容为事件
+KIND_OFFLINE = 3  # 内容为 [设备ID, 超时处理方式]
+KIND_REPORTS = 4  # 只出现在快照中，内容为 [设备ID, {data 字段: 最近一次上报的值}]，不含最新心跳中已有的字段
+
+_FRAME = struct.Struct('<III')
+_SEGMENT = re.compile(r'^segment-(\d{12})\.log$')
+_SNAPSHOT = re.compile(r'^snapshot-(\d{12})\.msgpack$')
+
+
+def _segment_name(number):
+    return f"segment-{number:012d}.log"
+
+
+def _snapshot_name(number):
+    return f"snapshot-{number:012d}.msgpack"
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _State:
+    """按记录归并出的状态：每个设备的最新心跳、心跳 data 各字段最近一次的值和最近的事件"""
+
+    def __init__(self, event_capacity):
+        self.devices = {}  # device_id -> [接收时间, 心跳记录]
+        self.fields = {}  # device_id -> {data 字段: 最近一次的值}，如只在部分心跳中上报的电量
+        self.events = deque(maxlen=event_capacity)  # [接收时间, 事件]
+
+    def apply(self, kind, t, payload):
+        if kind == KIND_HEARTBEAT:
+            self.devices[payload.get('device_id')] = [t, payload]
+            if isinstance(payload.get('data'), dict):
+                self.fields.setdefault(payload.get('device_id'), {}).update(payload['data'])
+        elif kind == KIND_REPORTS:
+            device_id, fields = payload
+            self.fields.setdefault(device_id, {}).update(fields)
+        elif kind == KIND_EVENT:
+            self.events.append([t, payload])
+        elif kind == KIND_OFFLINE:
+            device_id, policy = payload
+            if policy == 'mark':
+                entry = self.devices.get(device_id)
+                if entry is not None:
+                    entry[1]['status'] = 'offline'
+            else:
+                self.devices.pop(device_id, None)
+                self.fields.pop(device_id, None)
+
+    def reports(self):
+        """[[设备ID, 最新心跳中没有的 data 字段], ...]"""
+        result = []
+        for device_id, (_, record) in self.devices.items():
+            latest = record.get('data') if isinstance(record.get('data'), dict) else {}
+            earlier = {k: v for k, v in self.fields.get(device_id, {}).items() if k not in latest}
+            if earlier:
+                result.append([device_id, earlier])
+        return result
+
+
+class EventLog:
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, flush_interval=0.005, fsync=True,
+                 snapshot_segments=4, event_capacity=1000000, max_batch=10000):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval  # 组提交等待更多记录的时间（秒）
+        self.fsync = fsync
+        self.snapshot_segments = snapshot_segments
+        self.event_capacity = event_capacity
+        self.max_batch = max_batch
+        os.makedirs(directory, exist_ok=True)
+
+        self._buffer = []
+        self._flushed = threading.Event()  # 当前缓冲区写入并同步后置位
+        self._writing = None  # 正在写入的一批记录完成后置位
+        self._cond = threading.Condition()
+        self._closing = False
+        self._writer = None
+        self._file = None
+        self._segment = 0
+        self._segment_size = 0
+        self._compacting = False
+        self._compact_lock = threading.Lock()
+
+        self.records_written = 0
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.fsyncs = 0
+        self.snapshots = 0
+        self.recovered = 0
+        self.recovery_seconds = 0.0
+        self.torn_bytes = 0  # 恢复时截掉的不完整或校验失败的尾部字节数
+
+    # 目录
+
+    def _list(self, pattern):
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # 恢复
+
+    def recover(self):
+        """按顺序生成 (类型, 接收时间, 内容)：先是最新快照中的状态，再是之后各段中的记录"""
+        started = time.perf_counter()
+        count = 0
+        snapshots = self._list(_SNAPSHOT)
+        covered = 0
+        if snapshots:
+            covered = snapshots[-1]
+            for record in self._read_snapshot(covered):
+                count += 1
+                yield record
+        for number in self._list(_SEGMENT):
+            if number <= covered:
+                continue
+            for record in self._read_segment(number, truncate=True):
+                count += 1
+                yield record
+        self.recovered = count
+        self.recovery_seconds = time.perf_counter() - started
+
+    def _read_snapshot(self, number):
+        with open(self._path(_snapshot_name(number)), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                snapshot = msgpack.unpackb(mm, raw=False, strict_map_key=False)
+        # 先于心跳生成，心跳中的字段覆盖之前上报的值；早期的快照没有 reports
+        for report in snapshot.get('reports', []):
+            yield KIND_REPORTS, 0.0, report
+        for t, record in snapshot['devices']:
+            yield KIND_HEARTBEAT, t, record
+        for t, event in snapshot['events']:
+            yield KIND_EVENT, t, event
+
+    def _read_segment(self, number, truncate=False):
+        """逐帧读取段文件，遇到不完整或校验失败的帧时停止（truncate 时截掉该尾部）"""
+        path = self._path(_segment_name(number))
+        size = os.path.getsize(path)
+        if not size:
+            return
+        offset = 0
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    while offset + _FRAME.size <= size:
+                        length, crc, _ = _FRAME.unpack_from(mm, offset)
+                        start = offset + _FRAME.size
+                        if start + length > size or zlib.crc32(view[start:start + length]) != crc:
+                            break
+                        unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+                        unpacker.feed(view[start:start + length])
+                        for kind, t, payload in unpacker:
+                            yield kind, t, payload
+                        offset = start + length
+                finally:
+                    view.release()
+        if offset < size:
+            self.torn_bytes += size - offset
+            if truncate:
+                os.truncate(path, offset)
+
+    # 写入
+
+    def start(self):
+        """在新的段文件上开始写入（恢复之后调用）"""
+        segments = self._list(_SEGMENT)
+        snapshots = self._list(_SNAPSHOT)
+        self._open_segment(max(segments[-1:] + snapshots[-1:] + [0]) + 1)
+        self._writer = threading.Thread(target=self._run)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def append(self, kind, t, payload):
+        """追加一条记录，立即返回，由写线程按组提交"""
+        with self._cond:
+            self._buffer.append((kind, t, payload))
+            if len(self._buffer) == 1 or len(self._buffer) >= self.max_batch:
+                self._cond.notify()
+
+    def sync(self):
+        """等到此前追加的全部记录写入并同步到磁盘"""
+        with self._cond:
+            pending = self._flushed if self._buffer else self._writing
+        if pending is not None:
+            pending.wait()
+
+    def close(self):
+        """写完缓冲区中的记录后关闭"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if self._writer:
+            self._writer.join()
+
+    def _run(self):
+        packer = msgpack.Packer(use_bin_type=True, default=str)
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closing:
+                    self._cond.wait()
+                if self._buffer and len(self._buffer) < self.max_batch and not self._closing:
+                    # 组提交：等待一小段时间，让同一帧包含更多记录
+                    self._cond.wait(self.flush_interval)
+                batch, self._buffer = self._buffer, []
+                flushed, self._flushed = self._flushed, threading.Event()
+                self._writing = flushed
+                closing = self._closing
+            if batch:
+                self._write_frame(packer, batch)
+            flushed.set()
+            if closing and not batch:
+                self._file.close()
+                return
+
+    def _write_frame(self, packer, batch):
+        payload = b''.join(packer.pack(record) for record in batch)
+        self._file.write(_FRAME.pack(len(payload), zlib.crc32(payload), len(batch)))
+        self._file.write(payload)
+        self._file.flush()
+        if self.fsync:
+            os.fdatasync(self._file.fileno())
+            self.fsyncs += 1
+        self.records_written += len(batch)
+        self.frames_written += 1
+        self.bytes_written += _FRAME.size + len(payload)
+        self._segment_size += _FRAME.size + len(payload)
+        if self._segment_size >= self.segment_bytes:
+            self._file.close()
+            self._open_segment(self._segment + 1)
+            self._maybe_compact()
+
+    def _open_segment(self, number):
+        self._segment = number
+        self._segment_size = 0
+        self._file = open(self._path(_segment_name(number)), 'ab', buffering=0)
+        if self.fsync:
+            _fsync_dir(self.directory)
+
+    # 压缩
+
+    def _maybe_compact(self):
+        snapshots = self._list(_SNAPSHOT)
+        covered = snapshots[-1] if snapshots else 0
+        sealed = [n for n in self._list(_SEGMENT) if covered < n < self._segment]
+        if len(sealed) < self.snapshot_segments or self._compacting:
+            return
+        self._compacting = True
+        thread = threading.Thread(target=self.compact, args=(sealed[-1],))
+        thread.daemon = True
+        thread.start()
+
+    def compact(self, through=None):
+        """把最新快照和编号不超过 through 的封存段归并为新快照，删除被归并的文件"""
+        with self._compact_lock:
+            try:
+                snapshots = self._list(_SNAPSHOT)
+                covered = snapshots[-1] if snapshots else 0
+                if through is None:
+                    through = self._segment - 1
+                segments = [n for n in self._list(_SEGMENT) if covered < n <= through]
+                if not segments:
+                    return
+                state = _State(self.event_capacity)
+                if covered:
+                    for record in self._read_snapshot(covered):
+                        state.apply(*record)
+                for number in segments:
+                    for record in self._read_segment(number):
+                        state.apply(*record)
+
+                path = self._path(_snapshot_name(through))
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(msgpack.packb({
+                        "segment": through,
+                        "devices": list(state.devices.values()),
+                        "reports": state.reports(),
+                        "events": list(state.events)
+                    }, use_bin_type=True, default=str))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path + '.tmp', path)
+                _fsync_dir(self.directory)
+                for number in snapshots:
+                    os.remove(self._path(_snapshot_name(number)))
+                for number in self._list(_SEGMENT):
+                    if number <= through:
+                        os.remove(self._path(_segment_name(number)))
+                self.snapshots += 1
+            finally:
+                self._compacting = False
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._buffer)
+        return {
+            "directory": self.directory,
+            "segment": self._segment,
+            "segment_bytes": self._segment_size,
+            "segments": len(self._list(_SEGMENT)),
+            "pending": pending,
+            "records_written": self.records_written,
+            "frames_written": self.frames_written,
+            "bytes_written": self.bytes_written,
+            "fsyncs": self.fsyncs,
+            "snapshots": self.snapshots,
+            "recovered": self.recovered,
+            "recovery_seconds": round(self.recovery_seconds, 3),
+            "torn_bytes": self.torn_bytes
+        }
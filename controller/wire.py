@@ -0,0 +1,60 @@
+import threading
+import zlib
+from datetime import datetime
+
+import msgpack
+
+FORMAT_JSON = "json"
+FORMAT_DELTA = "delta-msgpack"
+CONTENT_TYPE = "application/vnd.heartbeat-delta+msgpack"
+SUPPORTED_FORMATS = [FORMAT_JSON, FORMAT_DELTA]
+
+
+class DeltaDecoder:
+    """解码设备端的差量二进制心跳（格式见 device/wire.py）
+
+    按设备保存最近一次应用的序号和完整状态，差量消息的基准序号与之不符时
+    返回 None，由调用方通知设备重新发送完整快照。
+    """
+
+    def __init__(self):
+        self._states = {}  # device_id -> (序号, 状态)
+        self._lock = threading.Lock()
+
+    def unpack(self, body, content_encoding=None):
+        """解出单条消息或消息列表"""
+        if content_encoding == 'deflate':
+            body = zlib.decompress(body)
+        return msgpack.unpackb(body, raw=False)
+
+    def decode(self, message):
+        """把差量消息还原为标准心跳，需要重新同步时返回 None"""
+        device_id = message.get("i")
+        if not device_id:
+            raise ValueError("缺少设备ID")
+        with self._lock:
+            if "b" in message:
+                previous = self._states.get(device_id)
+                if previous is None or previous[0] != message["b"]:
+                    return None
+                state = dict(previous[1])
+            else:
+                state = {}
+            for key in ("y", "s", "p"):
+                if key in message:
+                    state[key] = message[key]
+            self._states[device_id] = (message["q"], state)
+
+        data = {"current_power_consumption": state.get("p")}
+        data.update(message.get("e") or {})
+        return {
+            "device_identifier": device_id,
+            "device_type": state.get("y"),
+            "timestamp": datetime.fromtimestamp(message["t"]).isoformat(),
+            "status": state.get("s"),
+            "data": data
+        }
+
+    def forget(self, device_id):
+        with self._lock:
+            self._states.pop(device_id, None)
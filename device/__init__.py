@@ -1,4 +1,5 @@
 from .base_device import BaseDevice
 from .devices import Refrigerator, Light, Lock, Camera
+from .fleet import Fleet, parse_device_mix
 
-__all__ = ['BaseDevice', 'Refrigerator', 'Light', 'Lock', 'Camera'] 
\ No newline at end of file
+__all__ = ['BaseDevice', 'Refrigerator', 'Light', 'Lock', 'Camera', 'Fleet', 'parse_device_mix'] 
\ No newline at end of file
@@ -0,0 +1,115 @@
+import heapq
+import json
+import random
+
+from . import http_client
+from .simulation import FleetSimulator
+
+# 心跳 data 中不属于事件的字段
+STATE_FIELDS = {"current_power_consumption", "event_log"}
+
+
+class FileSink:
+    """把心跳和事件按行写入JSON文件"""
+
+    def __init__(self, path):
+        self._file = open(path, 'w', encoding='utf-8')
+        self.heartbeats = 0
+        self.events = 0
+
+    def write(self, heartbeat):
+        self._file.write(json.dumps({"type": "heartbeat", **heartbeat}, ensure_ascii=False))
+        self._file.write('\n')
+        self.heartbeats += 1
+        data = heartbeat["data"]
+        # 同一心跳周期内多次发生的事件按顺序放在 event_log 中
+        events = [(e["event_type"], e["event_data"], e["timestamp"]) for e in data.get("event_log", [])]
+        logged = {event_type for event_type, _, _ in events}
+        events.extend((event_type, event_data, heartbeat["timestamp"])
+                      for event_type, event_data in data.items()
+                      if event_type not in STATE_FIELDS and event_type not in logged)
+        for event_type, event_data, timestamp in events:
+            self._file.write(json.dumps({
+                "type": "event",
+                "device_id": heartbeat["device_identifier"],
+                "device_type": heartbeat.get("device_type"),
+                "event_type": event_type,
+                "event_data": event_data,
+                "timestamp": timestamp
+            }, ensure_ascii=False))
+            self._file.write('\n')
+            self.events += 1
+
+    def close(self):
+        self._file.close()
+
+
+class ControllerSink:
+    """把心跳攒批后发送到控制器的批量心跳接口"""
+
+    def __init__(self, controller_url, batch_size=1000, client=None):
+        self.url = f"{controller_url}/api/v1/devices/heartbeat/batch/"
+        self.batch_size = batch_size
+        self.client = client or http_client.get_client()
+        self._pending = []
+        self.heartbeats = 0
+
+    def write(self, heartbeat):
+        self._pending.append(heartbeat)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.client.post(self.url, self._pending)
+            self.heartbeats += len(self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+
+
+class AcceleratedRun:
+    """基于虚拟时钟的确定性加速模拟
+
+    用事件堆按虚拟时间依次执行各设备的心跳和模拟周期，不做任何真实等待，
+    一天的设备行为以CPU允许的最快速度跑完。相同的种子产生相同的输出。
+    """
+
+    def __init__(self, devices, sink, clock, heartbeat_interval=5, tick_interval=10,
+                 rates=None, seed=0):
+        self.devices = list(devices)
+        self.sink = sink
+        self.clock = clock
+        self.heartbeat_interval = heartbeat_interval
+        self.tick_interval = tick_interval
+        self.rng = random.Random(seed)
+        self.simulator = FleetSimulator(self.devices, rates=rates, seed=seed)
+
+    def run(self, duration):
+        """运行 duration 秒虚拟时间，返回发送的心跳数"""
+        heap = []
+        for i, device in enumerate(self.devices):
+            device.status = "online"
+            # 相位抖动与实时调度器一致
+            heapq.heappush(heap, (self.rng.uniform(0, self.heartbeat_interval), i, device))
+        tick_order = len(self.devices)
+        heapq.heappush(heap, (self.tick_interval, tick_order, None))
+
+        heartbeats = 0
+        start = self.clock.monotonic()
+        end = start + duration
+        while heap and start + heap[0][0] <= end:
+            offset, order, device = heapq.heappop(heap)
+            self.clock.advance_to(start + offset)
+            if device is None:
+                self.simulator.tick()
+                heapq.heappush(heap, (offset + self.tick_interval, order, None))
+                continue
+            self.sink.write(device._build_heartbeat())
+            device.events.commit()
+            heartbeats += 1
+            heapq.heappush(heap, (offset + self.heartbeat_interval, order, device))
+        self.clock.advance_to(end)
+        self.sink.close()
+        return heartbeats
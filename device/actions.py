@@ -0,0 +1,67 @@
+class ActionError(ValueError):
+    """动作不存在或参数不合法"""
+
+
+class Number:
+    """数值参数，可限定范围"""
+
+    def __init__(self, min=None, max=None):
+        self.min = min
+        self.max = max
+
+    def validate(self, name, value):
+        # bool 是 int 的子类，需要单独排除
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ActionError(f"{name}必须是数值")
+        if self.min is not None and value < self.min or self.max is not None and value > self.max:
+            raise ActionError(f"{name}超出范围: {self.min}到{self.max}")
+        return value
+
+
+class OneOf:
+    """取值限定在给定集合中的参数"""
+
+    def __init__(self, *choices):
+        self.choices = choices
+
+    def validate(self, name, value):
+        if value not in self.choices:
+            raise ActionError(f"{name}必须是 {', '.join(map(str, self.choices))} 之一")
+        return value
+
+
+def action(name, **params):
+    """把方法注册为设备动作，params 为参数名到校验器的映射
+
+    校验通过后以关键字参数调用方法，多余的参数被忽略：
+
+        @action("switch", state=OneOf("on", "off"))
+        def switch(self, state): ...
+    """
+    def decorator(method):
+        method._action = (name, params)
+        return method
+    return decorator
+
+
+def compile_actions(cls):
+    """收集类及其父类中注册的动作，返回 动作名 -> (方法名, 参数校验器)"""
+    actions = {}
+    for base in reversed(cls.__mro__):
+        for attr, value in base.__dict__.items():
+            spec = getattr(value, "_action", None)
+            if spec is not None:
+                actions[spec[0]] = (attr, spec[1])
+    return actions
+
+
+def validate_params(action_name, specs, params):
+    """按校验器检查参数，返回传给动作方法的关键字参数"""
+    if not isinstance(params, dict):
+        raise ActionError("params必须是对象")
+    kwargs = {}
+    for name, validator in specs.items():
+        if name not in params or params[name] is None:
+            raise ActionError(f"{action_name}缺少参数: {name}")
+        kwargs[name] = validator.validate(name, params[name])
+    return kwargs
@@ -1,44 +1,99 @@
+import json
 import threading
-import time
-import requests
 import random
-from abc import ABC, abstractmethod
-from datetime import datetime
-from ssdpy import SSDPServer
+import time
+import uuid
+from abc import ABC
+from contextlib import nullcontext
+from operator import attrgetter
+from . import http_client, metrics, resilience, ssdp
+from .clock import get_clock
+from .event_queue import EventQueue
+from .actions import ActionError, compile_actions, validate_params
+
+# 进程启动标识，保证重启后 ETag 不会与重启前的版本号冲突
+_BOOT_ID = uuid.uuid4().hex[:8]
+_MISSING = object()
+
+
+def _compile_state_schema(cls):
+    """把父类和本类声明的 STATE_SCHEMA 合并编译为取值表"""
+    fields = []
+    for base in cls.__mro__[1:]:
+        if "_state_fields" in base.__dict__:
+            fields = list(base._state_fields)
+            break
+    for name in cls.__dict__.get("STATE_SCHEMA", ()):
+        if name.startswith("_"):
+            raise ValueError(f"{cls.__name__}.STATE_SCHEMA 不能包含私有属性: {name}")
+        if name not in fields:
+            fields.append(name)
+    cls._state_fields = tuple(fields)
+    cls._state_getters = {name: attrgetter(name) for name in fields}
+
 
 class BaseDevice(ABC):
+    # 各事件类型的合并策略，未声明的类型只保留最新一次，见 EventQueue
+    EVENT_POLICIES = {}
+    # 每个设备最多缓存的 keep-all 事件数
+    EVENT_QUEUE_SIZE = 256
+    # 可查询的状态字段，子类只需声明新增的字段，定义类时与父类的字段合并编译为取值表
+    STATE_SCHEMA = ("device_id", "device_type", "status", "power", "last_update", "ip_addr", "ip_port", "tags")
+
+    _state_getters = {}  # 字段名 -> 取值函数，由 _compile_state_schema 生成
+    _actions = {}  # 动作名 -> (方法名, 参数校验器)，由 @action 注册
+    _version = 0  # 状态版本号，任一状态字段变化时加一
+    _snapshot_cache = None  # (版本号, 快照, 序列化后的JSON)
+    _recorder = None  # 正在记录轨迹的 TraceRecorder，见 device/trace.py
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _compile_state_schema(cls)
+        cls._actions = compile_actions(cls)
+
     def __init__(self, device_id, device_type, ip_addr="127.0.0.1", ip_port=1900):
         self.device_id = device_id
         self.device_type = device_type
         self.power = 0  # 功耗
         self.status = "offline"  # 设备状态，只支持online/offline/error
-        self.last_update = datetime.now().isoformat()
+        self.last_update = get_clock().now().isoformat()
+        self.tags = ()  # 设备标签，用于按标签广播控制命令
         self._stop_heartbeat = False
         self._heartbeat_thread = None
-        self.events = {}  # 存储设备事件
+        self._heartbeat_scheduler = None
+        self.events = EventQueue(self.EVENT_POLICIES, self.EVENT_QUEUE_SIZE)  # 等待随心跳发送的设备事件
+        self._state_listener = None  # 状态变化回调，添加事件时调用
 
         # SSDP 相关属性
         self.ip_addr = ip_addr
         self.ip_port = ip_port
-        self._ssdp_server = None
-        self._ssdp_thread = None
-        self._stop_ssdp = False
+        self._ssdp_responder = None
 
-    def start_heartbeat(self, controller_url, interval=5):
-        """启动心跳线程"""
+    def start_heartbeat(self, controller_url, interval=5, scheduler=None):
+        """启动心跳，传入 scheduler 时由共享的事件循环调度，否则启动独立线程"""
         # 启动心跳时设备状态改为online
         self.status = "online"
+
+        if scheduler is not None:
+            self._heartbeat_scheduler = scheduler
+            scheduler.add(self, controller_url, interval)
+            return
         
+        policy = resilience.get_resilience()
+        link = policy.link(controller_url)
+
         def _heartbeat():
+            failures = 0
             while not self._stop_heartbeat:
                 try:
-                    self._send_heartbeat(controller_url)
-                    time.sleep(interval)
+                    self._send_heartbeat(controller_url, link)
+                    failures = 0
+                    get_clock().sleep(interval)
                 except Exception as e:
-                    print(f"心跳发送失败: {e}")
-                    # 发送失败时设置状态为error
-                    # self.status = "error"
-                    time.sleep(1)
+                    resilience.failure_log.report(f"心跳发送失败: {e}")
+                    # 按带抖动的指数退避重试，避免控制器恢复时全部设备同时重连
+                    get_clock().sleep(policy.backoff.delay(failures))
+                    failures += 1
 
         self._heartbeat_thread = threading.Thread(target=_heartbeat)
         self._heartbeat_thread.daemon = True
@@ -49,62 +104,41 @@ class BaseDevice(ABC):
         self._stop_heartbeat = True
         # 停止心跳时设备状态改为offline
         self.status = "offline"
+        if self._heartbeat_scheduler:
+            self._heartbeat_scheduler.remove(self)
+            self._heartbeat_scheduler = None
         if self._heartbeat_thread:
             self._heartbeat_thread.join()
 
-    def start_ssdp_service(self, notify_interval=30):
-        """启动 SSDP 广播服务"""
+    def start_ssdp_service(self, location=None, responder=None):
+        """在进程共享的 SSDP 应答器中注册本设备"""
         if not self.ip_addr:
             print("SSDP IP 地址未设置，无法启动 SSDP 服务")
             return
-            
-        # 直接使用服务端点作为 location
-        location_url = f"http://{self.ip_addr}:{self.ip_port}"
-        
-        # 设备类型
-        device_type = f"urn:schemas-example-com:device:{self.device_type}:1"
-        
-        # 创建 SSDP 服务器
-        self._ssdp_server = SSDPServer(
-            usn=f"uuid:{self.device_id}::{device_type}",
-            device_type=device_type,
-            location=location_url,
-            extra_fields={
-                "DEVICE-ID": self.device_id,
-                "DEVICE-IP": self.ip_addr,
-                "DEVICE-PORT": str(self.ip_port),
-                "DEVICE-STATUS": self.status
-            }
-        )
-        
-        def _ssdp_service():
-            """SSDP 服务线程"""
-            print(f"设备 {self.device_id} 开始 SSDP 广播，类型: {self.device_type}，地址: {location_url}")
-            try:
-                self._ssdp_server.serve_forever()
-            except Exception as e:
-                print(f"SSDP 服务异常: {e}")
-                # SSDP服务异常时设置状态为error
-                # self.status = "error"
-        
-        # 在单独线程中启动 SSDP 服务
-        self._ssdp_thread = threading.Thread(target=_ssdp_service)
-        self._ssdp_thread.daemon = True
-        self._ssdp_thread.start()
+
+        # 默认直接使用服务端点作为 location
+        location_url = location or f"http://{self.ip_addr}:{self.ip_port}"
+
+        self._ssdp_responder = responder if responder is not None else ssdp.get_responder()
+        try:
+            self._ssdp_responder.start()
+        except OSError as e:
+            print(f"SSDP 服务异常: {e}")
+            return
+        self._ssdp_responder.register(self, location_url)
 
     def stop_ssdp_service(self):
-        """停止 SSDP 广播服务"""
-        if self._ssdp_server:
-            self._ssdp_server.stopped = True
-            self._ssdp_server.sock.close()
-        if self._ssdp_thread:
-            self._ssdp_thread.join(timeout=1)
-        print(f"设备 {self.device_id} 停止 SSDP 广播")
-
-    def _send_heartbeat(self, controller_url):
-        """发送心跳数据，包含设备事件"""
-        # 生成动态功耗数据
-        current_power = self._get_dynamic_power_consumption()
+        """从 SSDP 应答器中注销本设备"""
+        if self._ssdp_responder:
+            self._ssdp_responder.unregister(self.device_id)
+            self._ssdp_responder = None
+            print(f"设备 {self.device_id} 停止 SSDP 广播")
+
+    def _build_heartbeat(self):
+        """生成心跳数据，包含设备事件"""
+        # 生成动态功耗数据，期间的状态变化（如累计存储）由回放时的心跳重新产生，不写入轨迹
+        with self._trace_muted():
+            current_power = self._get_dynamic_power_consumption()
         
         # 准备数据字段
         data_fields = {
@@ -112,21 +146,54 @@ class BaseDevice(ABC):
         }
         
         # 合并设备特定事件
-        data_fields.update(self.events)
+        data_fields.update(self.events.drain())
         
         # 心跳数据
         heartbeat_data = {
             "device_identifier": self.device_id,
-            "timestamp": datetime.now().isoformat(),
+            "device_type": self.device_type,
+            "timestamp": get_clock().now().isoformat(),
             "status": self.status,  # 只使用online/offline/error三种状态
             "data": data_fields
         }
+        return heartbeat_data
+
+    def _send_heartbeat(self, controller_url, link=None):
+        """发送心跳数据，包含设备事件
+
+        传入 link 时，未送达的心跳连同事件放入其缓冲区，熔断期间不发送请求，
+        恢复后在后台线程中回放缓冲区
+        """
+        heartbeat_data = self._build_heartbeat()
+        if link is not None and not link.allow():
+            link.failed([heartbeat_data], short_circuited=True)
+            self.events.commit()
+            raise RuntimeError("控制器熔断中，心跳已缓存")
+        client = http_client.get_client()
+        started = time.perf_counter()
+        try:
+            response = client.post(f"{controller_url}/api/v1/devices/heartbeat/", heartbeat_data)
+            if response.status_code >= 500:
+                raise RuntimeError(f"控制器返回 {response.status_code}")
+        except Exception:
+            metrics.HEARTBEATS_FAILED.inc()
+            if link is None:
+                # 发送失败，事件留待下次心跳
+                self.events.rollback()
+            else:
+                link.failed([heartbeat_data])
+                self.events.commit()
+            raise
+        metrics.HEARTBEAT_LATENCY_SINGLE.observe(time.perf_counter() - started)
+        metrics.HEARTBEATS_OK.inc()
         
-        print(heartbeat_data)
-        requests.post(f"{controller_url}/api/v1/devices/heartbeat/", json=heartbeat_data)
-        
-        # 清空事件，因为已经发送
-        self.events = {}
+        # 提交事件，因为已经发送
+        self.events.commit()
+        if link is not None and link.succeeded():
+            url = f"{controller_url}/api/v1/devices/heartbeat/batch/"
+            replay = threading.Thread(target=link.replay, args=(lambda batch: client.post(url, batch).ok,))
+            replay.daemon = True
+            replay.start()
 
     def _get_dynamic_power_consumption(self):
         """生成动态功耗数据"""
@@ -135,25 +202,109 @@ class BaseDevice(ABC):
         fluctuation = base_power * random.uniform(-0.1, 0.1)
         return round(base_power + fluctuation, 2)
 
-    def get_info(self, keys):
-        """获取设备信息"""
-        info = {}
-        for key in keys:
-            if hasattr(self, key):
-                info[key] = getattr(self, key)
-        return info
+    @property
+    def event_overflow(self):
+        """因事件队列满而丢弃的事件数"""
+        return self.events.overflow
+
+    def __setattr__(self, name, value):
+        if name in self._state_getters:
+            old = self.__dict__.get(name, _MISSING)
+            if old is _MISSING or old != value:
+                object.__setattr__(self, "_version", self._version + 1)
+                if self._recorder is not None and old is not _MISSING:
+                    self._recorder.state(self, name, value)
+        object.__setattr__(self, name, value)
+
+    @property
+    def version(self):
+        """状态版本号"""
+        return self._version
+
+    @property
+    def etag(self):
+        """当前状态快照的 ETag"""
+        return f'"{_BOOT_ID}-{self.device_id}-{self._version}"'
+
+    def snapshot(self):
+        """全部状态字段的快照，同一版本只生成一次"""
+        return self._cached_snapshot()[1]
+
+    def snapshot_json(self):
+        """序列化后的状态快照，同一版本只序列化一次"""
+        return self._cached_snapshot()[2]
+
+    def _cached_snapshot(self):
+        cache = self._snapshot_cache
+        version = self._version
+        if cache is None or cache[0] != version:
+            snapshot = {name: getter(self) for name, getter in self._state_getters.items()}
+            cache = (version, snapshot, json.dumps(snapshot, ensure_ascii=False))
+            object.__setattr__(self, "_snapshot_cache", cache)
+        return cache
+
+    def get_info(self, keys=None):
+        """获取设备信息，只返回状态字段，keys 为空时返回全部状态"""
+        if not keys:
+            return dict(self.snapshot())
+        getters = self._state_getters
+        return {key: getters[key](self) for key in keys if key in getters}
+
+    @property
+    def actions(self):
+        """设备支持的动作名"""
+        return list(self._actions)
+
+    def prepare(self, action, params):
+        """查表并校验参数，返回 (动作方法, 关键字参数)，不合法时抛出 ActionError"""
+        spec = self._actions.get(action) if isinstance(action, str) else None
+        if spec is None:
+            raise ActionError(f"不支持的动作: {action}")
+        method_name, specs = spec
+        return getattr(self, method_name), validate_params(action, specs, params or {})
+
+    def dispatch(self, action, params):
+        """执行动作，不合法时抛出 ActionError"""
+        method, kwargs = self.prepare(action, params)
+        self.run(action, method, kwargs)
+
+    def run(self, action, method, kwargs):
+        """执行 prepare 返回的动作方法，记录轨迹时记下这次控制命令"""
+        recorder = self._recorder
+        if recorder is None:
+            method(**kwargs)
+            return
+        recorder.control(self, action, kwargs)
+        # 动作方法引起的状态变化和事件在回放控制命令时重新产生
+        with recorder.muted():
+            method(**kwargs)
 
-    @abstractmethod
     def control(self, action, params):
-        """控制设备（需要子类实现）"""
-        pass
+        """控制设备，动作不存在或参数不合法时返回False"""
+        try:
+            self.dispatch(action, params)
+        except ActionError:
+            return False
+        return True
 
     def add_event(self, event_type, event_data):
         """添加事件到事件队列，等待下次心跳发送"""
-        self.events[event_type] = event_data
+        self.last_update = get_clock().now().isoformat()
+        self.events.put(event_type, event_data, self.last_update)
+        if self._recorder is not None:
+            self._recorder.event(self, event_type, event_data)
+        if self._state_listener:
+            self._state_listener(self)
     
+    def _trace_muted(self):
+        recorder = self._recorder
+        return recorder.muted() if recorder is not None else nullcontext()
+
     def shutdown(self):
         """关闭设备，停止所有服务"""
         self.stop_heartbeat()
         self.stop_ssdp_service()
-        print(f"设备 {self.device_id} 已关闭")
\ No newline at end of file
+        print(f"设备 {self.device_id} 已关闭")
+
+
+_compile_state_schema(BaseDevice)
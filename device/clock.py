@@ -0,0 +1,64 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class RealClock:
+    """真实时钟"""
+
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """虚拟时钟：时间只在 advance/sleep 时前进，用于加速和可复现的模拟"""
+
+    def __init__(self, start=None):
+        self.start = start or datetime(2024, 1, 1)
+        self._elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def now(self):
+        return self.start + timedelta(seconds=self._elapsed)
+
+    def time(self):
+        return self.start.timestamp() + self._elapsed
+
+    def monotonic(self):
+        return self._elapsed
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """时间前进 seconds 秒"""
+        with self._lock:
+            self._elapsed += max(0.0, seconds)
+
+    def advance_to(self, elapsed):
+        """时间前进到自起点起的第 elapsed 秒，不会倒退"""
+        with self._lock:
+            self._elapsed = max(self._elapsed, elapsed)
+
+
+_clock = RealClock()
+
+
+def get_clock():
+    """获取进程当前使用的时钟"""
+    return _clock
+
+
+def set_clock(clock):
+    """替换进程使用的时钟，需在创建设备前调用"""
+    global _clock
+    _clock = clock
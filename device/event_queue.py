@@ -0,0 +1,171 @@
+import threading
+
+# 事件合并策略
+KEEP_ALL = "keep-all"  # 保留每一次事件
+KEEP_LATEST = "keep-latest"  # 只保留最新一次
+AGGREGATE = "aggregate"  # 合并为最新值及最小值/最大值/次数
+
+
+def _combine(fn, a, b):
+    """忽略 None 后取 fn(a, b)"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return fn(a, b)
+
+
+class EventQueue:
+    """设备的有界事件队列
+
+    每种事件类型按声明的策略合并：keep-all 按顺序保留全部事件（总数受 maxlen 限制，
+    超出时丢弃最旧的事件并计入 overflow），keep-latest 只保留最新一次，aggregate
+    对指定数值字段统计最小值、最大值和次数。
+
+    心跳发送前 drain() 在锁内一次取出全部待发送事件，发送成功后 commit()，
+    失败时 rollback() 把它们按策略合并回队列头部，发送期间新增的事件不会丢失。
+    """
+
+    def __init__(self, policies=None, maxlen=256):
+        self.policies = policies or {}  # event_type -> 策略，aggregate 为 (AGGREGATE, 字段名)
+        self.maxlen = maxlen
+        self.overflow = 0  # 因队列满而丢弃的事件数
+        self._pending = {}  # event_type -> 合并状态，按首次出现的顺序排列
+        self._log_size = 0  # keep-all 事件总数
+        self._in_flight = None
+        self._lock = threading.Lock()
+
+    def put(self, event_type, event_data, timestamp=None):
+        """添加一个事件"""
+        policy, field = self._policy(event_type)
+        with self._lock:
+            state = self._pending.get(event_type)
+            if policy == KEEP_ALL:
+                if state is None:
+                    state = self._pending[event_type] = []
+                state.append((event_data, timestamp))
+                self._log_size += 1
+                if self._log_size > self.maxlen:
+                    self._drop_oldest()
+            elif policy == AGGREGATE:
+                value = event_data.get(field)
+                if state is None:
+                    self._pending[event_type] = [event_data, value, value, 1]
+                else:
+                    state[0] = event_data
+                    state[1] = _combine(min, state[1], value)
+                    state[2] = _combine(max, state[2], value)
+                    state[3] += 1
+            else:
+                self._pending[event_type] = event_data
+
+    def drain(self):
+        """取出全部待发送事件，返回心跳 data 中的事件字段
+
+        上一次取出但未提交的事件会一并带上。
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._log_size = 0
+            if self._in_flight is not None:
+                pending = self._merge(self._in_flight, pending)
+            self._in_flight = pending
+        return self._payload(pending)
+
+    def commit(self):
+        """心跳发送成功，丢弃已取出的事件"""
+        with self._lock:
+            self._in_flight = None
+
+    def rollback(self):
+        """心跳发送失败，把已取出的事件合并回队列"""
+        with self._lock:
+            if self._in_flight is None:
+                return
+            self._pending = self._merge(self._in_flight, self._pending)
+            self._in_flight = None
+            self._log_size = sum(len(s) for t, s in self._pending.items()
+                                 if self._policy(t)[0] == KEEP_ALL)
+            while self._log_size > self.maxlen:
+                self._drop_oldest()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def depth(self):
+        """待发送的事件数，keep-all 按条计，其它类型每种计一条"""
+        with self._lock:
+            return self._log_size + sum(1 for t in self._pending if self._policy(t)[0] != KEEP_ALL)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending_types": len(self._pending),
+                "pending_log": self._log_size,
+                "in_flight": self._in_flight is not None,
+                "overflow": self.overflow
+            }
+
+    def _policy(self, event_type):
+        policy = self.policies.get(event_type, KEEP_LATEST)
+        if isinstance(policy, tuple):
+            return policy
+        return policy, None
+
+    def _drop_oldest(self):
+        """丢弃最早出现的 keep-all 事件类型中最旧的一条"""
+        for event_type, state in self._pending.items():
+            if self._policy(event_type)[0] == KEEP_ALL and state:
+                state.pop(0)
+                if not state:
+                    del self._pending[event_type]
+                self._log_size -= 1
+                self.overflow += 1
+                return
+
+    def _merge(self, older, newer):
+        """按策略合并两批事件，newer 中的最新值优先"""
+        merged = {}
+        for event_type in list(older) + [t for t in newer if t not in older]:
+            policy, _ = self._policy(event_type)
+            old = older.get(event_type)
+            new = newer.get(event_type)
+            if old is None or new is None:
+                merged[event_type] = new if old is None else old
+            elif policy == KEEP_ALL:
+                merged[event_type] = old + new
+            elif policy == AGGREGATE:
+                merged[event_type] = [
+                    new[0], _combine(min, old[1], new[1]), _combine(max, old[2], new[2]), old[3] + new[3]
+                ]
+            else:
+                merged[event_type] = new
+        return merged
+
+    def _payload(self, pending):
+        """转换为心跳 data 中的事件字段
+
+        每种事件类型的值为最新一次的事件数据；keep-all 类型出现多次时，
+        全部事件按顺序放在 event_log 中；aggregate 类型附加 <字段>_min、<字段>_max 和 count。
+        """
+        data = {}
+        log = []
+        for event_type, state in pending.items():
+            policy, field = self._policy(event_type)
+            if policy == KEEP_ALL:
+                data[event_type] = state[-1][0]
+                if len(state) > 1:
+                    log.extend({"event_type": event_type, "event_data": d, "timestamp": t}
+                               for d, t in state)
+            elif policy == AGGREGATE:
+                event_data, low, high, count = state
+                data[event_type] = dict(event_data)
+                if count > 1:
+                    data[event_type].update({f"{field}_min": low, f"{field}_max": high, "count": count})
+            else:
+                data[event_type] = state
+        if log:
+            log.sort(key=lambda e: e["timestamp"] or "")
+            data["event_log"] = log
+        return data
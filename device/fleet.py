@@ -0,0 +1,100 @@
+import re
+import time
+import uuid
+import resource
+from collections import Counter
+
+_MIX_ITEM = re.compile(r"^\s*(\d+)\s*([A-Za-z_]+)((?:\s*@[\w-]+)*)\s*$")
+
+
+def parse_device_mix(mix, device_mapping):
+    """解析设备组合描述，如 "3000 lights, 1000 locks @front @outdoor, 500 cameras"
+
+    返回 [(设备类型, 数量, 标签), ...]，设备类型为 device_mapping 中的键，
+    标签为该组设备的 @标签 元组，用于按标签广播控制命令
+    """
+    result = []
+    for item in mix.split(','):
+        if not item.strip():
+            continue
+        match = _MIX_ITEM.match(item)
+        if not match:
+            raise ValueError(f"无法解析设备组合: {item.strip()}")
+        count = int(match.group(1))
+        name = match.group(2).lower()
+        # 允许使用复数形式，如 lights、refrigerators
+        if name not in device_mapping and name.endswith('s') and name[:-1] in device_mapping:
+            name = name[:-1]
+        if name not in device_mapping:
+            raise ValueError(f"不支持的设备类型: {match.group(2)}")
+        tags = tuple(tag.strip() for tag in match.group(3).split('@') if tag.strip())
+        result.append((name, count, tags))
+    return result
+
+
+def current_rss():
+    """获取当前进程的常驻内存（字节）"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # 非 Linux 平台退化为峰值常驻内存（Linux 单位为KB）
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Fleet:
+    """在单个进程中托管多个虚拟设备"""
+
+    def __init__(self, device_mapping, ip_addr, ip_port):
+        self.device_mapping = device_mapping
+        self.ip_addr = ip_addr
+        self.ip_port = ip_port
+        self.devices = {}  # device_id -> 设备实例
+        self.startup_seconds = 0.0
+        self.rss_before = 0
+        self.rss_after = 0
+
+    def populate(self, mix, rng=None):
+        """按照设备组合创建设备，并记录启动耗时与内存占用
+
+        传入 random.Random 实例时设备ID由其生成，便于复现
+        """
+        plan = parse_device_mix(mix, self.device_mapping)
+        self.rss_before = current_rss()
+        started = time.perf_counter()
+        for device_type, count, tags in plan:
+            device_class = self.device_mapping[device_type]
+            for _ in range(count):
+                if rng is None:
+                    device_id = str(uuid.uuid4())
+                else:
+                    device_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+                device = device_class(device_id, self.ip_addr, self.ip_port)
+                device.tags = tags
+                self.devices[device.device_id] = device
+        self.startup_seconds = time.perf_counter() - started
+        self.rss_after = current_rss()
+        return self
+
+    def get(self, device_id):
+        return self.devices.get(device_id)
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __len__(self):
+        return len(self.devices)
+
+    def stats(self):
+        """统计设备数量、启动耗时和每设备内存"""
+        count = len(self.devices)
+        device_bytes = max(0, self.rss_after - self.rss_before)
+        return {
+            "device_count": count,
+            "device_types": dict(Counter(d.device_type for d in self.devices.values())),
+            "startup_seconds": round(self.startup_seconds, 3),
+            "rss_bytes": current_rss(),
+            "rss_bytes_per_device": round(device_bytes / count, 1) if count else 0,
+            "event_overflow": sum(d.event_overflow for d in self.devices.values())
+        }
@@ -0,0 +1,296 @@
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+
+from . import http_client
+from . import metrics
+from . import resilience as resilience_policy
+from . import wire
+
+
+class _HeartbeatEntry:
+    """定时堆中的一个设备心跳任务"""
+
+    __slots__ = ('device', 'controller_url', 'interval', 'cancelled', 'failures')
+
+    def __init__(self, device, controller_url, interval):
+        self.device = device
+        self.controller_url = controller_url
+        self.interval = interval
+        self.cancelled = False
+        self.failures = 0  # 连续失败次数，决定下次重试的退避时间
+
+
+class HeartbeatScheduler:
+    """单事件循环心跳调度器
+
+    所有设备的心跳由一个后台线程中的 asyncio 事件循环驱动，
+    使用定时堆按到期时间调度，HTTP 请求为非阻塞并复用共享的连接池，
+    慢控制器只会拖慢自身的请求而不会阻塞其他设备。
+
+    发送失败的心跳放入该控制器的缓冲区，设备按带抖动的指数退避重试；熔断期间不发送请求，
+    恢复后缓冲区按限速分批回放，见 resilience 模块。
+    """
+
+    def __init__(self, client=None, batch_window=0, batch_size=1000,
+                 wire_format=wire.FORMAT_JSON, codec=None, resilience=None):
+        self.resilience = resilience or resilience_policy.get_resilience()
+        # 批量模式：把窗口内到期的心跳合并为每个控制器一个请求，0 表示不合并
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        # 心跳编码：json、delta-msgpack，或 auto 与控制器协商
+        self.wire_format = wire_format
+        self.codec = codec or wire.DeltaCodec()
+        self._formats = {}  # controller_url -> 协商结果
+        self.client = client or http_client.get_client()
+        self._heap = []  # (到期时间, 序号, 心跳任务)
+        self._seq = itertools.count()
+        self._entries = {}  # device_id -> 心跳任务
+        self._tasks = set()
+        self._loop = None
+        self._wakeup = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._stopped = False
+
+    def start(self):
+        """在后台线程中启动事件循环"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run_loop)
+        self._thread.daemon = True
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        """停止调度器"""
+        self._stopped = True
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def add(self, device, controller_url, interval):
+        """注册设备心跳，首次发送时间在一个间隔内随机错开"""
+        self.start()
+        entry = _HeartbeatEntry(device, controller_url, interval)
+        previous = self._entries.get(device.device_id)
+        if previous:
+            previous.cancelled = True
+        self._entries[device.device_id] = entry
+        # 相位抖动：避免大量设备在同一毫秒发送心跳
+        phase = random.uniform(0, interval)
+        self._loop.call_soon_threadsafe(self._schedule_in, entry, phase)
+
+    def remove(self, device):
+        """取消设备心跳（惰性删除，出堆时跳过）"""
+        entry = self._entries.pop(device.device_id, None)
+        if entry:
+            entry.cancelled = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    def _schedule_in(self, entry, delay):
+        self._schedule_at(entry, self._loop.time() + delay)
+
+    def _schedule_at(self, entry, due):
+        if entry.cancelled:
+            return
+        heapq.heappush(self._heap, (due, next(self._seq), entry))
+        # 新任务比当前最早任务更早到期时唤醒主循环
+        if self._heap[0][2] is entry:
+            self._wakeup.set()
+
+    async def _main(self):
+        try:
+            while not self._stopped:
+                now = self._loop.time()
+                heap = self._heap
+                if self.batch_window:
+                    self._dispatch_batches(now)
+                while heap and heap[0][0] <= now:
+                    due, _, entry = heapq.heappop(heap)
+                    if entry.cancelled:
+                        continue
+                    self._spawn(self._fire(entry, due))
+
+                timeout = heap[0][0] - now if heap else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.client.close_async()
+
+    def _spawn(self, coro):
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _dispatch_batches(self, now):
+        """最早的心跳到期后，把窗口内到期的心跳按控制器分组合并发送"""
+        heap = self._heap
+        if not heap or heap[0][0] > now:
+            return
+        horizon = now + self.batch_window
+        groups = {}
+        while heap and heap[0][0] <= horizon:
+            due, _, entry = heapq.heappop(heap)
+            if entry.cancelled:
+                continue
+            groups.setdefault(entry.controller_url, []).append((entry, due))
+        for controller_url, items in groups.items():
+            for start in range(0, len(items), self.batch_size):
+                self._spawn(self._fire_batch(controller_url, items[start:start + self.batch_size]))
+
+    def _schedule_next(self, entry, due):
+        """按固定相位调度下一次心跳，落后时从当前时间重新计算"""
+        next_due = due + entry.interval
+        now = self._loop.time()
+        if next_due < now:
+            next_due = now + entry.interval
+        self._schedule_at(entry, next_due)
+
+    async def _negotiate(self, controller_url):
+        """确定发往该控制器的心跳编码"""
+        if self.wire_format != "auto":
+            return self.wire_format
+        chosen = self._formats.get(controller_url)
+        if chosen:
+            return chosen
+        try:
+            result = await self.client.get_json_async(
+                f"{controller_url}/api/v1/devices/heartbeat/formats/"
+            )
+            formats = result.get("formats", [])
+        except Exception:
+            # 协商失败时本次按JSON发送，下次再试
+            return wire.FORMAT_JSON
+        chosen = wire.FORMAT_DELTA if wire.FORMAT_DELTA in formats else wire.FORMAT_JSON
+        self._formats[controller_url] = chosen
+        return chosen
+
+    async def _post(self, controller_url, path, heartbeats, batch):
+        """发送一个或一批心跳，并记录延迟和成功/失败数"""
+        started = time.perf_counter()
+        try:
+            await self._send(controller_url, path, heartbeats, batch)
+        except Exception:
+            metrics.HEARTBEATS_FAILED.inc(len(heartbeats))
+            raise
+        latency = metrics.HEARTBEAT_LATENCY_BATCH if batch else metrics.HEARTBEAT_LATENCY_SINGLE
+        latency.observe(time.perf_counter() - started)
+        metrics.HEARTBEATS_OK.inc(len(heartbeats))
+
+    async def _send(self, controller_url, path, heartbeats, batch):
+        """按协商的编码发送一个或一批心跳，控制器返回 5xx 时抛出异常"""
+        url = f"{controller_url}{path}"
+        if await self._negotiate(controller_url) != wire.FORMAT_DELTA:
+            status, _ = await self.client.post_async(url, heartbeats if batch else heartbeats[0])
+            if status >= 500:
+                raise RuntimeError(f"控制器返回 {status}")
+            return
+        messages = [self.codec.encode(heartbeat) for heartbeat in heartbeats]
+        body, headers = self.codec.pack(messages if batch else messages[0])
+        status, response = await self.client.post_async(url, data=body, headers=headers)
+        if status >= 300:
+            # 控制器未确认，下次发送完整快照
+            for message in messages:
+                self.codec.reset(message["i"])
+            if status >= 500:
+                raise RuntimeError(f"控制器返回 {status}")
+            return
+        try:
+            resync = json.loads(response).get("resync", [])
+        except (ValueError, AttributeError):
+            resync = []
+        self.codec.ack(messages, resync)
+
+    async def _fire_batch(self, controller_url, items):
+        heartbeats = [entry.device._build_heartbeat() for entry, _ in items]
+        link = self.resilience.link(controller_url)
+        if not link.allow():
+            self._spool(link, items, heartbeats, short_circuited=True)
+            return
+        try:
+            await self._post(controller_url, "/api/v1/devices/heartbeat/batch/", heartbeats, batch=True)
+        except Exception as e:
+            resilience_policy.failure_log.report(f"批量心跳发送失败: {e}")
+            self._spool(link, items, heartbeats)
+            return
+
+        for entry, due in items:
+            # 提交事件，因为已经发送
+            entry.device.events.commit()
+            entry.failures = 0
+            self._schedule_next(entry, due)
+        self._after_success(controller_url, link)
+
+    async def _fire(self, entry, due):
+        device = entry.device
+        heartbeat_data = device._build_heartbeat()
+        link = self.resilience.link(entry.controller_url)
+        if not link.allow():
+            self._spool(link, [(entry, due)], [heartbeat_data], short_circuited=True)
+            return
+        try:
+            await self._post(entry.controller_url, "/api/v1/devices/heartbeat/", [heartbeat_data], batch=False)
+        except Exception as e:
+            resilience_policy.failure_log.report(f"心跳发送失败: {e}")
+            self._spool(link, [(entry, due)], [heartbeat_data])
+            return
+
+        # 提交事件，因为已经发送
+        device.events.commit()
+        entry.failures = 0
+        self._schedule_next(entry, due)
+        self._after_success(entry.controller_url, link)
+
+    def _spool(self, link, items, heartbeats, short_circuited=False):
+        """心跳未送达：连同其中的事件放入缓冲区，各设备按退避时间重试"""
+        link.failed(heartbeats, short_circuited)
+        for entry, _ in items:
+            # 事件已随心跳进入缓冲区
+            entry.device.events.commit()
+            self._schedule_in(entry, self.resilience.backoff.delay(entry.failures))
+            entry.failures += 1
+
+    def _after_success(self, controller_url, link):
+        if link.succeeded():
+            self._spawn(self._replay(controller_url, link))
+
+    async def _replay(self, controller_url, link):
+        """控制器恢复后按限速分批回放缓冲区"""
+        url = f"{controller_url}/api/v1/devices/heartbeat/batch/"
+        while not self._stopped:
+            batch = link.take_batch()
+            if not batch:
+                return
+            try:
+                status, _ = await self.client.post_async(url, batch)
+                ok = status < 300
+            except Exception:
+                ok = False
+            pause = link.replay_done(batch, ok)
+            if not ok:
+                return
+            await asyncio.sleep(pause)
@@ -0,0 +1,173 @@
+import asyncio
+import threading
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HeartbeatClient:
+    """进程内共享的心跳HTTP客户端
+
+    同步（requests）和异步（aiohttp）两条路径都使用有界的长连接池，
+    限制同时在途的请求数，并统计连接池命中/未命中和在途请求数。
+    """
+
+    def __init__(self, pool_size=20, connect_timeout=3, read_timeout=5, max_in_flight=200):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_in_flight = max_in_flight
+
+        self._lock = threading.Lock()
+        self.requests = 0  # 已发送的请求数
+        self.failures = 0  # 失败的请求数
+        self.in_flight = 0  # 当前在途的请求数
+        self._async_hits = 0
+        self._async_misses = 0
+
+        # 同步路径：连接池满时阻塞等待空闲连接，而不是新建连接
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        self._sync_slots = threading.BoundedSemaphore(max_in_flight)
+
+        # 异步路径：在首次使用的事件循环中创建
+        self._async_session = None
+        self._async_slots = None
+
+    def post(self, url, payload):
+        """同步发送JSON请求"""
+        with self._sync_slots:
+            self._begin()
+            ok = False
+            try:
+                response = self._session.post(
+                    url, json=payload, timeout=(self.connect_timeout, self.read_timeout)
+                )
+                ok = True
+                return response
+            finally:
+                self._end(ok)
+
+    async def post_async(self, url, payload=None, data=None, headers=None):
+        """异步发送请求，payload 按JSON发送，data 为已编码的请求体，返回 (状态码, 响应体)"""
+        if self._async_session is None:
+            self._create_async_session()
+        async with self._async_slots:
+            self._begin()
+            ok = False
+            try:
+                async with self._async_session.post(
+                    url, json=payload, data=data, headers=headers
+                ) as response:
+                    body = await response.read()
+                    ok = True
+                    return response.status, body
+            finally:
+                self._end(ok)
+
+    async def get_json_async(self, url):
+        """异步GET请求，返回解析后的JSON"""
+        if self._async_session is None:
+            self._create_async_session()
+        async with self._async_slots:
+            self._begin()
+            ok = False
+            try:
+                async with self._async_session.get(url) as response:
+                    response.raise_for_status()
+                    result = await response.json(content_type=None)
+                    ok = True
+                    return result
+            finally:
+                self._end(ok)
+
+    async def close_async(self):
+        """关闭异步会话（需在创建它的事件循环中调用）"""
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
+
+    def close(self):
+        self._session.close()
+
+    def stats(self):
+        """连接池与在途请求统计"""
+        sync_requests, sync_misses = self._sync_pool_counts()
+        with self._lock:
+            hits = self._async_hits + max(0, sync_requests - sync_misses)
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "pool_size": self.pool_size,
+                "pool_hits": hits,
+                "pool_misses": self._async_misses + sync_misses
+            }
+
+    def _begin(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def _end(self, ok):
+        with self._lock:
+            self.in_flight -= 1
+            if not ok:
+                self.failures += 1
+
+    def _sync_pool_counts(self):
+        """从 urllib3 连接池读取请求数和新建连接数"""
+        total_requests = 0
+        total_connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                total_requests += pool.num_requests
+                total_connections += pool.num_connections
+        return total_requests, total_connections
+
+    def _create_async_session(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_reuseconn.append(self._on_reuse)
+        trace.on_connection_create_end.append(self._on_create)
+        self._async_slots = asyncio.Semaphore(self.max_in_flight)
+        self._async_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            trace_configs=[trace]
+        )
+
+    async def _on_reuse(self, session, context, params):
+        with self._lock:
+            self._async_hits += 1
+
+    async def _on_create(self, session, context, params):
+        with self._lock:
+            self._async_misses += 1
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """设置进程内共享客户端的参数，需在发送第一个心跳前调用"""
+    global _default_client
+    with _default_lock:
+        _default_client = HeartbeatClient(**kwargs)
+    return _default_client
+
+
+def get_client():
+    """获取进程内共享的心跳客户端"""
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = HeartbeatClient()
+    return _default_client
@@ -0,0 +1,122 @@
+"""设备端 Prometheus 指标
+
+热路径上的指标在导入时就绑定好标签（labels() 的结果），调用时只做一次加法或分桶，
+不拼接标签、不分配对象。事件队列深度和 SSDP 计数等状态类指标在抓取时才统计。
+"""
+from collections import Counter as _Tally
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# 心跳请求延迟（秒），批量请求按整批计一次
+_LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+_heartbeat_latency = Histogram(
+    'device_heartbeat_send_seconds', '心跳请求从发出到控制器确认的耗时', ['mode'], buckets=_LATENCY_BUCKETS)
+HEARTBEAT_LATENCY_SINGLE = _heartbeat_latency.labels('single')
+HEARTBEAT_LATENCY_BATCH = _heartbeat_latency.labels('batch')
+
+_heartbeats = Counter('device_heartbeats', '发送的心跳数', ['result'])
+HEARTBEATS_OK = _heartbeats.labels('success')
+HEARTBEATS_FAILED = _heartbeats.labels('failure')
+
+_query_latency = Histogram(
+    'device_query_seconds', '/query 请求的处理耗时', ['mode'], buckets=_LATENCY_BUCKETS)
+QUERY_KEYS = _query_latency.labels('keys')
+QUERY_SNAPSHOT = _query_latency.labels('snapshot')
+QUERY_NOT_MODIFIED = _query_latency.labels('not_modified')
+QUERY_BATCH = _query_latency.labels('batch')
+
+_control_latency = Histogram(
+    'device_control_seconds', '控制命令的处理耗时', ['action'], buckets=_LATENCY_BUCKETS)
+_control_children = {}
+CONTROL_OTHER = _control_latency.labels('other')  # 未注册的动作，避免任意字符串成为标签
+
+
+def bind_actions(device_classes):
+    """为各设备类注册的动作预先绑定控制延迟的标签"""
+    for device_class in device_classes:
+        for action in device_class._actions:
+            if action not in _control_children:
+                _control_children[action] = _control_latency.labels(action)
+
+
+def control_latency(action):
+    """动作对应的控制延迟指标"""
+    return _control_children.get(action, CONTROL_OTHER)
+
+
+class _StateCollector:
+    """抓取时统计事件队列、SSDP 应答器和心跳缓冲区的状态"""
+
+    def __init__(self):
+        self.devices = None  # 返回当前托管设备的函数
+        self.responder = None  # 返回 SSDP 应答器的函数
+        self.resilience = None  # 返回心跳失败处理策略的函数
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        devices = self.devices() if self.devices else []
+        depth = _Tally()
+        overflow = _Tally()
+        status = _Tally()
+        for device in devices:
+            depth[device.device_type] += device.events.depth()
+            overflow[device.device_type] += device.events.overflow
+            status[(device.device_type, device.status)] += 1
+
+        family = GaugeMetricFamily('device_event_queue_depth', '等待随心跳发送的事件数', labels=['device_type'])
+        for device_type, value in depth.items():
+            family.add_metric([device_type], value)
+        yield family
+        family = CounterMetricFamily('device_event_overflow', '因事件队列满而丢弃的事件数', labels=['device_type'])
+        for device_type, value in overflow.items():
+            family.add_metric([device_type], value)
+        yield family
+        family = GaugeMetricFamily('device_hosted', '当前进程托管的设备数', labels=['device_type', 'status'])
+        for (device_type, device_status), value in status.items():
+            family.add_metric([device_type, device_status], value)
+        yield family
+
+        responder = self.responder() if self.responder else None
+        if responder is not None:
+            stats = responder.stats()
+            family = CounterMetricFamily('device_ssdp_packets', 'SSDP 应答器发送的报文数', labels=['kind'])
+            family.add_metric(['response'], stats['responses'])
+            family.add_metric(['notify'], stats['notifications'])
+            yield family
+            yield CounterMetricFamily('device_ssdp_searches', '收到的匹配 M-SEARCH 数', value=stats['searches'])
+            yield GaugeMetricFamily('device_ssdp_registered', 'SSDP 应答器中注册的设备数', value=stats['registered'])
+
+        policy = self.resilience() if self.resilience else None
+        if policy is not None:
+            links = policy.stats()
+            families = [
+                ('device_heartbeat_retries', CounterMetricFamily, '发送失败、稍后重试的心跳数', 'retries'),
+                ('device_heartbeat_short_circuited', CounterMetricFamily, '熔断期间直接缓存的心跳数', 'short_circuited'),
+                ('device_heartbeat_spool_depth', GaugeMetricFamily, '缓冲区中等待回放的心跳数', 'spool_depth'),
+                ('device_heartbeat_spool_dropped', CounterMetricFamily, '因缓冲区满而丢弃的心跳数', 'spool_dropped'),
+                ('device_heartbeat_replayed', CounterMetricFamily, '已回放的心跳数', 'replayed'),
+                ('device_heartbeat_breaker_open', GaugeMetricFamily, '熔断器是否打开（半开也计为1）', None),
+            ]
+            for name, kind, documentation, key in families:
+                family = kind(name, documentation, labels=['controller'])
+                for url, stats in links.items():
+                    family.add_metric([url], stats[key] if key else int(stats['state'] != 'closed'))
+                yield family
+
+
+_collector = _StateCollector()
+REGISTRY.register(_collector)
+
+
+def set_sources(devices=None, responder=None, resilience=None):
+    """设置抓取时使用的设备列表、SSDP 应答器和心跳失败处理策略来源（均为无参函数）"""
+    if devices is not None:
+        _collector.devices = devices
+    if responder is not None:
+        _collector.responder = responder
+    if resilience is not None:
+        _collector.resilience = resilience
@@ -0,0 +1,295 @@
+import random
+import threading
+import time
+from collections import deque
+
+from . import wire
+from .clock import get_clock
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class Backoff:
+    """带完全抖动的指数退避：第 n 次重试等待 uniform(0, min(max_delay, base * factor**n)) 秒
+
+    大量设备同时失败时，重试时间均匀分散在整个退避窗口内，控制器恢复后不会同时重连。
+    """
+
+    def __init__(self, base=1.0, max_delay=60.0, factor=2.0):
+        self.base = base
+        self.max_delay = max_delay
+        self.factor = factor
+
+    def delay(self, attempt):
+        # 指数部分先截断，避免 attempt 很大时溢出
+        ceiling = self.base * self.factor ** min(attempt, 64)
+        return random.uniform(0, min(self.max_delay, ceiling))
+
+
+class CircuitBreaker:
+    """单个控制器地址的熔断器
+
+    连续失败 failure_threshold 次后打开，打开期间不发送请求；reset_timeout 秒后进入半开状态，
+    只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0  # 连续失败次数
+        self.trips = 0  # 打开的次数
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """本次是否可以发送请求"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and get_clock().monotonic() - self._opened_at >= self.reset_timeout:
+                # 半开状态只放行这一个探测请求
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.trips += 1
+                self._opened_at = get_clock().monotonic()
+
+
+def _carries_events(heartbeat):
+    """心跳 data 中除状态字段外是否还有事件"""
+    return any(key not in wire.STATE_FIELDS for key in heartbeat.get("data", ()))
+
+
+class Spool:
+    """有界的内存缓冲区，保存控制器不可用期间未送达的心跳
+
+    超出容量时先丢弃只有状态字段的最旧心跳，全部心跳都带事件时才丢弃带事件的最旧心跳，
+    丢弃数计入 dropped。回放时先取带事件的心跳。
+    """
+
+    def __init__(self, maxlen=10000):
+        self.maxlen = maxlen
+        self.dropped = 0
+        self._events = deque()  # 带事件的心跳
+        self._samples = deque()  # 只有状态字段的心跳
+
+    def extend(self, items):
+        for item in items:
+            (self._events if _carries_events(item) else self._samples).append(item)
+        self._trim()
+
+    def take(self, count):
+        """取出最多 count 个，带事件的心跳优先，各自按时间先后"""
+        items = []
+        for queue in (self._events, self._samples):
+            while queue and len(items) < count:
+                items.append(queue.popleft())
+        return items
+
+    def requeue(self, items):
+        """回放失败，放回各自最旧的一端"""
+        for item in reversed(items):
+            (self._events if _carries_events(item) else self._samples).appendleft(item)
+        self._trim()
+
+    def _trim(self):
+        while len(self) > self.maxlen:
+            (self._samples or self._events).popleft()
+            self.dropped += 1
+
+    def __len__(self):
+        return len(self._events) + len(self._samples)
+
+
+class ControllerLink:
+    """设备进程到一个控制器地址的连接状态：熔断器、缓冲区和回放
+
+    心跳发送失败或被熔断时放入缓冲区（标记 replay），请求恢复成功后由一个调用方按
+    replay_batch 分批、以每秒 replay_rate 个心跳的速率回放到批量心跳接口。
+    """
+
+    def __init__(self, breaker, spool, replay_batch=500, replay_rate=1000):
+        self.breaker = breaker
+        self.spool = spool
+        self.replay_batch = replay_batch
+        self.replay_rate = replay_rate
+        self.retries = 0  # 发送失败、稍后重试的心跳数
+        self.short_circuited = 0  # 熔断期间未发送、直接缓存的心跳数
+        self.replayed = 0  # 已回放的心跳数
+        self._replaying = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        return self.breaker.allow()
+
+    def failed(self, heartbeats, short_circuited=False):
+        """心跳未送达：放入缓冲区，计入熔断器"""
+        for heartbeat in heartbeats:
+            heartbeat["replay"] = True
+        with self._lock:
+            self.spool.extend(heartbeats)
+            if short_circuited:
+                self.short_circuited += len(heartbeats)
+            else:
+                self.retries += len(heartbeats)
+        if not short_circuited:
+            self.breaker.record_failure()
+
+    def succeeded(self):
+        """请求成功，返回调用方是否需要开始回放缓冲区"""
+        self.breaker.record_success()
+        with self._lock:
+            if self._replaying or not self.spool:
+                return False
+            self._replaying = True
+            return True
+
+    def take_batch(self):
+        """取出下一批待回放的心跳，缓冲区为空时结束回放"""
+        with self._lock:
+            batch = self.spool.take(self.replay_batch)
+            if not batch:
+                self._replaying = False
+            return batch
+
+    def replay_done(self, batch, ok):
+        """一批回放完成，失败时放回缓冲区并结束本轮回放，返回等待多少秒再发送下一批"""
+        with self._lock:
+            if ok:
+                self.replayed += len(batch)
+            else:
+                self.spool.requeue(batch)
+                self._replaying = False
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return len(batch) / self.replay_rate if self.replay_rate else 0
+
+    def replay(self, post):
+        """同步回放缓冲区，post(心跳列表) 返回是否成功"""
+        while True:
+            batch = self.take_batch()
+            if not batch:
+                return
+            try:
+                ok = post(batch)
+            except Exception:
+                ok = False
+            pause = self.replay_done(batch, ok)
+            if not ok:
+                return
+            get_clock().sleep(pause)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.breaker.state,
+                "trips": self.breaker.trips,
+                "consecutive_failures": self.breaker.failures,
+                "retries": self.retries,
+                "short_circuited": self.short_circuited,
+                "spool_depth": len(self.spool),
+                "spool_dropped": self.spool.dropped,
+                "replayed": self.replayed,
+                "replaying": self._replaying
+            }
+
+
+class Resilience:
+    """心跳失败处理策略，按控制器地址维护 ControllerLink"""
+
+    def __init__(self, retry_base=1.0, retry_max=60.0, failure_threshold=5, reset_timeout=30.0,
+                 spool_size=10000, replay_batch=500, replay_rate=1000):
+        self.backoff = Backoff(retry_base, retry_max)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.spool_size = spool_size
+        self.replay_batch = replay_batch
+        self.replay_rate = replay_rate
+        self._links = {}
+        self._lock = threading.Lock()
+
+    def link(self, controller_url):
+        link = self._links.get(controller_url)
+        if link is None:
+            with self._lock:
+                link = self._links.get(controller_url)
+                if link is None:
+                    link = self._links[controller_url] = ControllerLink(
+                        CircuitBreaker(self.failure_threshold, self.reset_timeout),
+                        Spool(self.spool_size), self.replay_batch, self.replay_rate
+                    )
+        return link
+
+    def links(self):
+        with self._lock:
+            return dict(self._links)
+
+    def stats(self):
+        return {url: link.stats() for url, link in self.links().items()}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """设置进程内共享的失败处理策略，需在发送第一个心跳前调用"""
+    global _default
+    with _default_lock:
+        _default = Resilience(**kwargs)
+    return _default
+
+
+def get_resilience():
+    """获取进程内共享的失败处理策略"""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = Resilience()
+    return _default
+
+
+class FailureLog:
+    """心跳发送失败的提示：每 interval 秒最多输出一行，期间其余的失败只计数
+
+    失败数已记在 metrics.HEARTBEATS_FAILED 中，控制器不可用时不再每个心跳输出一行。
+    """
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self._next = 0.0
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def report(self, message):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next:
+                self._suppressed += 1
+                return
+            suppressed, self._suppressed = self._suppressed, 0
+            self._next = now + self.interval
+        if suppressed:
+            message = f"{message}（上次提示后另有 {suppressed} 次失败）"
+        print(message)
+
+
+failure_log = FailureLog()
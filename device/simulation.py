@@ -0,0 +1,191 @@
+import threading
+
+import numpy as np
+
+from .devices import Refrigerator, Light, Lock, Camera
+
+# 每个随机行为在每个周期内触发的概率
+DEFAULT_RATES = {
+    "door_toggle": 0.003,  # 冰箱开关门
+    "temperature_drift": 0.003,  # 冰箱温度波动
+    "brightness_change": 0.003,  # 灯调节亮度
+    "lock_toggle": 0.003,  # 门锁锁定/解锁
+    "battery_drain": 0.003,  # 门锁电池消耗
+    "recording_toggle": 0.003,  # 摄像头开始/停止录制
+    "resolution_change": 0.003,  # 摄像头切换分辨率
+}
+
+RESOLUTIONS = ["720p", "1080p", "4k"]
+
+
+def parse_rates(text):
+    """解析行为概率配置，如 "door_toggle=0.01, battery_drain=0.005" """
+    rates = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_RATES:
+            raise ValueError(f"未知的随机行为: {name}")
+        rates[name] = float(value)
+    return rates
+
+
+class FleetSimulator:
+    """设备群随机行为的批量模拟引擎
+
+    按设备类型把模拟用到的状态保存在 NumPy 数组中，每个周期对全部设备做一次向量化随机抽样，
+    只对状态发生变化的设备回写属性并生成事件。设备被 /control 修改时通过事件回调标记为脏，
+    在下一个周期开始时把其属性同步回数组。
+    """
+
+    def __init__(self, devices, rates=None, seed=None):
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.rng = np.random.default_rng(seed)
+
+        self.refrigerators = [d for d in devices if isinstance(d, Refrigerator)]
+        self.lights = [d for d in devices if isinstance(d, Light)]
+        self.locks = [d for d in devices if isinstance(d, Lock)]
+        self.cameras = [d for d in devices if isinstance(d, Camera)]
+
+        self.fridge_temperature = np.zeros(len(self.refrigerators))
+        self.fridge_door = np.zeros(len(self.refrigerators), dtype=bool)
+        self.light_brightness = np.zeros(len(self.lights), dtype=np.int16)
+        self.lock_locked = np.zeros(len(self.locks), dtype=bool)
+        self.lock_battery = np.zeros(len(self.locks))
+        self.camera_recording = np.zeros(len(self.cameras), dtype=bool)
+
+        # 先创建脏标记集合，再挂接状态变化回调
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._tick_thread = None
+        self._positions = {}  # device_id -> (设备列表, 下标)
+        for group in (self.refrigerators, self.lights, self.locks, self.cameras):
+            for i, device in enumerate(group):
+                self._positions[device.device_id] = (group, i)
+                self._load(group, i)
+                device._state_listener = self._mark_dirty
+
+        self.ticks = 0
+        self.events_emitted = 0
+
+    def tick(self):
+        """推进一个周期，返回本周期生成的事件数"""
+        self._sync_dirty()
+        self._tick_thread = threading.get_ident()
+        try:
+            emitted = (self._tick_refrigerators() + self._tick_lights()
+                       + self._tick_locks() + self._tick_cameras())
+        finally:
+            self._tick_thread = None
+        self.ticks += 1
+        self.events_emitted += emitted
+        return emitted
+
+    def _mark_dirty(self, device):
+        # 模拟引擎自身回写产生的事件无需同步
+        if self._tick_thread == threading.get_ident():
+            return
+        with self._dirty_lock:
+            self._dirty.add(device.device_id)
+
+    def _sync_dirty(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        for device_id in dirty:
+            group, i = self._positions[device_id]
+            self._load(group, i)
+
+    def _load(self, group, i):
+        """把设备属性读入数组"""
+        device = group[i]
+        if group is self.refrigerators:
+            self.fridge_temperature[i] = device.temperature
+            self.fridge_door[i] = device.door_open
+        elif group is self.lights:
+            self.light_brightness[i] = device.brightness
+        elif group is self.locks:
+            self.lock_locked[i] = device.locked
+            self.lock_battery[i] = device.battery
+        elif group is self.cameras:
+            self.camera_recording[i] = device.recording
+
+    def _draw(self, count, behavior):
+        """对 count 个设备抽样，返回触发该行为的下标"""
+        return np.flatnonzero(self.rng.random(count) < self.rates[behavior])
+
+    def _tick_refrigerators(self):
+        n = len(self.refrigerators)
+        if not n:
+            return 0
+        # 随机开关冰箱门
+        doors = self._draw(n, "door_toggle")
+        self.fridge_door[doors] ^= True
+        for i in doors.tolist():
+            device = self.refrigerators[i]
+            device.door_open = bool(self.fridge_door[i])
+            device.add_event("door_state_change", {"door_open": device.door_open})
+
+        # 随机温度变化，限制温度范围
+        temps = self._draw(n, "temperature_drift")
+        changed = self.fridge_temperature[temps] + self.rng.uniform(-1, 1, len(temps))
+        self.fridge_temperature[temps] = np.clip(changed, -20, 10)
+        for i in temps.tolist():
+            device = self.refrigerators[i]
+            device.temperature = float(self.fridge_temperature[i])
+            device.add_event("temperature_change", {"temperature": round(device.temperature, 1)})
+        return len(doors) + len(temps)
+
+    def _tick_lights(self):
+        n = len(self.lights)
+        if not n:
+            return 0
+        # 随机调节亮度
+        changes = self._draw(n, "brightness_change")
+        self.light_brightness[changes] = self.rng.integers(0, 101, len(changes))
+        for i in changes.tolist():
+            self.lights[i].control("set_brightness", {"brightness": int(self.light_brightness[i])})
+        return len(changes)
+
+    def _tick_locks(self):
+        n = len(self.locks)
+        if not n:
+            return 0
+        # 随机锁定/解锁，操作本身会消耗电量
+        toggles = self._draw(n, "lock_toggle")
+        self.lock_locked[toggles] ^= True
+        for i in toggles.tolist():
+            device = self.locks[i]
+            device.control("set_lock", {"state": "lock" if self.lock_locked[i] else "unlock"})
+            self.lock_battery[i] = device.battery
+
+        # 随机电池电量变化
+        drains = self._draw(n, "battery_drain")
+        drained = self.lock_battery[drains] - self.rng.uniform(0.1, 0.5, len(drains))
+        self.lock_battery[drains] = np.maximum(0, drained)
+        for i in drains.tolist():
+            device = self.locks[i]
+            device.battery = float(self.lock_battery[i])
+            device.add_event("battery_level", {"battery": round(device.battery, 1)})
+        return 2 * len(toggles) + len(drains)
+
+    def _tick_cameras(self):
+        n = len(self.cameras)
+        if not n:
+            return 0
+        # 随机开始/停止录制
+        toggle_mask = self.rng.random(n) < self.rates["recording_toggle"]
+        toggles = np.flatnonzero(toggle_mask)
+        self.camera_recording[toggles] ^= True
+        for i in toggles.tolist():
+            self.cameras[i].control("set_recording", {"state": "start" if self.camera_recording[i] else "stop"})
+
+        # 随机切换分辨率（与录制切换互斥）
+        resolution_mask = (self.rng.random(n) < self.rates["resolution_change"]) & ~toggle_mask
+        changes = np.flatnonzero(resolution_mask)
+        choices = self.rng.integers(0, len(RESOLUTIONS), len(changes))
+        for i, choice in zip(changes.tolist(), choices.tolist()):
+            self.cameras[i].control("set_resolution", {"resolution": RESOLUTIONS[choice]})
+        return len(toggles) + len(changes)
@@ -0,0 +1,306 @@
+import heapq
+import itertools
+import random
+import socket
+import struct
+import threading
+import time
+
+from ssdpy.constants import ipv4_multicast_ip
+from ssdpy.http_helper import parse_headers
+from ssdpy.protocol import create_notify_payload
+
+ST_ALL = "ssdp:all"
+NTS_ALIVE = b"NTS:ssdp:alive\r\n"
+NTS_BYEBYE = b"NTS:ssdp:byebye\r\n"
+
+
+def device_urn(device_type):
+    """设备类型对应的 SSDP 搜索目标"""
+    return f"urn:schemas-example-com:device:{device_type}:1"
+
+
+class _Entry:
+    """注册表中的一个设备，按当前状态缓存报文"""
+
+    __slots__ = ("device", "nt", "usn", "location", "fields", "_status", "_payload")
+
+    def __init__(self, device, location):
+        self.device = device
+        self.nt = device_urn(device.device_type)
+        self.usn = f"uuid:{device.device_id}::{self.nt}"
+        self.location = location
+        self.fields = {
+            "DEVICE-ID": device.device_id,
+            "DEVICE-IP": device.ip_addr,
+            "DEVICE-PORT": str(device.ip_port)
+        }
+        self._status = None
+        self._payload = None
+
+    def payload(self, host, max_age):
+        """生成 ssdp:alive 报文，DEVICE-STATUS 取设备的当前状态"""
+        status = self.device.status
+        if status != self._status:
+            self._payload = create_notify_payload(
+                host=host, nt=self.nt, usn=self.usn, location=self.location,
+                max_age=max_age, extra_fields={**self.fields, "DEVICE-STATUS": status}
+            )
+            self._status = status
+        return self._payload
+
+
+class SSDPResponder:
+    """进程内共享的 SSDP 应答器
+
+    全部托管设备共用一个组播套接字：注册表按搜索目标建立索引，收到 M-SEARCH 时
+    查表得到匹配的设备，把应答随机分散到 MX 窗口内的时间片中发送；ssdp:alive /
+    ssdp:byebye 通告按批发送，批与批之间留出间隔，避免瞬间发出大量组播报文。
+    """
+
+    def __init__(self, port=1900, max_age=1800, notify_interval=30,
+                 notify_batch=100, batch_spacing=0.05, max_mx=5):
+        self.port = port
+        self.max_age = max_age
+        self.notify_interval = notify_interval  # 周期性 ssdp:alive 通告的间隔（秒）
+        self.notify_batch = notify_batch  # 每批发送的报文数
+        self.batch_spacing = batch_spacing  # 批与批、时间片与时间片之间的间隔（秒）
+        self.max_mx = max_mx
+        self.host = f"{ipv4_multicast_ip}:{port}"
+        self._address = (ipv4_multicast_ip, port)
+
+        self._entries = {}  # device_id -> _Entry
+        self._by_st = {}  # 搜索目标 -> {device_id}
+        self._lock = threading.Lock()
+
+        # 待发送队列：(发送时间, 序号, 目标地址, [报文])
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._notify_tail = None  # 最后一批尚未发送的通告报文列表，新通告先补满这一批
+        self._notify_due = 0.0  # 最后一批通告的发送时间
+
+        self.searches = 0  # 收到的 M-SEARCH 数
+        self.responses = 0  # 已发送的应答数
+        self.notifications = 0  # 已发送的通告数
+
+        self.sock = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def register(self, device, location):
+        """注册设备并在下一批中发送 ssdp:alive"""
+        entry = _Entry(device, location)
+        with self._lock:
+            self._entries[device.device_id] = entry
+            for st in (entry.nt, f"uuid:{device.device_id}"):
+                self._by_st.setdefault(st, set()).add(device.device_id)
+        self._announce([entry], NTS_ALIVE)
+
+    def unregister(self, device_id):
+        """注销设备并发送 ssdp:byebye"""
+        with self._lock:
+            entry = self._entries.pop(device_id, None)
+            if entry is None:
+                return
+            for st in (entry.nt, f"uuid:{device_id}"):
+                ids = self._by_st.get(st)
+                if ids is not None:
+                    ids.discard(device_id)
+                    if not ids:
+                        del self._by_st[st]
+        self._announce([entry], NTS_BYEBYE)
+
+    def match(self, st):
+        """查找与搜索目标匹配的设备"""
+        with self._lock:
+            if st == ST_ALL:
+                return list(self._entries.values())
+            return [self._entries[i] for i in self._by_st.get(st, ())]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def start(self):
+        """打开组播套接字并启动接收、发送和周期通告线程"""
+        if self.sock is not None:
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        mreq = socket.inet_aton(ipv4_multicast_ip) + struct.pack(b"@I", socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.bind(("0.0.0.0", self.port))
+        sock.settimeout(1)
+        self.sock = sock
+        for target in (self._serve, self._send_loop, self._notify_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"SSDP 应答器已启动，端口: {self.port}")
+
+    def stop(self):
+        """对全部设备发送 ssdp:byebye 后停止"""
+        with self._lock:
+            entries = list(self._entries.values())
+        with self._cond:
+            self._queue.clear()
+            self._notify_tail = None
+        self._announce(entries, NTS_BYEBYE)
+        # 等待 byebye 发送完毕
+        deadline = time.monotonic() + len(entries) / self.notify_batch * self.batch_spacing + 1
+        while self._queue and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def stats(self):
+        with self._lock:
+            registered = len(self._entries)
+        with self._cond:
+            queued = sum(len(item[3]) for item in self._queue)
+        return {
+            "registered": registered,
+            "searches": self.searches,
+            "responses": self.responses,
+            "notifications": self.notifications,
+            "queued": queued
+        }
+
+    def _serve(self):
+        """接收 M-SEARCH 请求"""
+        while not self._stopped.is_set():
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if data.startswith(b"M-SEARCH"):
+                self._on_search(data, address)
+
+    def _on_search(self, data, address):
+        try:
+            headers = parse_headers(data)
+        except ValueError:
+            return
+        matched = self.match(headers.get("st", ""))
+        if not matched:
+            return
+        self.searches += 1
+        try:
+            mx = int(headers.get("mx", 1))
+        except ValueError:
+            mx = 1
+        mx = min(max(mx, 0), self.max_mx)
+        payloads = [entry.payload(self.host, self.max_age) for entry in matched]
+        # 每台设备随机落入 MX 窗口内的一个时间片
+        slots = max(1, min(len(payloads), int(mx / self.batch_spacing)))
+        buckets = [[] for _ in range(slots)]
+        for payload in payloads:
+            buckets[random.randrange(slots)].append(payload)
+        now = time.monotonic()
+        width = mx / slots
+        items = [(now + i * width + random.uniform(0, width), address, bucket)
+                 for i, bucket in enumerate(buckets) if bucket]
+        self._enqueue(items)
+
+    def _announce(self, entries, nts):
+        """把通告分批放入发送队列"""
+        if not entries:
+            return
+        payloads = []
+        for entry in entries:
+            payload = entry.payload(self.host, self.max_age)
+            if nts is not NTS_ALIVE:
+                payload = payload.replace(NTS_ALIVE, nts, 1)
+            payloads.append(payload)
+        with self._cond:
+            # 先补满最后一批未发送的通告，其余的在上一批之后按间隔分批排队；
+            # 逐个注册的设备也会合并成批，且不需要扫描发送队列
+            tail = self._notify_tail
+            if tail is not None and len(tail) < self.notify_batch:
+                room = self.notify_batch - len(tail)
+                tail.extend(payloads[:room])
+                payloads = payloads[room:]
+            now = time.monotonic()
+            due = max(now, self._notify_due + self.batch_spacing)
+            for i in range(0, len(payloads), self.notify_batch):
+                batch = payloads[i:i + self.notify_batch]
+                heapq.heappush(self._queue, (due, next(self._seq), self._address, batch))
+                self._notify_tail, self._notify_due = batch, due
+                due += self.batch_spacing
+            self._cond.notify()
+
+    def _enqueue(self, items):
+        with self._cond:
+            for due, address, payloads in items:
+                heapq.heappush(self._queue, (due, next(self._seq), address, payloads))
+            self._cond.notify()
+
+    def _send_loop(self):
+        """按时间顺序发送排队的应答和通告"""
+        while not self._stopped.is_set():
+            with self._cond:
+                while not self._stopped.is_set():
+                    if self._queue:
+                        delay = self._queue[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+                if self._stopped.is_set():
+                    return
+                _, _, address, payloads = heapq.heappop(self._queue)
+                if payloads is self._notify_tail:
+                    self._notify_tail = None
+            sent = 0
+            for payload in payloads:
+                try:
+                    self.sock.sendto(payload, address)
+                    sent += 1
+                except OSError:
+                    # 常见原因：请求来自不在本子网的地址
+                    pass
+            if address == self._address:
+                self.notifications += sent
+            else:
+                self.responses += sent
+
+    def _notify_loop(self):
+        """周期性地对全部设备发送 ssdp:alive"""
+        while not self._stopped.wait(self.notify_interval):
+            with self._lock:
+                entries = list(self._entries.values())
+            self._announce(entries, NTS_ALIVE)
+
+
+_default_responder = None
+_default_lock = threading.Lock()
+
+
+def configure(**kwargs):
+    """设置进程内共享应答器的参数，需在注册第一个设备前调用"""
+    global _default_responder
+    with _default_lock:
+        _default_responder = SSDPResponder(**kwargs)
+    return _default_responder
+
+
+def get_responder():
+    """获取进程内共享的 SSDP 应答器"""
+    global _default_responder
+    if _default_responder is None:
+        with _default_lock:
+            if _default_responder is None:
+                _default_responder = SSDPResponder()
+    return _default_responder
@@ -0,0 +1,262 @@
+import gzip
+import json
+import threading
+from contextlib import contextmanager
+
+from .base_device import BaseDevice
+from .clock import get_clock
+
+TRACE_VERSION = 1
+
+KIND_CONTROL = "c"  # 控制命令：a 动作名, p 参数
+KIND_STATE = "s"  # 状态字段直接变化：f 字段名, v 新值
+KIND_EVENT = "e"  # 直接添加的事件：e 事件类型, v 事件数据
+
+# 标识、连接和生命周期相关的状态字段，不属于设备行为，不记录也不回放
+UNTRACED_FIELDS = frozenset(("device_id", "device_type", "status", "last_update", "ip_addr", "ip_port", "tags"))
+
+
+class TraceError(ValueError):
+    """轨迹文件格式不正确"""
+
+
+def _open(path, mode):
+    """按扩展名打开轨迹文件，.gz 结尾时使用 gzip 压缩"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def traced_fields(device):
+    """设备需要记录和回放的状态字段"""
+    return [name for name in device._state_getters if name not in UNTRACED_FIELDS]
+
+
+class TraceRecorder:
+    """把设备的控制命令和状态变化写入轨迹文件
+
+    轨迹为JSON行文件（.gz 结尾时 gzip 压缩），第一行是文件头，之后每行一条记录，字段使用短键名：
+
+        t 自开始记录起的秒数, d 设备ID, y 设备类型, k 记录类型（c 控制命令, s 状态变化, e 事件）
+
+    控制命令执行期间由动作方法引起的状态变化和事件不单独记录，回放控制命令时会重新产生；
+    心跳生成期间的变化（如摄像头累计存储）同理。开始记录时先为每个设备写一组 t 为0的状态记录。
+    外部采集的真实轨迹只要转换为相同格式即可回放。
+    """
+
+    def __init__(self, path, clock=None):
+        self.path = path
+        self.clock = clock or get_clock()
+        self.records = 0
+        self._file = None
+        self._start = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self, devices=()):
+        """写入文件头和设备的初始状态，并开始记录进程内全部设备"""
+        self._file = _open(self.path, 'w')
+        self._start = self.clock.monotonic()
+        self._file.write(json.dumps({"trace": TRACE_VERSION, "start": self.clock.now().isoformat()}))
+        self._file.write('\n')
+        for device in devices:
+            for name in traced_fields(device):
+                self.state(device, name, getattr(device, name))
+        BaseDevice._recorder = self
+        return self
+
+    def close(self):
+        if BaseDevice._recorder is self:
+            BaseDevice._recorder = None
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @contextmanager
+    def muted(self):
+        """当前线程在此期间的状态变化和事件不写入轨迹"""
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+
+    def control(self, device, action, params):
+        self._write(device, {"k": KIND_CONTROL, "a": action, "p": params})
+
+    def state(self, device, name, value):
+        if name in UNTRACED_FIELDS or getattr(self._local, 'depth', 0):
+            return
+        self._write(device, {"k": KIND_STATE, "f": name, "v": value})
+
+    def event(self, device, event_type, event_data):
+        if getattr(self._local, 'depth', 0):
+            return
+        self._write(device, {"k": KIND_EVENT, "e": event_type, "v": event_data})
+
+    def _write(self, device, record):
+        record = {"t": round(self.clock.monotonic() - self._start, 3),
+                  "d": device.device_id, "y": device.device_type, **record}
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.write('\n')
+            self.records += 1
+
+    def stats(self):
+        return {"path": self.path, "records": self.records, "recording": self._file is not None}
+
+
+def read_trace(path):
+    """逐行读取轨迹，返回 (文件头, 记录迭代器)，不会把整个文件读入内存
+
+    无法解析的行（如进程被杀时写了一半的最后一行）跳过，数量记在文件头的 "malformed" 中。
+    """
+    f = _open(path, 'r')
+    try:
+        header = json.loads(f.readline() or 'null')
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("trace") != TRACE_VERSION:
+        f.close()
+        raise TraceError(f"不是版本 {TRACE_VERSION} 的轨迹文件: {path}")
+    header["malformed"] = 0
+
+    def records():
+        with f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError(line)
+                    record["t"] = float(record["t"])
+                except (ValueError, KeyError, TypeError):
+                    header["malformed"] += 1
+                    continue
+                yield record
+
+    return header, records()
+
+
+class TraceReplayer:
+    """把轨迹流式回放到设备群
+
+    轨迹中的设备第一次出现时映射到同类型的设备群设备，按设备群中的顺序依次分配，轨迹设备多于
+    设备群设备时循环复用；也可以通过 mapping 指定 轨迹设备ID -> 设备群设备ID。speed 为回放倍速，
+    为0时不等待，以最快速度回放。记录按文件顺序逐条读取和执行，内存占用与轨迹大小无关。
+    """
+
+    def __init__(self, path, devices, speed=1.0, loop=False, mapping=None, clock=None):
+        if speed < 0:
+            raise ValueError("speed不能为负数")
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.clock = clock or get_clock()
+        self._devices = {d.device_id: d for d in devices}
+        self._by_type = {}  # 设备类型 -> [设备列表, 下一个分配的下标]
+        for device in devices:
+            self._by_type.setdefault(device.device_type, [[], 0])[0].append(device)
+        self._mapping = {}  # 轨迹设备ID -> 设备群设备，None 表示没有同类型的设备
+        for trace_id, device_id in (mapping or {}).items():
+            self._mapping[trace_id] = self._devices[device_id]
+        self._stopped = threading.Event()
+
+        self.passes = 0
+        self.applied = 0
+        self.failed = 0  # 控制命令不合法或状态字段不存在
+        self.unmapped = 0  # 找不到同类型设备的记录
+        self.malformed = 0
+        self.lag = 0.0  # 最近一条记录相对计划时间的延迟（秒）
+
+    def stop(self):
+        self._stopped.set()
+
+    def target(self, trace_id, device_type):
+        """轨迹设备对应的设备群设备"""
+        if trace_id in self._mapping:
+            return self._mapping[trace_id]
+        device = None
+        group = self._by_type.get(device_type)
+        if group:
+            devices, index = group
+            device = devices[index % len(devices)]
+            group[1] = index + 1
+        self._mapping[trace_id] = device
+        return device
+
+    def mapping(self):
+        return {trace_id: d.device_id for trace_id, d in self._mapping.items() if d is not None}
+
+    def run(self):
+        """回放轨迹，loop 为真时循环回放直到 stop()，返回执行的记录数"""
+        offset = 0.0  # 之前各轮回放的轨迹时长
+        started = self.clock.monotonic()
+        while not self._stopped.is_set():
+            header, records = read_trace(self.path)
+            last = 0.0
+            for record in records:
+                if self._stopped.is_set():
+                    records.close()
+                    break
+                last = record["t"]
+                self._wait(started, offset + last)
+                self._apply(record)
+            self.malformed += header["malformed"]
+            self.passes += 1
+            if not self.loop or last <= 0:
+                break
+            offset += last
+        return self.applied
+
+    def _wait(self, started, at):
+        if not self.speed:
+            return
+        delay = started + at / self.speed - self.clock.monotonic()
+        self.lag = max(0.0, -delay)
+        # 分段等待，便于及时响应 stop()
+        while delay > 0 and not self._stopped.is_set():
+            self.clock.sleep(min(delay, 1.0))
+            delay = started + at / self.speed - self.clock.monotonic()
+
+    def _apply(self, record):
+        device = self.target(record.get("d"), record.get("y"))
+        if device is None:
+            self.unmapped += 1
+            return
+        kind = record.get("k")
+        if kind == KIND_CONTROL:
+            ok = device.control(record.get("a"), record.get("p"))
+        elif kind == KIND_STATE:
+            name = record.get("f")
+            ok = name in device._state_getters and name not in UNTRACED_FIELDS
+            if ok:
+                setattr(device, name, record.get("v"))
+        elif kind == KIND_EVENT:
+            ok = isinstance(record.get("e"), str)
+            if ok:
+                device.add_event(record["e"], record.get("v"))
+        else:
+            ok = False
+        if ok:
+            self.applied += 1
+        else:
+            self.failed += 1
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "speed": self.speed,
+            "passes": self.passes,
+            "applied": self.applied,
+            "failed": self.failed,
+            "unmapped": self.unmapped,
+            "malformed": self.malformed,
+            "mapped_devices": sum(1 for d in self._mapping.values() if d is not None),
+            "lag_seconds": round(self.lag, 3)
+        }
@@ -0,0 +1,96 @@
+import threading
+import zlib
+from datetime import datetime
+
+import msgpack
+
+FORMAT_JSON = "json"
+FORMAT_DELTA = "delta-msgpack"
+CONTENT_TYPE = "application/vnd.heartbeat-delta+msgpack"
+
+# 心跳 data 中随心跳变化的状态字段，其余字段均为事件
+STATE_FIELDS = ("current_power_consumption",)
+
+
+class DeltaCodec:
+    """差量编码的紧凑二进制心跳格式
+
+    每条消息只携带相对于控制器最近确认的状态发生变化的字段，每隔 snapshot_every 次
+    发送一次完整快照。消息为 msgpack 编码，字段使用短键名：
+
+        i 设备ID, q 序号, b 基准序号（缺省表示完整快照）, t 时间戳（epoch秒）,
+        y 设备类型, s 状态, p 当前功耗, e 事件
+
+    控制器找不到对应的基准状态时在响应中返回 resync 列表，设备下一次发送完整快照。
+    """
+
+    def __init__(self, snapshot_every=12, compress=False, compress_threshold=512):
+        self.snapshot_every = snapshot_every
+        self.compress = compress
+        self.compress_threshold = compress_threshold
+        self._acked = {}  # device_id -> (已确认序号, 已确认状态, 距上次快照的消息数)
+        self._seq = {}  # device_id -> 下一个序号
+        self._lock = threading.Lock()
+
+    def encode(self, heartbeat):
+        """把标准心跳转换为差量消息"""
+        device_id = heartbeat["device_identifier"]
+        data = heartbeat["data"]
+        state = {
+            "y": heartbeat.get("device_type"),
+            "s": heartbeat["status"],
+            "p": data.get("current_power_consumption")
+        }
+        with self._lock:
+            seq = self._seq.get(device_id, 0)
+            self._seq[device_id] = seq + 1
+            acked = self._acked.get(device_id)
+
+        timestamp = datetime.fromisoformat(heartbeat["timestamp"]).timestamp()
+        message = {"i": device_id, "q": seq, "t": timestamp}
+        if acked is None or acked[2] + 1 >= self.snapshot_every:
+            message.update(state)
+        else:
+            message["b"] = acked[0]
+            for key, value in state.items():
+                if acked[1].get(key) != value:
+                    message[key] = value
+        events = {k: v for k, v in data.items() if k not in STATE_FIELDS}
+        if events:
+            message["e"] = events
+        return message
+
+    def pack(self, messages):
+        """编码单条消息或消息列表，返回 (请求体, 请求头)"""
+        body = msgpack.packb(messages, use_bin_type=True)
+        headers = {"Content-Type": CONTENT_TYPE}
+        if self.compress and len(body) >= self.compress_threshold:
+            body = zlib.compress(body)
+            headers["Content-Encoding"] = "deflate"
+        return body, headers
+
+    def ack(self, messages, resync=()):
+        """发送成功后记录控制器已确认的状态，resync 中的设备下次发送完整快照"""
+        resync = set(resync)
+        with self._lock:
+            for message in messages:
+                device_id = message["i"]
+                if device_id in resync:
+                    self._acked.pop(device_id, None)
+                    continue
+                previous = self._acked.get(device_id)
+                if "b" in message and previous is not None:
+                    state = dict(previous[1])
+                    since_snapshot = previous[2] + 1
+                else:
+                    state = {}
+                    since_snapshot = 0
+                for key in ("y", "s", "p"):
+                    if key in message:
+                        state[key] = message[key]
+                self._acked[device_id] = (message["q"], state, since_snapshot)
+
+    def reset(self, device_id):
+        """丢弃已确认状态，下次发送完整快照"""
+        with self._lock:
+            self._acked.pop(device_id, None)
@@ -1,68 +1,51 @@
-from ssdpy import SSDPClient
+import sys
 import time
-import requests
 
-def test_ssdp_server(search_target="ssdp:all", timeout=5, retries=2):
-    client = SSDPClient()
+from controller.discovery import Discovery
+
+def test_ssdp_server(search_target="ssdp:all", timeout=5, retries=2, controller_url=None):
+    # 传入 controller_url 时会自动为新发现的设备设置控制器地址
+    discovery = Discovery(controller_url=controller_url)
     print(f"Sending M-SEARCH for '{search_target}'...")
 
-    found_devices = []
-    for i in range(retries):
-        print(f"Attempt {i+1}/{retries}...")
-        # 发送 M-SEARCH 请求，并等待响应
-        devices = client.m_search(search_target, mx=timeout)
-        if devices:
-            found_devices.extend(devices)
-            print(f"Found {len(devices)} devices in this attempt.")
-        time.sleep(1) # 短暂等待，避免发送过快
+    started = time.perf_counter()
+    # 多轮请求同时发出，应答按 USN 去重，新设备立即并行探测 /query
+    discovery.search(search_target, mx=timeout, rounds=retries)
+    discovery.wait_idle(timeout=30)
+    elapsed = time.perf_counter() - started
 
+    found_devices = discovery.devices()
     if not found_devices:
         print(f"No SSDP devices found for '{search_target}'.")
+        discovery.stop()
         return
 
-    print("\n--- Discovered SSDP Devices ---")
-    unique_locations = set() # 用来去重，因为多次搜索可能发现相同的设备
-    for device in found_devices:
-        location = device.get('location')
-        # if location not in unique_locations:
-        unique_locations.add(location)
-        print(f"  Location: {location}")
-        print(f"  Service Type (NT): {device.get('nt')}")
-        print(f"  Unique Service Name (USN): {device.get('usn')}")
-        print(f"  Host: {device.get('host')}")
-        print(f"  NTS: {device.get('nts')}")
-        
+    print(f"\n--- Discovered {len(found_devices)} SSDP Devices in {elapsed:.2f}s ---")
+    for record in found_devices:
+        headers = record.headers
+        print(f"  Location: {record.location}")
+        print(f"  Service Type (NT): {headers.get('nt')}")
+        print(f"  Unique Service Name (USN): {record.usn}")
+        print(f"  Host: {headers.get('host')}")
+        print(f"  NTS: {headers.get('nts')}")
+
         # 读取自定义字段（小写）
-        device_id = device.get('device-id')
-        device_ip = device.get('device-ip')
-        device_port = device.get('device-port')
-        device_status = device.get('device-status')
-        
-        if device_id:
-            print(f"  Device ID: {device_id}")
-        if device_ip:
-            print(f"  Device IP: {device_ip}")
-        if device_port:
-            print(f"  Device Port: {device_port}")
-        if device_status:
-            print(f"  Device Status: {device_status}")
-        
-        # 尝试获取设备描述XML
-        if location:
-            try:
-                print(f"  Fetching device description from: {location}")
-                response = requests.get(location, timeout=2)
-                if response.status_code == 200:
-                    print(f"  Successfully fetched XML. First 200 chars:\n{response.text[:200]}...")
-                else:
-                    print(f"  Failed to fetch XML (Status: {response.status_code})")
-            except requests.exceptions.RequestException as e:
-                print(f"  Error fetching XML: {e}")
+        for field, label in (("device-id", "Device ID"), ("device-ip", "Device IP"),
+                             ("device-port", "Device Port"), ("device-status", "Device Status")):
+            if headers.get(field):
+                print(f"  {label}: {headers[field]}")
+
+        if record.info is not None:
+            print(f"  Query result: {record.info}")
+        elif record.error:
+            print(f"  Error querying device: {record.error}")
         print("-" * 30)
+    print(discovery.stats())
+    discovery.stop()
 
 if __name__ == "__main__":
-    # 示例1: 搜索所有设备
-    test_ssdp_server("ssdp:all")
+    # 示例1: 搜索所有设备，可选参数为控制器地址
+    test_ssdp_server("ssdp:all", controller_url=sys.argv[1] if len(sys.argv) > 1 else None)
 
     # 示例2: 如果你的设备发布了特定的服务类型，可以更精确地搜索
-    # test_ssdp_server("urn:schemas-example-com:device:refrigerator:1")
\ No newline at end of file
+    # test_ssdp_server("urn:schemas-example-com:device:refrigerator:1")